@@ -1,24 +1,90 @@
 import asyncio
 import re
 import json
+import sys
+import time
 import inspect
 import traceback
+from functools import lru_cache
 from abc import abstractmethod
+from collections import deque
+from contextlib import nullcontext
 from datetime import datetime
 from dataclasses import dataclass
 from pathlib import Path
 
 from pydantic import BaseModel, Field
-from typing import AsyncGenerator, Union, Dict, Any, Tuple, List
+from typing import AsyncGenerator, Union, Dict, Any, Tuple, List, Optional
 
-from model import LLM
+from model import LLM, CONTEXT_CONFIG, config
 from prompt.reflect_memory import react_block_reflect_check_completion_prompt, react_block_conclude_success_prompt, \
     react_block_analyse_dilemma_prompt
 from prompt.system_prompt import jarvis_list_fact_prompt, jarvis_confirm_fact_prompt, \
-    jarvis_plan_multi_steps_task_prompt, jarvis_execute_task_step_prompt, jarvis_act_prompt
-from tool import generate_tool_schema, ToolRegistry
+    jarvis_plan_multi_steps_task_prompt, jarvis_fused_plan_prompt, jarvis_plan_draft_prompt, jarvis_execute_task_step_prompt, \
+    jarvis_act_prompt
+from tool import ToolRegistry
 from log import AgentLogger, LogLevel
-from utils import extract_json_codeblock, remove_browser_info_in_the_history
+from memory_index import MemoryIndex, MemoryEntry
+from plan_library import PlanLibrary
+from context import ContextManager, estimate_tokens
+from session import bind_browser, bind_shell, current_browser
+from shell import ShellSession
+from utils import extract_json_codeblock
+
+TOOL_CALL_PATTERN = re.compile(r'<tool_call>\s*({.*?})\s*</tool_call>', re.DOTALL)
+# 同一回复中并发执行的只读工具调用数上限
+MAX_PARALLEL_TOOLS = config.get("tools", {}).get("max_parallel", 4)
+AGENT_CONFIG = config.get("agent", {})
+PLAN_LIBRARY_CONFIG = AGENT_CONFIG.get("plan_library", {})
+MEMORY_CONFIG = config.get("memory", {})
+TOOL_GROUP_CONFIG = config.get("tools", {}).get("groups", {})
+
+
+@lru_cache(maxsize=None)
+def tool_group_pattern(group: str) -> re.Pattern:
+    """
+    匹配工具组名或其任意一个关键词，英文关键词必须是完整的单词（"url"不匹配"curl"），中文关键词按子串匹配
+    """
+    keywords = [group, *TOOL_GROUP_CONFIG.get(group, {}).get("keywords", [])]
+    alternatives = "|".join(re.escape(keyword) for keyword in sorted(keywords, key=len, reverse=True))
+    return re.compile(rf"(?<![A-Za-z0-9_])(?:{alternatives})(?![A-Za-z0-9_])", re.IGNORECASE)
+PLANNING_MODES = ("sequential", "fused")
+# fused规划模式下回复中各部分的标题，与jarvis_fused_plan_prompt中的模板一致
+UNKNOWN_FACTS_HEADING = "* 还需要去确认的事实有"
+PLAN_HEADING = "* 任务方案"
+
+
+def tool_call_stream_end(text: str) -> Optional[int]:
+    """
+    流式生成时判断回复是否已经可以结束：最后一个完整的工具调用之后出现了非工具调用的内容时，返回该工具调用的结束位置
+    工具调用之后只有空白，或者紧接着开始了下一个工具调用时，返回None继续生成
+    """
+    last = None
+    for last in TOOL_CALL_PATTERN.finditer(text):
+        pass
+    if last is None:
+        return None
+    rest = text[last.end():].lstrip()
+    if not rest or rest.startswith("<tool_call>") or "<tool_call>".startswith(rest):
+        return None
+    return last.end()
+
+
+def split_fused_plan(text: str) -> Tuple[str, str, Dict[str, Any]]:
+    """
+    将fused规划模式的回复拆分为已知事实、待确认事实和任务方案
+    回复中缺少待确认事实的标题时其为空字符串，缺少合法的JSON任务方案时返回空字典
+    """
+    plan = extract_json_codeblock(text)
+    plan_start = text.find(PLAN_HEADING)
+    if plan_start < 0:
+        plan_start = text.find("```json")
+    facts = text if plan_start < 0 else text[:plan_start]
+    unknown_start = facts.find(UNKNOWN_FACTS_HEADING)
+    if unknown_start < 0:
+        return facts.strip(), "", plan
+    return facts[:unknown_start].strip(), facts[unknown_start:].strip(), plan
+
 
 @dataclass
 class ToolCallParseResult:
@@ -36,20 +102,51 @@ class BaseAgent:
         self.llm = LLM(init_model_name)
 
         self.tool_registrar = ToolRegistry()
-        self.tool_registrar.load_tools(tools_folder="toolbox")
+        # 工具清单中记录了各模块的工具与schema，模块源码未变化时工具在第一次调用时才导入
+        self.tool_registrar.load_tools(tools_folder="toolbox",
+                                       manifest_path=config.get("tools", {}).get("manifest") or None)
 
         self.history = []
         self.total_steps = 0
         self.sys_prompt_template = sys_prompt_template
+        # agent独占的浏览器（如BrowserPool分配的上下文），为None时使用外部绑定的或默认的浏览器
+        self.browser = None
+        # agent独占的持久shell会话，工作目录与环境变量在多次run_cmd之间保持
+        self.shell = ShellSession()
+        # 开始运行（规划阶段）时就在后台启动浏览器，而不是等到第一次调用浏览器工具
+        self.prewarm_browser = config.get("browser", {}).get("prewarm", False)
+
+        self.context_manager = ContextManager(
+            **{k: v for k, v in CONTEXT_CONFIG.items() if k != "default_budget"}
+        )
 
     def render_tool_schema_texts(self) -> str:
         tool_schemas = []
-        for tool_name, tool_func in self.tool_registrar.tools.items():
-            tool_schemas.append(generate_tool_schema(tool_func))
+        for tool_name in self.tool_registrar.tools:
+            tool_schemas.append(self.tool_registrar.tool_schema(tool_name))
 
         tools_schema_texts = "\n".join(tool_schemas)
         return tools_schema_texts
 
+    def with_runtime(self, prompt: str, step_state: str = None) -> str:
+        """在本次请求的prompt末尾附加易变的运行时信息，默认不附加，子类可按需覆盖"""
+        return prompt
+
+    def prune_history(self, prompt: str) -> None:
+        """在发起请求前按当前模型的token预算修剪历史记录，为本次的prompt预留空间"""
+        budget = self.llm.context_budget
+        if budget is not None:
+            budget -= self.context_manager.count_text(prompt)
+        report = self.context_manager.enforce(self.history, budget)
+        if report["snapshot_rewritten"] and (browser := self.resolve_browser()) is not None:
+            browser.state_tracker.reset()
+        if report["compacted"] or report["truncated"] or report["evicted"]:
+            self.logger.log_task(
+                f"历史记录token数：{report['before']} -> {report['after']}，移除 {report['removed']}\n"
+                f"压缩浏览器状态 {report['compacted']} 条，截断 {report['truncated']} 条，移除 {report['evicted']} 条",
+                subtitle="PRUNING······", title="Prune history"
+            )
+
     def save_trajectory(self, output_path="outputs/trajectory.json"):
         path = Path(output_path)
         path.parent.mkdir(parents=True, exist_ok=True)
@@ -93,7 +190,8 @@ class BaseAgent:
             self.llm = LLM(llm_name)
 
         ai_response = ""
-        async for chunk in self.llm.async_stream_generate(prompt, history=self.history):
+        async for chunk in self.llm.async_stream_generate(self.with_runtime(prompt), history=self.history,
+                                                       track_stability=True):
             ai_response += chunk
             print(chunk, end="", flush=True)
         self.history.extend([
@@ -142,40 +240,149 @@ class BaseAgent:
         ai_response: str
     ) -> ToolCallParseResult:
         """
-        解析LLM的输出文本，判断其中是否有工具调用格式，提取工具名称和参数。
+        解析LLM的输出文本，判断其中是否有工具调用格式，提取第一个工具调用的工具名称和参数。
         """
-        # AGENT_LOGGER.log_task(llm_output_text, subtitle="ROUTING······", title="Parsing LLM output text")
-        match = re.search(r'<tool_call>\s*({.*?})\s*</tool_call>', ai_response, re.DOTALL)
-        if not match:
+        results = self.parse_tool_calls(ai_response)
+        if not results:
             return ToolCallParseResult(False, None, "No tool call found in the llm output text.")
-        else:
-            # 将工具调用文本转换为dict
-            tool_call_text = match.group(1).strip()
-            try:
-                tool_call_json = json.loads(tool_call_text)
-            except json.JSONDecodeError as e:
-                return ToolCallParseResult(True, None, f"Error decoding TOOL JSON: {e}")
-
-            # 提取工具名以及填入参数
-            tool_name = tool_call_json.get('name')
-            arguments = tool_call_json.get('arguments')
-            if tool_name is None:
-                return ToolCallParseResult(True, None, "Tool call JSON does not contain key: 'name'")
-            if arguments is None:
-                return ToolCallParseResult(True, None, "Tool call JSON does not contain key: 'arguments'")
-
-            return ToolCallParseResult(
-                True,
-                {"tool_name": tool_name, "arguments": arguments},
-                "Successfully extract tool call JSON"
-            )
+        return results[0]
+
+    def parse_tool_calls(
+        self,
+        ai_response: str
+    ) -> List[ToolCallParseResult]:
+        """
+        按出现顺序解析LLM输出文本中的所有工具调用，没有工具调用时返回空列表
+        """
+        return [self._parse_tool_call_text(match.group(1).strip()) for match in TOOL_CALL_PATTERN.finditer(ai_response)]
+
+    @staticmethod
+    def _parse_tool_call_text(tool_call_text: str) -> ToolCallParseResult:
+        # 将工具调用文本转换为dict
+        try:
+            tool_call_json = json.loads(tool_call_text)
+        except json.JSONDecodeError as e:
+            return ToolCallParseResult(True, None, f"Error decoding TOOL JSON: {e}")
+
+        # 提取工具名以及填入参数
+        tool_name = tool_call_json.get('name')
+        arguments = tool_call_json.get('arguments')
+        if tool_name is None:
+            return ToolCallParseResult(True, None, "Tool call JSON does not contain key: 'name'")
+        if arguments is None:
+            return ToolCallParseResult(True, None, "Tool call JSON does not contain key: 'arguments'")
+
+        return ToolCallParseResult(
+            True,
+            {"tool_name": tool_name, "arguments": arguments},
+            "Successfully extract tool call JSON"
+        )
+
+    async def call_tools(
+        self,
+        parse_results: List[ToolCallParseResult]
+    ) -> AsyncGenerator[tuple, None]:
+        """
+        按顺序执行一次回复中的所有工具调用，以(status, chunk)的形式流式返回，最后返回("[DONE]", 合并后的观测)
 
-    async def run(self, prompt: str, llm_name: str = None, step_limit: int = None) -> None:
+        - 相邻的只读工具调用并发执行，并发数不超过MAX_PARALLEL_TOOLS，全部完成后按调用顺序输出
+        - 其余工具调用（如会改变页面的浏览器操作）逐个串行执行
+        - 只有一个工具调用时，观测与单独调用call_tool完全相同
+        """
+        results: List[str] = [""] * len(parse_results)
+        semaphore = asyncio.Semaphore(MAX_PARALLEL_TOOLS)
+
+        async def run_quietly(tool_json: dict) -> str:
+            async with semaphore:
+                async for status, chunk in self.call_tool(**tool_json):
+                    if status == "[DONE]":
+                        return chunk
+            return ""
+
+        i = 0
+        while i < len(parse_results):
+            tool_json = parse_results[i].tool_json
+            if tool_json is None:
+                results[i] = f"<tool_response>\n工具调用解析失败：{parse_results[i].parse_msg}\n</tool_response>"
+                i += 1
+                continue
+
+            if not self.tool_registrar.is_read_only(tool_json["tool_name"]):
+                async for status, chunk in self.call_tool(**tool_json):
+                    if status == "[DONE]":
+                        results[i] = chunk
+                    else:
+                        yield status, chunk
+                i += 1
+                continue
+
+            # 收集相邻的只读工具调用并发执行
+            group = []
+            while (
+                i < len(parse_results) and parse_results[i].tool_json is not None
+                and self.tool_registrar.is_read_only(parse_results[i].tool_json["tool_name"])
+            ):
+                group.append(i)
+                i += 1
+            if len(group) > 1:
+                self.logger.log_task(f"Running {len(group)} read-only tool calls concurrently",
+                                     subtitle="CALLING······", title="Parallel Tool Calls")
+            outputs = await asyncio.gather(*(run_quietly(parse_results[j].tool_json) for j in group))
+            for j, output in zip(group, outputs):
+                results[j] = output
+                yield "[STREAMING]", output
+
+        if len(results) == 1:
+            yield "[DONE]", results[0]
+            return
+        yield "[DONE]", "\n".join(
+            f"第{i + 1}个工具调用（{result.tool_json['tool_name'] if result.tool_json else '解析失败'}）的结果：\n{output}"
+            for i, (result, output) in enumerate(zip(parse_results, results))
+        )
+
+    def stream_action(self, prompt: str) -> AsyncGenerator[str, None]:
+        """
+        流式请求下一步行动，识别到完整的工具调用后立即停止生成；模型支持停止序列时直接以</tool_call>作为停止序列
+        """
+        if self.llm.tool_call_stop:
+            return self._stream_with_stop_sequence(prompt)
+        return self.llm.async_stream_generate(prompt, history=self.history, stop_at=tool_call_stream_end,
+                                              track_stability=True)
+
+    async def _stream_with_stop_sequence(self, prompt: str) -> AsyncGenerator[str, None]:
+        response = ""
+        async for chunk in self.llm.async_stream_generate(prompt, history=self.history, stop=["</tool_call>"],
+                                                       track_stability=True):
+            response += chunk
+            yield chunk
+        # 停止序列本身不会被返回，补全被截断的工具调用结束标签
+        if response.count("<tool_call>") > response.count("</tool_call>"):
+            yield "</tool_call>"
+
+    async def run(self, prompt: str, llm_name: str = None, step_limit: int = None, echo: bool = True) -> None:
+        """运行任务，echo为False时不向标准输出打印生成内容（例如同一进程中并发运行多个agent时）"""
         if llm_name is not None:
             self.llm = LLM(llm_name)
 
-        async for chunk in self._run(prompt, step_limit):
-            print(chunk, end="", flush=True)
+        with bind_browser(self.browser) if self.browser is not None else nullcontext(), bind_shell(self.shell):
+            # 不预热时，浏览器模块（及其依赖）在第一次调用浏览器工具时才导入
+            preload = self.browser is not None or self.prewarm_browser or "browser" in sys.modules
+            browser = self.resolve_browser() if preload else None
+            if browser is not None:
+                browser.mark_startup()
+                if self.prewarm_browser:
+                    browser.prewarm()
+            async for chunk in self._run(prompt, step_limit):
+                if echo:
+                    print(chunk, end="", flush=True)
+
+    def resolve_browser(self):
+        """本agent运行时浏览器工具使用的浏览器，浏览器工具不可用时返回None"""
+        try:
+            from browser import default_browser
+        except ImportError:
+            return None
+        return self.browser or current_browser() or default_browser()
 
     @abstractmethod
     async def _run(self, prompt: str, step_limit: int) -> AsyncGenerator[str, None]:
@@ -186,10 +393,32 @@ class BaseAgent:
 class JarvisAgent(BaseAgent):
     """
     jarvis后端agent代理
+
+    context_layout:
+    - dynamic: 当前时间等易变信息直接写入system prompt，每一步都会重建history[0]
+    - stable: system prompt只包含系统记忆和工具描述，保持字节级稳定以命中服务端的prompt cache，
+      当前时间、temp_memory以及步骤状态放在每次请求末尾的<runtime>中，且不写入历史记录
     """
-    def __init__(self, init_model_name: str, sys_prompt_template: str, memory_dir: str):
+    def __init__(self, init_model_name: str, sys_prompt_template: str, memory_dir: str, context_layout: str = "dynamic",
+                 planning_mode: str = None):
         super().__init__(init_model_name, sys_prompt_template)
 
+        if context_layout not in ("dynamic", "stable"):
+            raise ValueError(f"Unknown context layout '{context_layout}', expected 'dynamic' or 'stable'")
+        self.context_layout = context_layout
+        planning_mode = planning_mode or AGENT_CONFIG.get("planning_mode", "sequential")
+        if planning_mode not in PLANNING_MODES:
+            raise ValueError(f"Unknown planning mode '{planning_mode}', expected one of {PLANNING_MODES}")
+        self.planning_mode = planning_mode
+        # 最近一次任务规划的耗时与用量，用于比较不同规划方式
+        self.planning_stats: Dict[str, Any] = {}
+        # 反思阶段与完成度检查同时推测执行困境分析，最近的检查结果中未完成的比例不低于阈值时才推测
+        self.speculative_dilemma: bool = AGENT_CONFIG.get("speculative_dilemma", False)
+        self.speculation_threshold: float = AGENT_CONFIG.get("speculation_threshold", 0.0)
+        self.recent_step_failures = deque(maxlen=AGENT_CONFIG.get("speculation_window", 10))
+        self.speculation_stats = {"checks": 0, "started": 0, "used": 0, "cancelled": 0,
+                                  "wasted_tokens": 0, "saved_seconds": 0.0}
+
         self.memory_dir = Path(memory_dir)
         self.tool_enhance_dict: Dict[str, Any] = self.load_memory(self.memory_dir / "tool_memory.json")
         self.logger.log_task(str(self.tool_enhance_dict), subtitle="LOADING······", title="Load tool memory")
@@ -203,32 +432,119 @@ class JarvisAgent(BaseAgent):
         self.system_memory = (f"<原则和方法论>{self.methodology_memory}</原则和方法论>\n"
                               f"<特定平台和应用中的注意事项、障碍及其解决方法>{self.application_memory}</特定平台和应用中的注意事项、障碍及其解决方法>\n")
         self.logger.log_task(self.system_memory, subtitle="LOADING······", title="Load system memory")
+        # 开启检索时，system prompt中只注入与任务相关的记忆条目，与当前任务步骤相关的其余条目随每次请求注入
+        self.memory_index = MemoryIndex({
+            "原则和方法论": self.memory_dir / "methodology_memory.txt",
+            "特定平台和应用中的注意事项、障碍及其解决方法": self.memory_dir / "application_memory.txt",
+        }) if MEMORY_CONFIG.get("retrieval", False) else None
+        self.task_memory: List[MemoryEntry] = []
+        self.step_memory: str = ""
+        self.memory_stats = {"requests": 0, "full_tokens": 0, "injected_tokens": 0, "saved_tokens": 0}
 
         self.multi_steps_plan = None
+        # 记录历史任务的方案与结果，新任务与成功的历史任务足够相似时复用其方案或将其作为草稿
+        self.plan_library = PlanLibrary(self.memory_dir / PLAN_LIBRARY_CONFIG.get("file", "plan_library.jsonl")) \
+            if PLAN_LIBRARY_CONFIG.get("enabled", True) else None
+
+        # 按任务步骤只提供相关工具组的工具，各工具子集的描述渲染后缓存，同一子集在不同步骤中保持字节级一致
+        self.tool_subset_cache: Dict[Optional[Tuple[str, ...]], str] = {}
+        # 当前提供给模型的工具组，None表示全部工具
+        self.active_tool_groups: Optional[Tuple[str, ...]] = None
+        self.tool_registrar.register_tool("request_tools", self.request_tools)
 
         self.tool_schema_texts = self.render_tool_schema_texts()
         # system prompt永远在历史记录的最前面
         # TODO: 思考为prompt template写类型检查的方法
-        self.history.append({"role": "system", "content": [{"type": "text", "text": self.sys_prompt_template.format(
-            now=datetime.now(),
-            knowledge=self.system_memory,
+        self.history.append(self.render_system_message(self.system_memory))
+
+    def render_system_message(self, knowledge: str) -> dict:
+        # stable布局下不在system prompt中写入当前时间，保证前缀不变
+        now = datetime.now() if self.context_layout == "dynamic" else "见最新一条用户消息末尾的<runtime>"
+        return {"role": "system", "content": [{"type": "text", "text": self.sys_prompt_template.format(
+            now=now,
+            knowledge=knowledge,
             tools=self.tool_schema_texts
-        )}]})
+        )}]}
+
+    def with_runtime(self, prompt: str, step_state: str = None) -> str:
+        """stable布局下，在本次请求的prompt末尾附加易变信息；dynamic布局下原样返回"""
+        if self.context_layout == "dynamic":
+            return prompt
+
+        runtime = [f"current time: {datetime.now()}"]
+        if step_state:
+            runtime.append(f"当前任务步骤状态：{step_state}")
+        if self.temp_memory:
+            runtime.append(self.temp_memory)
+        if self.step_memory:
+            runtime.append(self.step_memory)
+        return prompt + "\n\n<runtime>\n" + "\n".join(runtime) + "\n</runtime>"
+
+    def render_tool_schema_texts(self, groups: Tuple[str, ...] = None) -> str:
+        """渲染groups中工具组的工具描述（groups为None时为全部工具），同一工具子集只渲染一次"""
+        if groups in self.tool_subset_cache:
+            return self.tool_subset_cache[groups]
 
-    def render_tool_schema_texts(self) -> str:
         tool_schemas = []
-        for tool_name, tool_func in self.tool_registrar.tools.items():
+        for tool_name in self.tool_registrar.tool_names(groups):
             # 补充对tool memory的加载
             if tool_name in self.tool_enhance_dict:
                 tool_schemas.append(
-                    generate_tool_schema(tool_func, self.tool_enhance_dict[tool_name]["tool_description"]))
+                    self.tool_registrar.tool_schema(tool_name, self.tool_enhance_dict[tool_name]["tool_description"]))
+            elif tool_name == "request_tools":
+                tool_schemas.append(self.tool_registrar.tool_schema(tool_name, self.describe_tool_groups()))
             else:
-                tool_schemas.append(generate_tool_schema(tool_func))
+                tool_schemas.append(self.tool_registrar.tool_schema(tool_name))
 
         tools_schema_texts = "\n".join(tool_schemas)
-        self.logger.log_task(tools_schema_texts, subtitle="LOADING······", title="Loading Tools")
+        self.tool_subset_cache[groups] = tools_schema_texts
+        self.logger.log_task(tools_schema_texts, subtitle="LOADING······", title=f"Loading Tools: {', '.join(groups or ['all'])}")
         return tools_schema_texts
 
+    def describe_tool_groups(self) -> str:
+        lines = [f"- {group}: {TOOL_GROUP_CONFIG.get(group, {}).get('description', '')}"
+                 for group in self.tool_registrar.groups()]
+        return ("当前提供的工具不足以完成任务步骤时，请求其他工具组的工具，之后的请求中会在工具列表中提供这些工具。可请求的工具组有：\n"
+                + "\n".join(lines))
+
+    def select_tool_groups(self, task_step: str) -> Optional[Tuple[str, ...]]:
+        """按任务步骤中出现的关键词（或工具组名）选择工具组，没有匹配或者匹配了全部工具组时返回None，即提供全部工具"""
+        if not TOOL_GROUP_CONFIG.get("select_by_step", False):
+            return None
+        groups = self.tool_registrar.groups()
+        selected = tuple(group for group in groups if tool_group_pattern(group).search(task_step))
+        return selected if selected and len(selected) < len(groups) else None
+
+    def apply_tool_groups(self, groups: Optional[Tuple[str, ...]]) -> None:
+        """切换提供给模型的工具子集，并重建system prompt"""
+        if groups == self.active_tool_groups:
+            return
+        self.active_tool_groups = groups
+        self.tool_schema_texts = self.render_tool_schema_texts(groups)
+        self.history[0] = self.render_system_message(self.system_memory)
+
+    async def request_tools(self, groups: List[str]):
+        """
+        请求当前工具列表之外的其他工具组的工具
+
+        Args:
+            groups: 需要的工具组名列表，如 ["browser"]，传入 ["all"] 请求全部工具
+        """
+        known = self.tool_registrar.groups()
+        unknown = [group for group in groups if group not in known and group != "all"]
+        if "all" in groups:
+            requested = None
+        else:
+            requested = tuple(sorted(set(self.active_tool_groups or known) | (set(groups) & set(known))))
+            if len(requested) == len(known):
+                requested = None
+        self.apply_tool_groups(requested)
+
+        result = f"当前工具列表已包含工具组：{', '.join(requested or known)}，可以直接调用其中的工具"
+        if unknown:
+            result += f"\n不存在的工具组：{', '.join(unknown)}，可请求的工具组有：{', '.join(known)}"
+        yield {"data": {"stream_chunk": result}, "instruction": ""}
+
     def load_memory(self, memory_path: str | Path):
         path = Path(memory_path)
         suffix = path.suffix.lower()
@@ -264,6 +580,7 @@ class JarvisAgent(BaseAgent):
 
         # 所有yield的结果都仅用于给用户展示结果
         # 实际上下文分析始终以agent.history属性中保存的为准
+        self.select_task_memory(prompt)
         plan_trajectory = []
         async for chunk in self.multi_step_task_plan(prompt, plan_trajectory):
             yield chunk
@@ -271,6 +588,8 @@ class JarvisAgent(BaseAgent):
         for step_index, (task_step, step_goal) in enumerate(self.multi_steps_plan.items()):
             current_step = f"Step{step_index + 1}: {task_step}\nGoal: {step_goal}"
             self.logger.log_task(current_step, subtitle=f"EXECUTING", title=f"Executing Task Step {step_index + 1}")
+            self.select_step_memory(current_step)
+            self.apply_tool_groups(self.select_tool_groups(current_step))
 
             task_step_retry_time_limit = 2
             finish = False
@@ -299,20 +618,112 @@ class JarvisAgent(BaseAgent):
 
             if not finish:
                 self.logger.log_task(f"Done at step {step_index + 1}, agent don't finish this step at {task_step_retry_time_limit} times.", subtitle=f"DONE", title=f"Task Failed")
+                self.record_plan(prompt, "failure", failed_step=step_index + 1)
                 return
 
         self.logger.log_task(f"Agent finish all the task steps， total tool call steps: {self.total_steps}.", subtitle=f"DONE", title=f"Task Finished")
+        self.record_plan(prompt, "success")
         return
 
+    def select_task_memory(self, prompt: str) -> None:
+        """
+        按任务描述选择system prompt中注入的记忆，整个任务期间保持不变
+        记忆总量不超过task_max_tokens、或者与任务相关的条目少于task_top_k条时注入全部记忆
+        """
+        if self.memory_index is None:
+            return
+        top_k = MEMORY_CONFIG.get("task_top_k", 8)
+        self.task_memory = self.memory_index.select(
+            prompt, top_k, MEMORY_CONFIG.get("task_max_tokens", 2000), fallback_below=top_k)
+        self.system_memory = self.memory_index.render(self.task_memory)
+        self.history[0] = self.render_system_message(self.system_memory)
+        self.logger.log_task(
+            f"注入{len(self.task_memory)}/{len(self.memory_index.entries)}条记忆，"
+            f"{sum(entry.tokens for entry in self.task_memory)}/{self.memory_index.total_tokens} tokens\n{self.system_memory}",
+            subtitle="LOADING······", title="Retrieve system memory")
+
+    def select_step_memory(self, task_step: str) -> None:
+        """检索与当前任务步骤相关、且不在system prompt中的记忆条目，在该步骤的每次请求中注入"""
+        if self.memory_index is None:
+            return
+        entries = self.memory_index.select(task_step, MEMORY_CONFIG.get("step_top_k", 4),
+                                           MEMORY_CONFIG.get("step_max_tokens", 800), exclude=self.task_memory)
+        self.step_memory = self.memory_index.render(entries)
+
+    def record_memory_savings(self) -> None:
+        """记录一次请求中检索注入的记忆相比整体注入节省的token数"""
+        if self.memory_index is None:
+            return
+        injected = sum(entry.tokens for entry in self.task_memory) + estimate_tokens(self.step_memory)
+        self.memory_stats["requests"] += 1
+        self.memory_stats["full_tokens"] += self.memory_index.total_tokens
+        self.memory_stats["injected_tokens"] += injected
+        self.memory_stats["saved_tokens"] += max(0, self.memory_index.total_tokens - injected)
+
+    def record_plan(self, prompt: str, outcome: str, **extra: Any) -> None:
+        """将本次任务的方案与执行结果写入计划库"""
+        if self.plan_library is None or not self.multi_steps_plan:
+            return
+        self.plan_library.record(prompt, self.multi_steps_plan, outcome,
+                                 reused=self.planning_stats.get("plan_library") == "reused", **extra)
+
+    def should_speculate(self) -> bool:
+        """是否推测执行困境分析：最近的完成度检查中未完成的比例不低于阈值，尚无检查结果时总是推测"""
+        if not self.speculative_dilemma:
+            return False
+        if not self.recent_step_failures:
+            return True
+        failure_rate = sum(self.recent_step_failures) / len(self.recent_step_failures)
+        return failure_rate >= self.speculation_threshold
+
+    async def _speculate_dilemma(self, trajectory: List[dict], queue: asyncio.Queue) -> None:
+        """流式生成困境分析并放入队列，结束（包括被取消）时放入None"""
+        try:
+            async for chunk in self.llm.async_stream_generate(react_block_analyse_dilemma_prompt, history=trajectory):
+                queue.put_nowait(chunk)
+        finally:
+            queue.put_nowait(None)
+
     async def react_block_reflect(self, trajectory: List[dict], reflection: Dict[str, str]):
         # print("\n\n", prompt)
-        tasks = [
-            self.llm.async_generate(react_block_reflect_check_completion_prompt, history=trajectory),
-            self.llm.async_generate(react_block_conclude_success_prompt.format(past_conclusion=self.temp_memory), history=trajectory),
-        ]
-        finish, conclude = await asyncio.gather(*tasks)
-        finish, conclude = extract_json_codeblock(finish), extract_json_codeblock(conclude)
-        reflection["finish"] = finish.get("finish", "no")
+        check_task = asyncio.ensure_future(
+            self.llm.async_generate(react_block_reflect_check_completion_prompt, history=trajectory))
+        conclude_task = asyncio.ensure_future(
+            self.llm.async_generate(react_block_conclude_success_prompt.format(past_conclusion=self.temp_memory), history=trajectory))
+        speculation, speculated = None, asyncio.Queue()
+        if self.should_speculate():
+            speculation = asyncio.create_task(self._speculate_dilemma(trajectory, speculated))
+            speculation_start = time.perf_counter()
+            self.speculation_stats["started"] += 1
+
+        try:
+            finish = extract_json_codeblock(await check_task)
+            reflection["finish"] = finish.get("finish", "no")
+            self.speculation_stats["checks"] += 1
+            self.recent_step_failures.append(reflection["finish"] == "no")
+            if speculation is not None:
+                if reflection["finish"] == "no":
+                    self.speculation_stats["used"] += 1
+                    self.speculation_stats["saved_seconds"] += time.perf_counter() - speculation_start
+                else:
+                    # 步骤已完成，困境分析不再需要，已经发送的输入和已生成的输出计为浪费
+                    speculation.cancel()
+                    generated = ""
+                    while not speculated.empty():
+                        generated += speculated.get_nowait() or ""
+                    self.speculation_stats["cancelled"] += 1
+                    self.speculation_stats["wasted_tokens"] += (
+                        self.context_manager.count(trajectory)
+                        + self.context_manager.count_text(react_block_analyse_dilemma_prompt)
+                        + estimate_tokens(generated)
+                    )
+                    speculation = None
+            conclude = extract_json_codeblock(await conclude_task)
+        except BaseException:
+            for task in (check_task, conclude_task, speculation):
+                if task is not None:
+                    task.cancel()
+            raise
 
         lines = [f"- {k}: {v}" for k, v in conclude.items()]
         conclude = "\n".join(lines) + "\n"
@@ -321,33 +732,112 @@ class JarvisAgent(BaseAgent):
         # 更新系统记忆
         self.temp_memory = "<当前任务执行中积攒的经验>" + conclude + "</当前任务执行中积攒的经验>"
         self.logger.log_task(self.temp_memory, subtitle="LOADING······", title="Load temp memory")
-        self.history[0] = {"role": "system", "content": [{"type": "text", "text": self.sys_prompt_template.format(
-            now=datetime.now(),
-            knowledge=self.system_memory + "\n" + self.temp_memory,
-            tools=self.tool_schema_texts
-        )}]}
+        # stable布局下temp_memory通过<runtime>传递，不改动system prompt
+        if self.context_layout == "dynamic":
+            self.history[0] = self.render_system_message(self.system_memory + "\n" + self.temp_memory)
 
         if reflection["finish"] == "no":
             analysis = ""
-            async for chunk in self.llm.async_stream_generate(react_block_analyse_dilemma_prompt, history=trajectory):
-                yield chunk
-                analysis += chunk
+            if speculation is not None:
+                try:
+                    while (chunk := await speculated.get()) is not None:
+                        yield chunk
+                        analysis += chunk
+                    await speculation
+                finally:
+                    speculation.cancel()
+            else:
+                async for chunk in self.llm.async_stream_generate(react_block_analyse_dilemma_prompt, history=trajectory):
+                    yield chunk
+                    analysis += chunk
             messages = [
                 {"role": "user", "content": [{"type": "text", "text": react_block_analyse_dilemma_prompt}]},
                 {"role": "assistant", "content": [{"type": "text", "text": analysis}]}
             ]
             self.history.extend(messages)
 
+        if self.speculation_stats["started"]:
+            hit_rate = self.speculation_stats["used"] / self.speculation_stats["started"]
+            self.logger.log_task(f"推测执行命中率：{hit_rate:.0%}\n{self.speculation_stats}", subtitle="REFLECTING···", title="Speculation stats")
+
         # self.pretty_print_trajectory(trajectory)
 
     async def multi_step_task_plan(self,
             prompt: str,
             trajectory: List[dict]
     ):
+        stats = {"mode": self.planning_mode, "calls": 0, "estimated_prompt_tokens": 0}
+        usage_before = dict(self.llm.usage_stats)
+        start = time.perf_counter()
+
+        match = self.plan_library.match(prompt) if self.plan_library is not None else None
+        draft = ""
+        if match is not None:
+            entry, similarity = match
+            stats["similarity"] = round(similarity, 3)
+            if similarity >= PLAN_LIBRARY_CONFIG.get("reuse_threshold", 0.95):
+                stats["plan_library"] = "reused"
+            elif similarity >= PLAN_LIBRARY_CONFIG.get("draft_threshold", 0.5):
+                stats["plan_library"] = "draft"
+                draft = jarvis_plan_draft_prompt.format(
+                    task=entry["task"], plan=json.dumps(entry["plan"], ensure_ascii=False, indent=4))
+            self.logger.log_task(f"相似度：{similarity:.2f}，处理方式：{stats.get('plan_library', 'ignored')}\n{entry['task']}",
+                                 "PLANNING···", "Similar past task")
+
+        if stats.get("plan_library") == "reused":
+            planner = self.reuse_plan(prompt, match[0], stats)
+        elif self.planning_mode == "fused":
+            planner = self.fused_plan(prompt, stats, draft)
+        else:
+            planner = self.sequential_plan(prompt, stats, draft)
+        async for chunk in planner:
+            yield chunk
+
+        facts = self.history[-1]["content"][0]["text"]
+        self.history[-1] = {"role": "assistant",
+                            "content": [{"type": "text", "text": f"{facts}\n\n* 任务方案可分为如下步骤：\n    {
+                                '\n    '.join([f'{i+1}. {x}' for i, x in enumerate(self.multi_steps_plan.keys())])
+                            }"}]}
+        self.logger.log_task(self.history[-1]["content"][0]["text"], "PLANNING···", "Generate task plan")
+
+        stats["seconds"] = round(time.perf_counter() - start, 3)
+        stats.update({key: self.llm.usage_stats[key] - usage_before.get(key, 0)
+                      for key in ("prompt_tokens", "cached_tokens", "completion_tokens")})
+        self.planning_stats = stats
+        self.logger.log_task(f"规划方式：{stats['mode']}，耗时：{stats['seconds']}s，LLM调用：{stats['calls']}次\n{stats}",
+                             "PLANNING···", "Planning cost")
+
+        trajectory.extend(self.history[:])
+
+    async def _planning_call(self, prompt: str, stats: Dict[str, Any]) -> AsyncGenerator[str, None]:
+        """发起一次规划阶段的流式调用，并记录调用次数与估算的输入token数"""
+        prompt = self.with_runtime(prompt)
+        self.record_memory_savings()
+        stats["calls"] += 1
+        stats["estimated_prompt_tokens"] += (self.context_manager.count(self.history)
+                                             + self.context_manager.count_text(prompt))
+        async for chunk in self.llm.async_stream_generate(prompt, history=self.history, track_stability=True):
+            yield chunk
+
+    async def reuse_plan(self, prompt: str, entry: Dict[str, Any], stats: Dict[str, Any]) -> AsyncGenerator[str, None]:
+        """直接复用相似的成功历史任务的方案，不调用LLM"""
+        self.multi_steps_plan = dict(entry["plan"])
+        facts = f"* 复用相似历史任务的任务方案，历史任务为：\n    {entry['task']}"
+        self.history.extend([
+            {"role": "user", "content": [{"type": "text", "text": prompt}]},
+            {"role": "assistant", "content": [{"type": "text", "text": facts}]}
+        ])
+        yield facts + "\n\n"
+
+    async def sequential_plan(self, prompt: str, stats: Dict[str, Any], draft: str = "") -> AsyncGenerator[str, None]:
+        """
+        依次生成已知事实、待确认事实和任务方案，每一部分都以前一部分为上下文，draft非空时在制定任务方案时附上
+        结束时历史记录的最后两条为任务与模型给出的已知事实和待确认事实，任务方案写入self.multi_steps_plan
+        """
         current_prompt = f"<task>\n{prompt}\n</task>\n\n{jarvis_list_fact_prompt}"
 
         known_facts = ""
-        async for chunk in self.llm.async_stream_generate(current_prompt, history=self.history):
+        async for chunk in self._planning_call(current_prompt, stats):
             yield chunk
             known_facts += chunk
         self.history.extend([
@@ -357,25 +847,45 @@ class JarvisAgent(BaseAgent):
         yield "\n\n"
 
         unknown_facts = ""
-        async for chunk in self.llm.async_stream_generate(jarvis_confirm_fact_prompt, history=self.history):
+        async for chunk in self._planning_call(jarvis_confirm_fact_prompt, stats):
             yield chunk
             unknown_facts += chunk
         self.history[-1] = {"role": "assistant", "content": [{"type": "text", "text": f"{known_facts}\n\n{unknown_facts}"}]}
         yield "\n\n"
 
         multi_steps_plan = ""
-        async for chunk in self.llm.async_stream_generate(jarvis_plan_multi_steps_task_prompt, history=self.history):
+        async for chunk in self._planning_call("\n".join(filter(None, (draft, jarvis_plan_multi_steps_task_prompt))), stats):
             yield chunk
             multi_steps_plan += chunk
 
         self.multi_steps_plan = extract_json_codeblock(multi_steps_plan)
-        self.history[-1] = {"role": "assistant",
-                            "content": [{"type": "text", "text": f"{known_facts}\n\n{unknown_facts}\n\n* 任务方案可分为如下步骤：\n    {
-                                '\n    '.join([f'{i+1}. {x}' for i, x in enumerate(self.multi_steps_plan.keys())])
-                            }"}]}
-        self.logger.log_task(self.history[-1]["content"][0]["text"], "PLANNING···", "Generate task plan")
 
-        trajectory.extend(self.history[:])
+    async def fused_plan(self, prompt: str, stats: Dict[str, Any], draft: str = "") -> AsyncGenerator[str, None]:
+        """
+        在一次调用中按模板生成已知事实、待确认事实和任务方案，省去两次重新发送system prompt与历史记录的往返
+        draft非空时附在模板之前；回复中没有合法的任务方案时，再单独请求一次任务方案
+        """
+        current_prompt = f"<task>\n{prompt}\n</task>\n\n{draft}\n{jarvis_fused_plan_prompt}" if draft else \
+            f"<task>\n{prompt}\n</task>\n\n{jarvis_fused_plan_prompt}"
+
+        response = ""
+        async for chunk in self._planning_call(current_prompt, stats):
+            yield chunk
+            response += chunk
+        known_facts, unknown_facts, self.multi_steps_plan = split_fused_plan(response)
+        self.history.extend([
+            {"role": "user", "content": [{"type": "text", "text": prompt}]},
+            {"role": "assistant", "content": [{"type": "text", "text": "\n\n".join(filter(None, (known_facts, unknown_facts)))}]}
+        ])
+
+        if not self.multi_steps_plan:
+            self.logger.log_task("回复中没有合法的任务方案，单独请求任务方案", "PLANNING···", "Fused planning fallback")
+            yield "\n\n"
+            multi_steps_plan = ""
+            async for chunk in self._planning_call("\n".join(filter(None, (draft, jarvis_plan_multi_steps_task_prompt))), stats):
+                yield chunk
+                multi_steps_plan += chunk
+            self.multi_steps_plan = extract_json_codeblock(multi_steps_plan)
 
     async def reason_and_act(
             self,
@@ -392,44 +902,44 @@ class JarvisAgent(BaseAgent):
         steps = 0
         # working_memory = []
         while exist_tool_call and (step_limit is None or steps < step_limit):
-            # 需要修改system_prompt中的当前时间
-            self.history[0] = {"role": "system", "content": [{"type": "text", "text": self.sys_prompt_template.format(
-                now=datetime.now(),
-                knowledge=self.system_memory,
-                tools=self.tool_schema_texts
-            )}]}
+            # dynamic布局需要修改system_prompt中的当前时间
+            if self.context_layout == "dynamic":
+                self.history[0] = self.render_system_message(self.system_memory + self.step_memory)
 
             user_message = {"role": "user", "content": [{"type": "text", "text": current_prompt}]}
             if steps == 0:
-                generator = self.llm.async_stream_generate(current_prompt, history=self.history)
+                request_prompt = current_prompt
                 trajectory.append({"role": "user", "content": [{"type": "text", "text": prompt}]})
             else:
-                generator = self.llm.async_stream_generate(jarvis_act_prompt.format(observation=current_prompt), history=self.history)
+                request_prompt = jarvis_act_prompt.format(observation=current_prompt)
                 trajectory.append(user_message)
+            if self.context_layout == "stable":
+                step_title = prompt.splitlines()[0] if prompt.strip() else "未命名步骤"
+                request_prompt = self.with_runtime(request_prompt, f"{step_title}（已执行{steps}次行动）")
+            self.prune_history(request_prompt)
+            self.record_memory_savings()
+            generator = self.stream_action(request_prompt)
 
             ai_response = ""
             async for chunk in generator:
                 yield chunk
                 ai_response += chunk
 
-            # 保留最近6轮对话中的浏览器状态，减少上下文
-            if len(self.history) > 6:
-                history_user_content = self.history[-6]["content"][0]["text"]
-                assert self.history[-6].get("role") == "user"
-                self.history[-6] = {"role": "user", "content": [{"type": "text", "text": remove_browser_info_in_the_history(history_user_content)}]}
             ai_message = {"role": "assistant", "content": [{"type": "text", "text": ai_response}]}
             self.history.extend([user_message, ai_message])
             trajectory.append(ai_message)
 
             # print(self.history)
-            parse_result = self.parse_tool_call(ai_response)
+            parse_results = self.parse_tool_calls(ai_response)
+            parse_result = parse_results[0] if parse_results else self.parse_tool_call(ai_response)
             # AGENT_LOGGER.log_markdown(parsing_message, "Tool call parsing result")
 
-            if parse_result.tool_json:
-                self.logger.log_task(str(parse_result.tool_json), subtitle="CALLING······", title=f"Action Step {steps + 1} ")
+            if any(result.tool_json for result in parse_results):
+                tool_calls = [result.tool_json for result in parse_results if result.tool_json]
+                self.logger.log_task("\n".join(map(str, tool_calls)), subtitle="CALLING······", title=f"Action Step {steps + 1} ")
 
                 tool_call_result = None
-                async for status, chunk in self.call_tool(**parse_result.tool_json):
+                async for status, chunk in self.call_tools(parse_results):
                     if status == "[DONE]":
                         yield "\n* * * * * * * * * * * *\n"
                         tool_call_result = chunk
@@ -451,7 +961,7 @@ class JarvisAgent(BaseAgent):
             steps += 1
 
         self.total_steps += steps
-        self.logger.log_task(f"当前任务步骤执行步数：{steps}", subtitle="DONE", title="Task Step Over")
+        self.logger.log_task(f"当前任务步骤执行步数：{steps}\n{self.llm.prompt_stability.report()}\ntoken用量：{self.llm.usage_stats}，提前停止的请求（估计值）：{self.llm.estimated_usage_stats}\n流式生成：{self.llm.stream_stats}\n记忆检索：{self.memory_stats}", subtitle="DONE", title="Task Step Over")
         return
 
     async def call_tool(
@@ -1,6 +1,5 @@
 
 from agent import BaseAgent
-from utils import remove_browser_info_in_the_history
 
 class ReActAgent(BaseAgent):
     def __init__(self, init_model_name: str, sys_prompt_template: str):
@@ -26,28 +25,26 @@ class ReActAgent(BaseAgent):
         while exist_tool_call and (step_limit is None or steps < step_limit):
 
             steps += 1
+            self.prune_history(current_prompt)
             ai_response = ""
-            async for chunk in self.llm.async_stream_generate(current_prompt, history=self.history):
+            async for chunk in self.stream_action(current_prompt):
                 yield chunk
                 ai_response += chunk
-            # 保留最近6轮对话中的浏览器状态，减少上下文
-            if len(self.history) > 6:
-                history_user_content = self.history[-6]["content"][0]["text"]
-                self.history[-6] = {"role": "user", "content": [
-                    {"type": "text", "text": remove_browser_info_in_the_history(history_user_content)}]}
             self.history.extend([
                 {"role": "user", "content": [{"type": "text", "text": current_prompt}]},
                 {"role": "assistant", "content": [{"type": "text", "text": ai_response}]}
             ])
             # print(self.history)
-            parse_result = self.parse_tool_call(ai_response)
+            parse_results = self.parse_tool_calls(ai_response)
+            parse_result = parse_results[0] if parse_results else self.parse_tool_call(ai_response)
             # AGENT_LOGGER.log_markdown(parsing_message, "Tool call parsing result")
 
-            if parse_result.tool_json:
-                self.logger.log_task(str(parse_result.tool_json), subtitle="CALLING······", title="Start tool call")
+            if any(result.tool_json for result in parse_results):
+                tool_calls = [result.tool_json for result in parse_results if result.tool_json]
+                self.logger.log_task("\n".join(map(str, tool_calls)), subtitle="CALLING······", title="Start tool call")
 
                 tool_call_result = None
-                async for status, chunk in self.call_tool(**parse_result.tool_json):
+                async for status, chunk in self.call_tools(parse_results):
                     if status == "[DONE]":
                         yield "\n* * * * * * * * * * * *\n"
                         tool_call_result = chunk
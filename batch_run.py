@@ -0,0 +1,277 @@
+"""
+在同一个事件循环中并发运行一批任务
+
+任务清单为JSONL文件，每行一个任务：{"task_name": "<任务名>", "task": "<任务指令>"}，可选"agent"字段覆盖--agent
+每个任务使用独立的agent（独立的历史记录）、输出目录（output_dir/<task_name>）与工作目录（output_dir/<task_name>/workspace），
+浏览器工具使用BrowserPool中的独立上下文；配置了评估命令时，agent结束后交给评估worker池异步评估，不阻塞其他任务
+    python batch_run.py tasks.jsonl --agent jarvis --concurrency 4 --eval_workers 2
+"""
+import argparse
+import asyncio
+import json
+import os
+import shlex
+import string
+import time
+import traceback
+from dataclasses import asdict, dataclass
+from pathlib import Path
+from typing import Any, Callable, Dict, List, Optional
+
+from log import LogLevel
+from model import config, preconnect
+from shell import ShellSession
+
+BATCH_CONFIG = config.get("batch", {})
+AGENT_KINDS = ("jarvis", "react")
+# 评估命令中可以使用的占位符
+EVAL_FIELDS = ("task_name", "output_dir", "trajectory")
+
+
+@dataclass
+class TaskResult:
+    task_name: str
+    agent: str
+    # agent的运行结果：pending、finished或error
+    status: str = "pending"
+    # 评估结果：未评估时为None，否则为evaluated或eval_error
+    eval_status: Optional[str] = None
+    agent_seconds: float = 0.0
+    eval_seconds: float = 0.0
+    eval_returncode: Optional[int] = None
+    error: str = ""
+
+
+def load_manifest(path: str | Path) -> List[Dict[str, Any]]:
+    tasks, names = [], set()
+    with open(path, "r", encoding="utf-8") as f:
+        for line_number, line in enumerate(f, 1):
+            if not line.strip():
+                continue
+            task = json.loads(line)
+            if not task.get("task_name") or not task.get("task"):
+                raise ValueError(f"{path}:{line_number}: each task needs 'task_name' and 'task'")
+            if task["task_name"] in names:
+                raise ValueError(f"{path}:{line_number}: duplicate task_name '{task['task_name']}'")
+            if task.get("agent", AGENT_KINDS[0]) not in AGENT_KINDS:
+                raise ValueError(f"{path}:{line_number}: unknown agent '{task['agent']}', expected one of {AGENT_KINDS}")
+            names.add(task["task_name"])
+            tasks.append(task)
+    return tasks
+
+
+def build_agent(kind: str, model: str, workspace: Path):
+    """构建一个不向终端输出日志、在workspace中执行命令的agent"""
+    if kind == "jarvis":
+        from agent import JarvisAgent
+        from prompt.system_prompt import jarvis_sys_prompt
+
+        agent = JarvisAgent(init_model_name=model, sys_prompt_template=jarvis_sys_prompt, memory_dir="memory",
+                            context_layout="stable")
+    else:
+        from baseline import ReActAgent
+        from prompt.baseline_prompt import react_sys_prompt
+
+        agent = ReActAgent(init_model_name=model, sys_prompt_template=react_sys_prompt)
+    agent.logger.level = LogLevel.OFF
+    agent.shell = ShellSession(cwd=str(workspace))
+    return agent
+
+
+def create_browser_pool():
+    """浏览器依赖可用时创建共享Chromium进程的上下文池，否则返回None"""
+    try:
+        from browser_pool import BrowserPool
+    except ImportError as e:
+        print(f"browser pool disabled: {e}")
+        return None
+    return BrowserPool()
+
+
+class BatchRunner:
+    """
+    - 最多同时运行concurrency个agent
+    - eval_cmd非空时由eval_workers个worker异步执行评估命令，命令中的{task_name}、{output_dir}、{trajectory}会被替换
+    - 每个任务结束（配置了评估时为评估结束）后输出总体进度与吞吐量，全部结束后写入output_dir/summary.json
+    """
+    def __init__(
+            self,
+            tasks: List[Dict[str, Any]],
+            agent_factory: Callable[[str, Path], Any],
+            output_dir: str | Path,
+            agent_kind: str = "jarvis",
+            concurrency: int = 4,
+            eval_workers: int = 2,
+            eval_cmd: str = "",
+            eval_env: Dict[str, str] = None,
+            step_limit: int = 50,
+            browser_pool=None,
+    ):
+        self.tasks = tasks
+        self.agent_factory = agent_factory
+        self.output_dir = Path(output_dir)
+        self.agent_kind = agent_kind
+        self.concurrency = concurrency
+        self.eval_workers = eval_workers
+        self.eval_cmd = eval_cmd
+        self.check_eval_cmd(eval_cmd)
+        self.eval_env = {k: str(v) for k, v in (eval_env or {}).items()}
+        self.step_limit = step_limit
+        self.browser_pool = browser_pool
+
+        self.results: List[TaskResult] = []
+        self.running = 0
+        self.completed = 0
+        self.started_at = 0.0
+
+    @staticmethod
+    def check_eval_cmd(eval_cmd: str) -> None:
+        """在运行任务之前检查评估命令，避免每个任务结束后才发现命令无法使用"""
+        for part in shlex.split(eval_cmd):
+            for _, field, _, _ in string.Formatter().parse(part):
+                if field is not None and field not in EVAL_FIELDS:
+                    raise ValueError(f"unknown placeholder '{{{field}}}' in eval_cmd, expected one of {EVAL_FIELDS}")
+
+    def task_dir(self, task_name: str) -> Path:
+        return self.output_dir / task_name
+
+    async def run(self) -> List[TaskResult]:
+        self.started_at = time.perf_counter()
+        self.results = [TaskResult(task["task_name"], task.get("agent", self.agent_kind)) for task in self.tasks]
+        semaphore = asyncio.Semaphore(self.concurrency)
+        eval_queue: asyncio.Queue = asyncio.Queue()
+        workers = [asyncio.create_task(self._eval_worker(eval_queue))
+                   for _ in range(self.eval_workers if self.eval_cmd else 0)]
+        try:
+            await asyncio.gather(*(self._run_task(task, result, semaphore, eval_queue)
+                                   for task, result in zip(self.tasks, self.results)))
+            await eval_queue.join()
+        finally:
+            for worker in workers:
+                worker.cancel()
+            if self.browser_pool is not None:
+                await self.browser_pool.close()
+        self.write_summary()
+        return self.results
+
+    async def _run_task(self, task: Dict[str, Any], result: TaskResult, semaphore: asyncio.Semaphore,
+                        eval_queue: asyncio.Queue) -> None:
+        task_dir = self.task_dir(task["task_name"])
+        workspace = task_dir / "workspace"
+        async with semaphore:
+            self.running += 1
+            start = time.perf_counter()
+            agent, browser = None, None
+            try:
+                workspace.mkdir(parents=True, exist_ok=True)
+                agent = await asyncio.to_thread(self.agent_factory, result.agent, workspace.resolve())
+                if self.browser_pool is not None:
+                    browser = await self.browser_pool.acquire()
+                    agent.browser = browser
+                await agent.run(task["task"], step_limit=self.step_limit, echo=False)
+                result.status = "finished"
+            except Exception:
+                result.status = "error"
+                result.error = traceback.format_exc()
+            finally:
+                if browser is not None:
+                    await self.browser_pool.release(browser)
+                if agent is not None:
+                    await agent.shell.aclose()
+                    agent.save_trajectory(str(task_dir / "trajectory.json"))
+                result.agent_seconds = time.perf_counter() - start
+                self.running -= 1
+
+        if self.eval_cmd and agent is not None:
+            eval_queue.put_nowait(result)
+        else:
+            self._report(result)
+
+    async def _eval_worker(self, queue: asyncio.Queue) -> None:
+        while True:
+            result = await queue.get()
+            try:
+                await self._evaluate(result)
+            finally:
+                queue.task_done()
+                self._report(result)
+
+    async def _evaluate(self, result: TaskResult) -> None:
+        start = time.perf_counter()
+        try:
+            task_dir = self.task_dir(result.task_name).resolve()
+            fields = {"task_name": result.task_name, "output_dir": task_dir, "trajectory": task_dir / "trajectory.json"}
+            command = [part.format(**fields) for part in shlex.split(self.eval_cmd)]
+            process = await asyncio.create_subprocess_exec(
+                *command, stdout=asyncio.subprocess.PIPE, stderr=asyncio.subprocess.STDOUT,
+                env={**os.environ, **self.eval_env},
+            )
+            output, _ = await process.communicate()
+            (task_dir / "eval_output.txt").write_bytes(output)
+            result.eval_returncode = process.returncode
+            result.eval_status = "evaluated" if process.returncode == 0 else "eval_error"
+        except Exception:
+            # 评估失败只影响当前任务，worker继续处理其余任务
+            result.eval_status = "eval_error"
+            result.error += f"\nevaluation failed: {traceback.format_exc()}"
+        result.eval_seconds = time.perf_counter() - start
+
+    def _report(self, result: TaskResult) -> None:
+        self.completed += 1
+        elapsed = time.perf_counter() - self.started_at
+        throughput = self.completed / elapsed * 60 if elapsed > 0 else 0.0
+        status = result.status if result.eval_status is None else f"{result.status}, {result.eval_status}"
+        print(f"[{self.completed}/{len(self.tasks)}] {result.task_name}: {status} "
+              f"(agent {result.agent_seconds:.1f}s, eval {result.eval_seconds:.1f}s) | "
+              f"running {self.running}, {throughput:.2f} tasks/min, elapsed {elapsed:.0f}s", flush=True)
+
+    def write_summary(self) -> None:
+        elapsed = time.perf_counter() - self.started_at
+        summary = {
+            "tasks": len(self.results),
+            "elapsed_seconds": round(elapsed, 3),
+            "tasks_per_minute": round(len(self.results) / elapsed * 60, 3) if elapsed > 0 else 0.0,
+            "status": {status: sum(r.status == status for r in self.results) for status in sorted({r.status for r in self.results})},
+            "eval_status": {status: sum(r.eval_status == status for r in self.results)
+                            for status in sorted({r.eval_status for r in self.results if r.eval_status})},
+            "results": [asdict(result) for result in self.results],
+        }
+        self.output_dir.mkdir(parents=True, exist_ok=True)
+        (self.output_dir / "summary.json").write_text(json.dumps(summary, ensure_ascii=False, indent=2), encoding="utf-8")
+
+
+async def main():
+    parser = argparse.ArgumentParser(description="并发运行任务清单中的任务")
+    parser.add_argument("manifest", type=str, help="任务清单（JSONL），每行为{\"task_name\": ..., \"task\": ...}")
+    parser.add_argument("--agent", type=str, default="jarvis", choices=AGENT_KINDS)
+    parser.add_argument("--model", type=str, default="gemini", help="config.yaml中的模型名")
+    parser.add_argument("--concurrency", type=int, default=BATCH_CONFIG.get("concurrency", 4))
+    parser.add_argument("--eval_workers", type=int, default=BATCH_CONFIG.get("eval_workers", 2))
+    parser.add_argument("--eval_cmd", type=str, default=BATCH_CONFIG.get("eval_cmd", ""),
+                        help="评估命令，可使用{task_name}、{output_dir}、{trajectory}占位符，为空时不评估")
+    parser.add_argument("--output_dir", type=str, default=BATCH_CONFIG.get("output_dir", "outputs/batch"))
+    parser.add_argument("--step_limit", type=int, default=50)
+    parser.add_argument("--no_browser", action="store_true", help="不启动共享的浏览器")
+    args = parser.parse_args()
+
+    tasks = load_manifest(args.manifest)
+    await preconnect([args.model])
+    runner = BatchRunner(
+        tasks,
+        agent_factory=lambda kind, workspace: build_agent(kind, args.model, workspace),
+        output_dir=args.output_dir,
+        agent_kind=args.agent,
+        concurrency=args.concurrency,
+        eval_workers=args.eval_workers,
+        eval_cmd=args.eval_cmd,
+        eval_env=BATCH_CONFIG.get("eval_env"),
+        step_limit=args.step_limit,
+        browser_pool=None if args.no_browser else create_browser_pool(),
+    )
+    results = await runner.run()
+    print(f"summary written to {Path(args.output_dir) / 'summary.json'}: "
+          f"{sum(r.status == 'finished' for r in results)}/{len(results)} tasks finished")
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
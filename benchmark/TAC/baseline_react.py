@@ -5,6 +5,7 @@ import argparse
 import subprocess
 
 from baseline import ReActAgent
+from model import preconnect
 from prompt.baseline_prompt import react_sys_prompt
 
 BASELINE = "ReAct"
@@ -15,7 +16,11 @@ async def main():
     parser.add_argument("task_name", type=str, help="任务名")
     args = parser.parse_args()
 
-    react_agent = ReActAgent(init_model_name="gemini", sys_prompt_template=react_sys_prompt)
+    # 在构建agent（加载工具）的同时预先建立与LLM服务的连接
+    react_agent, _ = await asyncio.gather(
+        asyncio.to_thread(ReActAgent, init_model_name="gemini", sys_prompt_template=react_sys_prompt),
+        preconnect(["gemini"])
+    )
 
     react_agent.logger.log_task(args.task, subtitle="STARTING······", title="Task")
     await react_agent.run(args.task, step_limit=50)
@@ -0,0 +1,92 @@
+"""
+测量冷启动耗时：从启动`python run.py`到LLM服务收到第一个请求的时间
+
+本地的桩服务记录第一个请求的到达时间后立即结束agent进程，不需要真实的LLM服务。
+每轮先删除工具清单运行一次（导入全部工具模块并生成清单，即引入清单之前的启动方式），再在清单有效时运行一次：
+    python benchmark/cold_start.py --runs 3
+"""
+import argparse
+import os
+import subprocess
+import sys
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from pathlib import Path
+
+ROOT = Path(__file__).resolve().parent.parent
+sys.path.insert(0, str(ROOT))
+# model.py 在导入时按相对路径读取config.yaml
+os.chdir(ROOT)
+
+from model import config
+
+
+class FirstRequestServer(ThreadingHTTPServer):
+    def __init__(self):
+        super().__init__(("127.0.0.1", 0), FirstRequestHandler)
+        self.first_request = threading.Event()
+        self.first_request_at = None
+
+
+class FirstRequestHandler(BaseHTTPRequestHandler):
+    def do_HEAD(self):
+        # 预连接的探测请求
+        self.send_response(200)
+        self.end_headers()
+
+    def do_POST(self):
+        if not self.server.first_request.is_set():
+            self.server.first_request_at = time.perf_counter()
+            self.server.first_request.set()
+        self.send_response(503)
+        self.end_headers()
+
+    def log_message(self, format, *args):
+        pass
+
+
+def measure(server: FirstRequestServer, timeout: float) -> float:
+    server.first_request.clear()
+    env = {**os.environ, "BASE_URL": f"http://127.0.0.1:{server.server_port}/v1", "API_KEY": "benchmark"}
+    start = time.perf_counter()
+    process = subprocess.Popen([sys.executable, "run.py", "cold_start", "打开GitLab并列出所有仓库"],
+                               env=env, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+    try:
+        if not server.first_request.wait(timeout):
+            raise TimeoutError(f"run.py sent no LLM request within {timeout}s")
+        return server.first_request_at - start
+    finally:
+        process.kill()
+        process.wait()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="从启动run.py到第一个LLM请求的冷启动基准")
+    parser.add_argument("--runs", type=int, default=3)
+    parser.add_argument("--timeout", type=float, default=120)
+    args = parser.parse_args()
+
+    manifest = config.get("tools", {}).get("manifest")
+    if not manifest:
+        sys.exit("tools.manifest is empty in config.yaml, nothing to compare")
+    manifest = Path(manifest)
+
+    server = FirstRequestServer()
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    results = {"without manifest": [], "with manifest": []}
+    try:
+        for _ in range(args.runs):
+            manifest.unlink(missing_ok=True)
+            results["without manifest"].append(measure(server, args.timeout))
+            results["with manifest"].append(measure(server, args.timeout))
+    finally:
+        server.shutdown()
+
+    print(f"{'mode':<20}{'first request (s)':>20}")
+    for mode, runs in results.items():
+        print(f"{mode:<20}{sum(runs) / len(runs):>20.2f}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,91 @@
+"""
+对比流式生成在识别到完整工具调用后提前停止与完整生成的输出token数和耗时
+
+使用replay_server回放一段"工具调用 + 模型自行编造的后续内容"的回复，按--tps模拟生成速度：
+    python benchmark/early_stop.py --tps 50 --trailing_chars 800 --runs 3
+"""
+import argparse
+import asyncio
+import os
+import socket
+import sys
+import tempfile
+import threading
+import time
+from pathlib import Path
+
+ROOT = Path(__file__).resolve().parent.parent
+sys.path.insert(0, str(ROOT))
+# model.py 在导入时按相对路径读取config.yaml
+os.chdir(ROOT)
+
+import uvicorn
+
+from agent import tool_call_stream_end
+from context import estimate_tokens
+from replay_server import ReplayServer, request_key
+
+TOOL_CALL = '思考：需要先查看当前页面。\n<tool_call>\n{"name": "browser_get_browser_state", "arguments": {}}\n</tool_call>'
+TRAILING = "\nObservation: 页面显示了登录表单，用户名输入框的索引为3，密码输入框的索引为4。\n"
+
+
+def free_port() -> int:
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+
+async def measure(llm, stop_at) -> tuple[str, float]:
+    start = time.perf_counter()
+    text = "".join([chunk async for chunk in llm.async_stream_generate("next", stop_at=stop_at)])
+    return text, time.perf_counter() - start
+
+
+async def main():
+    parser = argparse.ArgumentParser(description="工具调用提前停止的收益基准")
+    parser.add_argument("--model", default="gemini", help="config.yaml中的模型名，仅用于构造请求")
+    parser.add_argument("--tps", type=float, default=50, help="模拟的生成速度（token/秒）")
+    parser.add_argument("--trailing_chars", type=int, default=800, help="工具调用之后编造内容的字符数")
+    parser.add_argument("--runs", type=int, default=3)
+    args = parser.parse_args()
+
+    from model import LLM
+
+    llm = LLM(args.model)
+    port = free_port()
+    llm.base_url = f"http://127.0.0.1:{port}/v1"
+    content = TOOL_CALL + (TRAILING * (args.trailing_chars // len(TRAILING) + 1))[:args.trailing_chars]
+
+    with tempfile.TemporaryDirectory() as cassette_dir:
+        app = ReplayServer("replay", cassette_dir, tps=args.tps)
+        messages = await llm.prepare_messages("next", None, None)
+        key = request_key({"model": llm.model, "messages": messages})
+        body = ReplayServer._completion({"model": llm.model}, content, None)
+        for _ in range(args.runs * 2):
+            app.cassette.append(key, {"model": llm.model, "messages": messages}, {"stream": False, "body": body})
+
+        server = uvicorn.Server(uvicorn.Config(app, host="127.0.0.1", port=port, log_level="warning"))
+        threading.Thread(target=server.run, daemon=True).start()
+        while not server.started:
+            await asyncio.sleep(0.01)
+
+        results = {"full": [], "early_stop": []}
+        for _ in range(args.runs):
+            results["full"].append(await measure(llm, None))
+            results["early_stop"].append(await measure(llm, tool_call_stream_end))
+        server.should_exit = True
+
+    print(f"{'mode':<12}{'output tokens':>15}{'seconds':>10}")
+    summary = {}
+    for mode, runs in results.items():
+        tokens = sum(estimate_tokens(text) for text, _ in runs) / len(runs)
+        seconds = sum(elapsed for _, elapsed in runs) / len(runs)
+        summary[mode] = (tokens, seconds)
+        print(f"{mode:<12}{tokens:>15.0f}{seconds:>10.2f}")
+    saved_tokens = summary["full"][0] - summary["early_stop"][0]
+    saved_seconds = summary["full"][1] - summary["early_stop"][1]
+    print(f"saved per step: {saved_tokens:.0f} output tokens, {saved_seconds:.2f}s")
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
@@ -0,0 +1,269 @@
+"""
+每一步都会执行的纯Python热点路径的微基准，输入为接近实际规模的合成数据（50步的历史记录、500个元素的selector map）
+
+结果以JSON记录在hot_paths_baseline.json中，修改热点路径后与基线对比，单次调用耗时的中位数超出基线--tolerance时以非零状态退出：
+    python benchmark/hot_paths.py               # 运行并输出结果
+    python benchmark/hot_paths.py --compare     # 与基线对比
+    python benchmark/hot_paths.py --save        # 更新基线
+tests/test_hot_paths.py以pytest-benchmark的方式运行同一组用例
+"""
+import argparse
+import json
+import os
+import platform
+import statistics
+import sys
+import time
+from pathlib import Path
+from typing import Any, Callable, Dict, List
+
+ROOT = Path(__file__).resolve().parent.parent
+sys.path.insert(0, str(ROOT))
+# model.py 在导入时按相对路径读取config.yaml
+os.chdir(ROOT)
+
+from browser_state import BrowserStateTracker, element_info, filter_elements, wrap_browser_info
+
+BASELINE_PATH = Path(__file__).resolve().parent / "hot_paths_baseline.json"
+HISTORY_STEPS = 50
+SELECTOR_MAP_SIZE = 500
+TAGS = ("button", "a", "input", "div", "span", "select")
+
+# 用例名到准备函数的映射，准备函数构造输入并返回被测量的无参函数
+CASES: Dict[str, Callable[[], Callable[[], Any]]] = {}
+
+
+def case(name: str):
+    def register(setup: Callable[[], Callable[[], Any]]):
+        CASES[name] = setup
+        return setup
+    return register
+
+
+class SyntheticElement:
+    """与browser_use的DOM节点接口一致的可交互元素"""
+    def __init__(self, index: int):
+        self.index = index
+        self.tag_name = TAGS[index % len(TAGS)]
+        self.text = f"Item {index} of project repository {index % 37}"
+        self.attributes = {"href": f"/root/project-{index % 37}/-/issues/{index}"} if self.tag_name == "a" else {}
+        if self.tag_name == "input":
+            self.attributes["placeholder"] = f"Search field {index}"
+
+    def clickable_elements_to_string(self) -> str:
+        return (f"[{self.index}]<{self.tag_name} {self.text} />\n"
+                f"\t[{self.index + 10000}]<span {self.text[:12]} />\n\t[{self.index + 20000}]<img />")
+
+
+def make_selector_map(size: int = SELECTOR_MAP_SIZE, start: int = 1) -> Dict[int, SyntheticElement]:
+    return {index: SyntheticElement(index) for index in range(start, start + size)}
+
+
+def make_browser_state(size: int = SELECTOR_MAP_SIZE, start: int = 1) -> dict:
+    return {
+        "url": "http://gitlab.example.com/root/project/-/issues",
+        "title": "Issues · project · GitLab",
+        "tabs": [{"url": "http://gitlab.example.com/root/project/-/issues", "title": "Issues · project · GitLab"}],
+        "interactive_elements": [element_info(index, element) for index, element in make_selector_map(size, start).items()],
+    }
+
+
+def make_reply(step: int) -> str:
+    return (
+        f"思考：第{step}步，需要查看当前页面上的议题列表，确认目标议题的位置后再点击。" * 4
+        + '\n<tool_call>\n{"name": "browser_click_element", "arguments": {"index": '
+        + str(step) + '}}\n</tool_call>'
+    )
+
+
+def make_history(steps: int = HISTORY_STEPS) -> List[dict]:
+    """每一步为一条带工具调用的模型回复与一条工具结果，偶数步的工具结果附带完整的浏览器状态"""
+    browser_info = wrap_browser_info(make_browser_state())
+    history = [{"role": "system", "content": [{"type": "text", "text": "你是一个能够使用工具的助手。" * 200}]}]
+    for step in range(steps):
+        observation = f"Clicked element {step}\n" + (browser_info if step % 2 == 0 else "")
+        history.append({"role": "assistant", "content": [{"type": "text", "text": make_reply(step)}]})
+        history.append({"role": "user", "content": [
+            {"type": "text", "text": f"<tool_response>\n{observation}\n</tool_response>"}
+        ]})
+    return history
+
+
+def run_coroutine(coroutine) -> Any:
+    """执行不会真正挂起的协程，避免把事件循环的开销计入测量"""
+    try:
+        coroutine.send(None)
+    except StopIteration as stop:
+        return stop.value
+    coroutine.close()
+    raise RuntimeError("coroutine suspended, it cannot be benchmarked synchronously")
+
+
+@case("parse_tool_call")
+def bench_parse_tool_call():
+    from agent import JarvisAgent
+
+    agent = JarvisAgent.__new__(JarvisAgent)
+    reply = make_reply(HISTORY_STEPS)
+    return lambda: agent.parse_tool_call(reply)
+
+
+@case("remove_browser_info_in_the_history")
+def bench_remove_browser_info():
+    from utils import remove_browser_info_in_the_history
+
+    texts = [message["content"][0]["text"] for message in make_history()]
+    return lambda: [remove_browser_info_in_the_history(text) for text in texts]
+
+
+@case("extract_json_codeblock")
+def bench_extract_json_codeblock():
+    from utils import extract_json_codeblock
+
+    plan = {f"步骤{i}：在GitLab中处理第{i}个议题": f"议题{i}的状态变为已关闭" for i in range(10)}
+    reply = "* 任务方案：\n" + "先确认议题列表，再逐个处理。\n" * 10 + "```json\n" + json.dumps(plan, ensure_ascii=False, indent=4) + "\n```"
+    return lambda: extract_json_codeblock(reply)
+
+
+@case("generate_tool_schema")
+def bench_generate_tool_schema():
+    from tool import generate_tool_schema
+
+    async def browser_input_text(index: int, text: str, press_enter: bool = False, delay: float = 0.0):
+        """
+        Input text into an interactive element of the current page.
+
+        Args:
+            index: The index of the element in the browser state.
+            text: The text to type into the element.
+            press_enter: Whether to press Enter after typing.
+            delay: Seconds to wait between key strokes.
+
+        Returns:
+            A message describing the result.
+        """
+
+    return lambda: generate_tool_schema(browser_input_text)
+
+
+@case("prepare_messages")
+def bench_prepare_messages():
+    from model import LLM
+
+    # claude家族会为system prompt与历史记录打上cache_control标记
+    llm = LLM("claude")
+    history = make_history()
+    return lambda: run_coroutine(llm.prepare_messages("继续执行下一步", None, history, track_stability=True))
+
+
+@case("browser_state_element_info")
+def bench_element_info():
+    selector_map = make_selector_map()
+    return lambda: [element_info(index, element) for index, element in selector_map.items()]
+
+
+@case("browser_state_render_diff")
+def bench_render_diff():
+    # 页面上新增了10个元素，其余元素的index整体后移
+    before, after = make_browser_state(), make_browser_state(SELECTOR_MAP_SIZE + 10, start=11)
+
+    def render():
+        tracker = BrowserStateTracker()
+        tracker.render("tab", before)
+        return tracker.render("tab", after)
+    return render
+
+
+@case("browser_state_filter")
+def bench_filter_elements():
+    elements = make_browser_state()["interactive_elements"]
+    return lambda: filter_elements(elements, query="open issue 42 of project repository", top_k=20)
+
+
+def measure(func: Callable[[], Any], rounds: int = 20, round_seconds: float = 0.01) -> dict:
+    """每轮重复调用至少round_seconds，返回单次调用耗时（微秒）的统计"""
+    iterations, start = 0, time.perf_counter()
+    while time.perf_counter() - start < round_seconds:
+        func()
+        iterations += 1
+
+    per_call = []
+    for _ in range(rounds):
+        start = time.perf_counter()
+        for _ in range(iterations):
+            func()
+        per_call.append((time.perf_counter() - start) / iterations * 1e6)
+    return {
+        "median_us": round(statistics.median(per_call), 3),
+        "min_us": round(min(per_call), 3),
+        "mean_us": round(statistics.mean(per_call), 3),
+        "rounds": rounds,
+        "iterations": iterations,
+    }
+
+
+def run_cases(names: List[str], rounds: int) -> Dict[str, dict]:
+    results = {}
+    for name in names:
+        results[name] = measure(CASES[name](), rounds=rounds)
+        print(f"{name:<40}{results[name]['median_us']:>14.1f}", flush=True)
+    return results
+
+
+def compare(results: Dict[str, dict], baseline: Dict[str, dict], tolerance: float) -> List[str]:
+    """输出与基线的对比，返回超出基线tolerance的用例"""
+    regressions = []
+    print(f"\n{'case':<40}{'baseline (us)':>14}{'current (us)':>14}{'ratio':>8}")
+    for name, result in results.items():
+        if name not in baseline:
+            print(f"{name:<40}{'-':>14}{result['median_us']:>14.1f}{'-':>8}")
+            continue
+        ratio = result["median_us"] / baseline[name]["median_us"]
+        flag = ""
+        if ratio > 1 + tolerance:
+            regressions.append(name)
+            flag = "  REGRESSION"
+        print(f"{name:<40}{baseline[name]['median_us']:>14.1f}{result['median_us']:>14.1f}{ratio:>8.2f}{flag}")
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description="agent热点路径的微基准")
+    parser.add_argument("--rounds", type=int, default=20)
+    parser.add_argument("--filter", type=str, default="", help="只运行名称包含该字符串的用例")
+    parser.add_argument("--baseline", type=Path, default=BASELINE_PATH)
+    parser.add_argument("--save", action="store_true", help="把本次结果写入基线文件")
+    parser.add_argument("--compare", action="store_true", help="与基线文件对比")
+    parser.add_argument("--tolerance", type=float, default=0.5, help="允许的相对基线的变慢比例")
+    args = parser.parse_args()
+
+    names = [name for name in CASES if args.filter in name]
+    print(f"{'case':<40}{'median (us)':>14}")
+    results = run_cases(names, args.rounds)
+
+    if args.compare:
+        baseline = json.loads(args.baseline.read_text(encoding="utf-8"))["cases"]
+        regressions = compare(results, baseline, args.tolerance)
+        if regressions:
+            sys.exit(f"\n{len(regressions)} case(s) slower than baseline by more than {args.tolerance:.0%}: "
+                     f"{', '.join(regressions)}")
+
+    if args.save:
+        baseline = {
+            "python": platform.python_version(),
+            "platform": platform.platform(),
+            "machine": platform.machine(),
+            "history_steps": HISTORY_STEPS,
+            "selector_map_size": SELECTOR_MAP_SIZE,
+            "cases": results,
+        }
+        if args.filter and args.baseline.exists():
+            # 只运行部分用例时保留其余用例的基线
+            previous = json.loads(args.baseline.read_text(encoding="utf-8"))
+            baseline["cases"] = {**previous["cases"], **results}
+        args.baseline.write_text(json.dumps(baseline, ensure_ascii=False, indent=2) + "\n", encoding="utf-8")
+        print(f"\nbaseline written to {args.baseline}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,116 @@
+"""
+对比三次调用的sequential规划与一次调用的fused规划的耗时与token用量
+
+使用replay_server按顺序回放预设的规划回复，按--ttft/--tps模拟首token延迟与生成速度：
+    python benchmark/planning.py --ttft 1.5 --tps 50 --runs 3
+"""
+import argparse
+import asyncio
+import os
+import socket
+import sys
+import tempfile
+import threading
+from pathlib import Path
+
+ROOT = Path(__file__).resolve().parent.parent
+sys.path.insert(0, str(ROOT))
+# model.py 在导入时按相对路径读取config.yaml
+os.chdir(ROOT)
+
+import uvicorn
+
+from context import estimate_tokens
+from replay_server import ReplayServer
+
+TASK = "在公司的GitLab上找到sotopia仓库，把它的README中的安装步骤整理成文档上传到OwnCloud的Documents目录"
+KNOWN_FACTS = """\
+* 已知事实有：
+    1. 需要在公司的GitLab上找到sotopia仓库
+    2. 需要整理的是README中的安装步骤
+    3. 整理后的文档需要上传到OwnCloud的Documents目录"""
+UNKNOWN_FACTS = """\
+* 还需要去确认的事实有：
+    1. GitLab与OwnCloud的访问地址和登录方式
+    2. README中安装步骤的具体内容
+    3. 文档的格式与文件名要求"""
+PLAN = """\
+```json
+{
+    "登录GitLab并打开sotopia仓库": "在浏览器中打开sotopia仓库首页",
+    "阅读README中的安装步骤": "获取README中完整的安装步骤",
+    "整理安装步骤文档": "在本地生成整理好的安装步骤文档",
+    "上传文档到OwnCloud": "文档出现在OwnCloud的Documents目录中"
+}
+```"""
+REPLIES = {
+    "sequential": [KNOWN_FACTS, UNKNOWN_FACTS, PLAN],
+    "fused": [f"{KNOWN_FACTS}\n\n{UNKNOWN_FACTS}\n\n* 任务方案：\n{PLAN}"],
+}
+
+
+class ScriptedCassette:
+    """不区分请求，按顺序返回预设回复的录制集合"""
+    def __init__(self):
+        self.responses = []
+
+    def next(self, key: str) -> dict | None:
+        return self.responses.pop(0) if self.responses else None
+
+
+def free_port() -> int:
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+
+async def measure(mode: str, base_url: str, cassette: ScriptedCassette) -> dict:
+    from agent import JarvisAgent
+    from log import LogLevel
+    from prompt.system_prompt import jarvis_sys_prompt
+
+    agent = await asyncio.to_thread(JarvisAgent, "gemini", jarvis_sys_prompt, "memory", planning_mode=mode)
+    agent.logger.level = LogLevel.OFF
+    agent.llm.base_url = base_url
+    for reply in REPLIES[mode]:
+        cassette.responses.append({"stream": False, "body": ReplayServer._completion({"model": agent.llm.model}, reply, None)})
+
+    output = ""
+    async for chunk in agent.multi_step_task_plan(TASK, []):
+        output += chunk
+    assert agent.multi_steps_plan, f"{mode} planning produced no plan"
+    return {**agent.planning_stats, "output_tokens": estimate_tokens(output)}
+
+
+async def main():
+    parser = argparse.ArgumentParser(description="任务规划方式的耗时与token用量基准")
+    parser.add_argument("--ttft", type=float, default=1.5, help="模拟的首token延迟（秒）")
+    parser.add_argument("--tps", type=float, default=50, help="模拟的生成速度（token/秒）")
+    parser.add_argument("--runs", type=int, default=3)
+    args = parser.parse_args()
+
+    port = free_port()
+    with tempfile.TemporaryDirectory() as cassette_dir:
+        app = ReplayServer("replay", cassette_dir, ttft=args.ttft, tps=args.tps)
+        app.cassette = ScriptedCassette()
+        server = uvicorn.Server(uvicorn.Config(app, host="127.0.0.1", port=port, log_level="warning"))
+        threading.Thread(target=server.run, daemon=True).start()
+        while not server.started:
+            await asyncio.sleep(0.01)
+
+        results = {mode: [] for mode in REPLIES}
+        for _ in range(args.runs):
+            for mode in REPLIES:
+                results[mode].append(await measure(mode, f"http://127.0.0.1:{port}/v1", app.cassette))
+        server.should_exit = True
+
+    print(f"{'mode':<12}{'calls':>7}{'prompt tokens':>15}{'output tokens':>15}{'seconds':>10}")
+    for mode, runs in results.items():
+        average = {key: sum(run[key] for run in runs) / len(runs)
+                   for key in ("calls", "estimated_prompt_tokens", "output_tokens", "seconds")}
+        print(f"{mode:<12}{average['calls']:>7.0f}{average['estimated_prompt_tokens']:>15.0f}"
+              f"{average['output_tokens']:>15.0f}{average['seconds']:>10.2f}")
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
@@ -1,8 +1,10 @@
 import asyncio
+import base64
+import hashlib
 import json
 import os
-import re
 import sys
+import time
 from pathlib import Path
 from typing import Literal, Any
 
@@ -13,15 +15,89 @@ from browser_use.controller.service import Controller
 from browser_use.filesystem.file_system import FileSystem
 from browser_use.llm.openai.chat import ChatOpenAI
 
+from browser_state import BrowserStateTracker, element_info, element_region, filter_elements
+from cache import LRUCache, TieredCache
+from imaging import downscale_image
+from log import AgentLogger, LogLevel
+from model import HTTP_CLIENTS, config
+
+BROWSER_CONFIG = config.get("browser", {})
+
 
 class BrowserUseLight:
 
-    def __init__(self):
+    def __init__(self, shared_browser=None, playwright=None, max_memory_mb: float = 0):
+        """
+        shared_browser/playwright: 由BrowserPool传入时，在共享的Chromium进程中新建独立的浏览器上下文，而不是启动新的浏览器
+        max_memory_mb: 浏览器上下文的JS堆内存上限，超出时在下一次导航前重建上下文，0表示不限制
+        """
         self.config = load_browser_use_config()
+        self.shared_browser = shared_browser
+        self.playwright = playwright
+        self.max_memory_mb = max_memory_mb
         self.browser_session: BrowserSession | None = None
         self.controller: Controller | None = None
         self.file_system: FileSystem | None = None
         self.llm: ChatOpenAI | None = None
+        # 记录每个标签页上一次输出的浏览器状态，用于输出增量
+        self.state_tracker = BrowserStateTracker()
+        self.logger = AgentLogger(level=LogLevel.INFO)
+
+        # 视觉提取只截图，不遍历DOM；截图缩放后上传，并按(URL, DOM哈希, 截图摘要, 问题)缓存回答
+        # 只有页面内容与截图都完全相同时才复用，输入框中的文字等细小变化也会使缓存失效
+        screenshot_cfg = BROWSER_CONFIG.get("screenshot", {})
+        self.screenshot_max_width = screenshot_cfg.get("max_width", 1280)
+        self.screenshot_max_height = screenshot_cfg.get("max_height", 1280)
+        self.screenshot_quality = screenshot_cfg.get("jpeg_quality", 75)
+        self.vision_cache = LRUCache(maxsize=screenshot_cfg.get("cache_size", 128))
+        self.vision_stats = {"calls": 0, "cache_hits": 0, "bytes_saved": 0, "seconds_saved": 0.0}
+
+        # 内容提取结果按(URL, DOM哈希, 归一化的query)缓存，页面被导航或改动时失效
+        extract_cfg = BROWSER_CONFIG.get("extract_cache", {})
+        self.extract_cache = TieredCache(
+            maxsize=extract_cfg.get("max_entries", 64),
+            ttl=extract_cfg.get("ttl", 600),
+            disk_path=extract_cfg.get("disk_path") or None,
+        )
+
+        # 浏览器会话的初始化任务，预热与工具调用共享同一个任务，避免重复启动
+        self._init_task: asyncio.Task | None = None
+        self.startup_stats = {"started_at": time.perf_counter(), "init_seconds": None, "waited_seconds": 0.0,
+                              "first_action_latency": None}
+
+    def mark_startup(self) -> None:
+        """Reset the reference point of the startup-to-first-action latency, e.g. when an agent starts running."""
+        self.startup_stats.update(started_at=time.perf_counter(), first_action_latency=None, waited_seconds=0.0)
+
+    def prewarm(self) -> None:
+        """Start initializing the browser session in the background, must be called inside an event loop."""
+        if not self.browser_session and (self._init_task is None or self._init_task.done()):
+            self._init_task = asyncio.create_task(self._timed_init())
+
+    async def _timed_init(self) -> None:
+        start = time.perf_counter()
+        await self._init_browser_session()
+        self.startup_stats["init_seconds"] = time.perf_counter() - start
+
+    async def _ensure_session(self) -> None:
+        """Initialize the browser session once; callers only wait if a (pre-warm) initialization is still running."""
+        if self.browser_session and (self._init_task is None or self._init_task.done()):
+            return
+        self.prewarm()
+        start = time.perf_counter()
+        await asyncio.shield(self._init_task)
+        self.startup_stats["waited_seconds"] += time.perf_counter() - start
+
+    def _record_first_action(self) -> None:
+        if self.startup_stats["first_action_latency"] is not None:
+            return
+        stats = self.startup_stats
+        stats["first_action_latency"] = time.perf_counter() - stats["started_at"]
+        init_seconds = f"{stats['init_seconds']:.2f}s" if stats["init_seconds"] is not None else "n/a"
+        self.logger.log(
+            f"[browser] startup-to-first-action latency {stats['first_action_latency']:.2f}s "
+            f"(session init {init_seconds}, tool call waited {stats['waited_seconds']:.2f}s)"
+        )
 
     # TODO: 需要暴露更多的路径参数给初始化
     async def _init_browser_session(self, **kwargs):
@@ -53,12 +129,22 @@ class BrowserUseLight:
         for key, value in kwargs.items():
             profile_data[key] = value
 
+        if self.shared_browser is not None:
+            # 共享的浏览器中只能创建非持久化的上下文
+            profile_data['user_data_dir'] = None
+
         # Create browser profile
         profile = BrowserProfile(**profile_data)
 
-        # Create browser session
-        self.browser_session = BrowserSession(browser_profile=profile)
-        await self.browser_session.start()
+        # Create browser session, it is published only after it has started and the controller is ready,
+        # so that tool calls made while a pre-warm is still running wait for it instead of using a half-built session
+        if self.shared_browser is not None:
+            browser_session = BrowserSession(
+                browser_profile=profile, browser=self.shared_browser, playwright=self.playwright
+            )
+        else:
+            browser_session = BrowserSession(browser_profile=profile)
+        await browser_session.start()
 
         # Create controller for direct actions
         self.controller = Controller()
@@ -71,23 +157,54 @@ class BrowserUseLight:
                 base_url=os.getenv('BASE_URL'),
                 temperature=llm_config.get('temperature', 0.7),
                 # max_tokens=llm_config.get('max_tokens'),
+                # 与agent的LLM共享连接池
+                http_client=HTTP_CLIENTS.get_async_client(os.getenv('BASE_URL')),
             )
 
         # Initialize FileSystem for extraction actions
         file_system_path = profile_data.get('file_system_path', '/workspace/browser-use')
         self.file_system = FileSystem(base_dir=Path(file_system_path).expanduser())
+        self.browser_session = browser_session
+
+    async def _memory_usage_mb(self) -> float:
+        """Sum of the used JS heap of all pages in this browser context."""
+        total = 0
+        for page in self.browser_session.tabs:
+            if page.is_closed():
+                continue
+            try:
+                total += await page.evaluate("() => performance.memory ? performance.memory.usedJSHeapSize : 0")
+            except Exception:
+                continue
+        return total / 1024 / 1024
+
+    async def _enforce_memory_limit(self) -> str | None:
+        """Restart the browser context when it exceeds max_memory_mb, returning a notice for the model."""
+        if not self.browser_session or not self.max_memory_mb:
+            return None
+        usage = await self._memory_usage_mb()
+        if usage <= self.max_memory_mb:
+            return None
+        await self._close_browser()
+        self.extract_cache.invalidate(lambda key: True)
+        await self._ensure_session()
+        return (f'Browser context used {usage:.0f}MB (limit {self.max_memory_mb}MB) and was restarted, '
+                f'all previously opened tabs were closed')
 
     async def _navigate(self, url: str, new_tab: bool = False) -> str:
         """Navigate to a URL."""
         if not self.browser_session:
             return 'Error: No browser session active'
 
+        await self._invalidate_extract_cache()
         if new_tab:
             page = await self.browser_session.navigate(url, new_tab=True)
             tab_idx = self.browser_session.tabs.index(page)
+            self._record_first_action()
             return f'Opened new tab #{tab_idx} with URL: {url}'
         else:
             await self.browser_session.navigate(url)
+            self._record_first_action()
             return f'Navigated to: {url}'
 
     async def _click(self, index: int, new_tab: bool = False) -> str:
@@ -100,6 +217,7 @@ class BrowserUseLight:
         if not element:
             return f'Element with index {index} not found'
 
+        await self._invalidate_extract_cache()
         if new_tab:
             # For links, extract href and open in new tab
             href = element.attributes.get('href')
@@ -137,50 +255,79 @@ class BrowserUseLight:
             await self.browser_session._click_element_node(element)
             return f'Clicked element {index}'
 
-    async def _get_browser_state(self) -> str:
-        """Get current browser state."""
+    async def _get_browser_state(
+        self,
+        full_snapshot: bool = False,
+        query: str = "",
+        top_k: int = 20,
+        region: str = "all",
+        offset: int = 0,
+        limit: int = 0,
+    ) -> str:
+        """
+        Get current browser state, or its diff against the last state emitted for the current tab.
+        When query, region or paging is given, only the matching elements are returned.
+        """
         if not self.browser_session:
             return 'Error: No browser session active'
 
         state = await self.browser_session.get_state_summary(cache_clickable_elements_hashes=False)
+        page = await self.browser_session.get_current_page()
 
         result = {
             'url': state.url,
             'title': state.title,
             'tabs': [{'url': tab.url, 'title': tab.title} for tab in state.tabs],
-            'interactive_elements': [],
+            # Add interactive elements with their indices
+            'interactive_elements': [element_info(index, element) for index, element in state.selector_map.items()],
         }
 
-        # Add interactive elements with their indices
-        for index, element in state.selector_map.items():
-            raw_str = element.clickable_elements_to_string().replace('\t', '').replace('\n[', '[')
-            # 匹配所有的 "[数字]"，返回所有索引
-            all_indices = [int(x) for x in re.findall(r'\[(\d+)\]', raw_str)]
-            # main_idx = all_indices[0] if all_indices else None
-            sub_element_indices = all_indices[1:] if len(all_indices) > 1 else []
-
-            # 提取第一个 <xxx ... /> 作为主元素标签内容
-            main_tag_match = re.search(r'\[\d+\]<(.*?)\/>', raw_str)
-            main_tag_text = '<' + main_tag_match.group(1).strip() + '/>' if main_tag_match else ""
-
-            elem_info = {
-                'index': index,
-                'tag': element.tag_name,
-                'text': main_tag_text,
-                # 'sub_element_index': sub_element_indices,
-            }
-            if element.attributes.get('placeholder'):
-                elem_info['placeholder'] = element.attributes['placeholder']
-            if element.attributes.get('href'):
-                elem_info['href'] = element.attributes['href']
-            result['interactive_elements'].append(elem_info)
-
-        return "============== BROWSER INFO BEGIN ==============\n" + json.dumps(result) + "\n============== BROWSER INFO END =============="
-
-    async def _extract_content_by_vision(self, query: str) -> str:
+        if query.strip() or region != "all" or offset or limit:
+            regions = {index: element_region(element) for index, element in state.selector_map.items()}
+            selected, cursor = filter_elements(
+                result['interactive_elements'], query=query, top_k=top_k, region=region,
+                regions=regions, offset=offset, limit=limit,
+            )
+            return self.state_tracker.render_filtered(result, selected, cursor, query=query, region=region)
 
-        state = await self.browser_session.get_state_summary(cache_clickable_elements_hashes=False)
+        return self.state_tracker.render(id(page), result, full_snapshot=full_snapshot)
+
+    async def _mark_elements(self) -> None:
+        """Draw highlight marks for interactive elements without recording a state for diffs."""
+        if self.browser_session:
+            await self.browser_session.get_state_summary(cache_clickable_elements_hashes=False)
+
+    async def _capture_screenshot(self) -> tuple[str, str, str, int]:
+        """
+        Capture only a viewport screenshot, downscaled and re-encoded for the vision model.
+        Returns (base64 image, mime type, digest of the original screenshot, size of the original base64 screenshot).
+        """
+        raw_b64 = await self.browser_session.take_screenshot()
+        raw = base64.b64decode(raw_b64)
+        image, mime = await asyncio.to_thread(
+            downscale_image, raw, self.screenshot_max_width, self.screenshot_max_height, self.screenshot_quality
+        )
+        return base64.b64encode(image).decode("utf-8"), mime, hashlib.sha256(raw).hexdigest(), len(raw_b64)
 
+    async def _extract_content_by_vision(self, query: str, fingerprint: tuple[str, str] | None = None) -> str:
+        """
+        fingerprint: (URL, DOM hash) of the current page when the caller has already computed it.
+        """
+        if not self.browser_session:
+            return 'Error: No browser session active'
+
+        url, dom_hash = fingerprint or await self._page_fingerprint()
+        image_b64, mime, digest, raw_size = await self._capture_screenshot()
+        key = (url, dom_hash, digest, " ".join(query.split()))
+        self.vision_stats["calls"] += 1
+
+        # 同一页面的DOM与截图都没有变化、且问题相同时，直接复用先前的回答
+        entry = self.vision_cache.get(key)
+        if entry is not None:
+            self._report_vision(hit=True, bytes_saved=raw_size, seconds_saved=entry["seconds"])
+            return entry["answer"]
+
+        start = time.perf_counter()
         response = await self.llm.get_client().chat.completions.create(
             model=self.llm.model,
             messages=[
@@ -188,13 +335,62 @@ class BrowserUseLight:
                     {"type": "text", "text": query},
                     {
                         "type": "image_url",
-                        "image_url": {"url": f"data:image/jpeg;base64,{state.screenshot}"}
+                        "image_url": {"url": f"data:{mime};base64,{image_b64}"}
                     }
                 ]}
             ]
         )
+        answer = response.choices[0].message.content
+        self.vision_cache.set(key, {"answer": answer, "seconds": time.perf_counter() - start})
+        self._report_vision(hit=False, bytes_saved=raw_size - len(image_b64), seconds_saved=0.0)
+
+        return answer
+
+    def _report_vision(self, hit: bool, bytes_saved: int, seconds_saved: float) -> None:
+        self.vision_stats["cache_hits"] += hit
+        self.vision_stats["bytes_saved"] += bytes_saved
+        self.vision_stats["seconds_saved"] += seconds_saved
+        self.logger.log(
+            f"[vision] cache {'hit' if hit else 'miss'}, saved {bytes_saved} bytes and {seconds_saved:.2f}s "
+            f"(total: {self.vision_stats})"
+        )
+
+    async def _page_fingerprint(self) -> tuple[str, str]:
+        """Return the current page URL and a hash of its serialized DOM."""
+        page = await self.browser_session.get_current_page()
+        html = await page.content()
+        return page.url, hashlib.sha256(html.encode("utf-8")).hexdigest()
+
+    async def _invalidate_extract_cache(self) -> None:
+        """Drop cached extraction results of the current page before it is navigated away or mutated."""
+        if not self.browser_session:
+            return
+        page = await self.browser_session.get_current_page()
+        self.extract_cache.invalidate(lambda key: key[0] == page.url)
+
+    async def _extract_page_content(self, query: str) -> dict:
+        """
+        Extract content with both the vision model and the HTML extraction, reusing the cached result
+        when the same query is asked again about an unchanged page.
+        """
+        if not self.browser_session:
+            return {"vision_result": 'Error: No browser session active', "html_result": ''}
+
+        url, dom_hash = await self._page_fingerprint()
+        key = (url, dom_hash, " ".join(query.split()))
+        result = self.extract_cache.get(key)
+        if result is not None:
+            self.logger.log(f"[extract] cache hit for {url} (stats: {self.extract_cache.stats()})")
+            return result
 
-        return response.choices[0].message.content
+        vision_result, html_result = await asyncio.gather(
+            self._extract_content_by_vision(query, (url, dom_hash)), self._extract_content(query, True)
+        )
+        result = {"vision_result": vision_result, "html_result": html_result}
+        if not any(str(value).startswith("Error:") for value in result.values()):
+            self.extract_cache.set(key, result)
+        self.logger.log(f"[extract] cache miss for {url} (stats: {self.extract_cache.stats()})")
+        return result
 
     async def _extract_content(self, query: str, extract_links: bool = False) -> str:
         """Extract content from current page."""
@@ -241,6 +437,7 @@ class BrowserUseLight:
         if not element:
             return f'Element with index {index} not found'
 
+        await self._invalidate_extract_cache()
         await self.browser_session._input_text_element_node(element, text)
         return f"Typed '{text}' into element {index}"
 
@@ -248,6 +445,7 @@ class BrowserUseLight:
         if not self.browser_session:
             return 'Error: No browser session active'
 
+        await self._invalidate_extract_cache()
         page = await self.browser_session.get_current_page()
         await page.keyboard.press(keys)
         return f"Sent keys: {keys}"
@@ -257,15 +455,23 @@ class BrowserUseLight:
         if not self.browser_session:
             return 'Error: No browser session active'
 
+        await self._invalidate_extract_cache()
         await self.browser_session.go_back()
         return 'Navigated back'
 
     async def _close_browser(self) -> str:
         """Close the browser session."""
         if self.browser_session:
-            await self.browser_session.stop()
+            if self.shared_browser is not None:
+                # 只关闭自己的上下文，共享的浏览器进程由BrowserPool管理
+                if self.browser_session.browser_context:
+                    await self.browser_session.browser_context.close()
+            else:
+                await self.browser_session.stop()
             self.browser_session = None
+            self._init_task = None
             self.controller = None
+            self.state_tracker.reset()
             return 'Browser closed'
         return 'No browser session to close'
 
@@ -297,6 +503,17 @@ class BrowserUseLight:
             tab = self.browser_session.tabs[tab_index]
             url = tab.url
             await tab.close()
+            self.state_tracker.reset(id(tab))
             return f'Closed tab {tab_index}: {url}'
         return f'Invalid tab index: {tab_index}'
 
+
+_default_browser: BrowserUseLight | None = None
+
+
+def default_browser() -> BrowserUseLight:
+    """进程级的默认浏览器，供未绑定浏览器上下文的agent使用"""
+    global _default_browser
+    if _default_browser is None:
+        _default_browser = BrowserUseLight()
+    return _default_browser
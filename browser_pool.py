@@ -0,0 +1,86 @@
+import asyncio
+from contextlib import asynccontextmanager
+from typing import AsyncIterator, List
+
+from browser import BROWSER_CONFIG, BrowserUseLight
+from session import bind_browser
+
+
+class BrowserPool:
+    """
+    在同一个Chromium进程中运行多个相互隔离的浏览器上下文（独立的cookie、存储与标签页），供同一进程中的多个agent并发使用
+
+    - 最多同时存在max_contexts个上下文，超出时acquire等待其他agent释放
+    - 每个上下文的JS堆内存超过max_context_memory_mb时，在下一次导航前重建该上下文
+
+    用法：
+        pool = BrowserPool()
+        async with pool.session():
+            await agent.run(task)  # 工具通过session.current_browser()获取本agent的浏览器
+        await pool.close()
+    """
+    def __init__(self, max_contexts: int = None, max_context_memory_mb: float = None, headless: bool = True):
+        pool_cfg = BROWSER_CONFIG.get("pool", {})
+        self.max_contexts = max_contexts or pool_cfg.get("max_contexts", 8)
+        self.max_context_memory_mb = max_context_memory_mb or pool_cfg.get("max_context_memory_mb", 1024)
+        self.headless = headless
+
+        self._semaphore = asyncio.Semaphore(self.max_contexts)
+        self._lock = asyncio.Lock()
+        self._playwright = None
+        self._browser = None
+        self.active: List[BrowserUseLight] = []
+
+    async def start(self) -> None:
+        """启动共享的Chromium进程，重复调用时直接返回"""
+        async with self._lock:
+            if self._browser is not None and self._browser.is_connected():
+                return
+            from playwright.async_api import async_playwright
+
+            if self._playwright is None:
+                self._playwright = await async_playwright().start()
+            self._browser = await self._playwright.chromium.launch(headless=self.headless)
+
+    async def acquire(self) -> BrowserUseLight:
+        await self._semaphore.acquire()
+        try:
+            await self.start()
+        except BaseException:
+            self._semaphore.release()
+            raise
+        browser = BrowserUseLight(
+            shared_browser=self._browser,
+            playwright=self._playwright,
+            max_memory_mb=self.max_context_memory_mb,
+        )
+        self.active.append(browser)
+        return browser
+
+    async def release(self, browser: BrowserUseLight) -> None:
+        try:
+            await browser._close_browser()
+        finally:
+            if browser in self.active:
+                self.active.remove(browser)
+            self._semaphore.release()
+
+    @asynccontextmanager
+    async def session(self) -> AsyncIterator[BrowserUseLight]:
+        """获取一个浏览器上下文，并在with块内绑定为当前协程的浏览器"""
+        browser = await self.acquire()
+        try:
+            with bind_browser(browser):
+                yield browser
+        finally:
+            await self.release(browser)
+
+    async def close(self) -> None:
+        for browser in list(self.active):
+            await self.release(browser)
+        if self._browser is not None:
+            await self._browser.close()
+            self._browser = None
+        if self._playwright is not None:
+            await self._playwright.stop()
+            self._playwright = None
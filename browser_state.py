@@ -0,0 +1,171 @@
+import json
+import re
+from typing import Any, Dict, List, Optional, Tuple
+
+from retrieval import BM25Index
+
+BROWSER_INFO_BEGIN = "============== BROWSER INFO BEGIN =============="
+BROWSER_INFO_END = "============== BROWSER INFO END =============="
+# 元素相对于当前可视区域的位置
+REGIONS = ("all", "viewport", "above", "below")
+# 元素字符串中第一个 <xxx ... /> 为主元素标签
+MAIN_TAG_PATTERN = re.compile(r'\[\d+\]<(.*?)\/>')
+
+
+def wrap_browser_info(payload: Any) -> str:
+    return BROWSER_INFO_BEGIN + "\n" + json.dumps(payload) + "\n" + BROWSER_INFO_END
+
+
+def element_info(index: int, element) -> Dict[str, Any]:
+    """将DOM树中的可交互元素转换为给模型阅读的简要信息"""
+    raw_str = element.clickable_elements_to_string().replace('\t', '').replace('\n[', '[')
+    # 匹配所有的 "[数字]"，返回所有索引
+    # all_indices = [int(x) for x in re.findall(r'\[(\d+)\]', raw_str)]
+    # sub_element_indices = all_indices[1:] if len(all_indices) > 1 else []
+
+    # 提取第一个 <xxx ... /> 作为主元素标签内容
+    main_tag_match = MAIN_TAG_PATTERN.search(raw_str)
+    main_tag_text = '<' + main_tag_match.group(1).strip() + '/>' if main_tag_match else ""
+
+    elem_info = {
+        'index': index,
+        'tag': element.tag_name,
+        'text': main_tag_text,
+        # 'sub_element_index': sub_element_indices,
+    }
+    if element.attributes.get('placeholder'):
+        elem_info['placeholder'] = element.attributes['placeholder']
+    if element.attributes.get('href'):
+        elem_info['href'] = element.attributes['href']
+    return elem_info
+
+
+def element_region(element) -> Optional[str]:
+    """根据DOM节点的视口信息判断元素位于可视区域内、上方还是下方，缺少信息时返回None"""
+    if getattr(element, 'is_in_viewport', False):
+        return "viewport"
+    coordinates = getattr(element, 'viewport_coordinates', None)
+    if coordinates is None:
+        return None
+    return "above" if coordinates.top_left.y < 0 else "below"
+
+
+def filter_elements(
+    elements: List[dict],
+    query: str = "",
+    top_k: int = 20,
+    region: str = "all",
+    regions: Dict[int, Optional[str]] = None,
+    offset: int = 0,
+    limit: int = 0,
+) -> Tuple[List[dict], Optional[dict]]:
+    """
+    按查询相关性、视口区域和偏移量筛选元素，返回筛选结果以及获取后续元素的游标（没有更多元素时为None）
+
+    - query: 非空时用BM25对元素的text、placeholder、href打分，只保留得分最高的top_k个，按得分降序排列
+    - region: 只保留位于指定区域的元素，缺少视口信息的元素总是保留
+    - offset/limit: 在上述结果中分页，limit为0时不分页
+    """
+    if region != "all":
+        if region not in REGIONS:
+            raise ValueError(f"Unknown region '{region}', expected one of {REGIONS}")
+        regions = regions or {}
+        elements = [elem for elem in elements if regions.get(elem['index']) in (region, None)]
+
+    if query.strip():
+        index = BM25Index([
+            " ".join(str(elem.get(key, "")) for key in ('text', 'placeholder', 'href')) for elem in elements
+        ])
+        elements = [elements[i] for i, _ in index.search(query, top_k)]
+
+    if limit <= 0:
+        return elements[offset:], None
+    page = elements[offset:offset + limit]
+    remaining = len(elements) - offset - len(page)
+    cursor = {'offset': offset + len(page), 'remaining': remaining} if remaining > 0 else None
+    return page, cursor
+
+
+def _keyed_elements(elements: List[dict]) -> Dict[Tuple, dict]:
+    """
+    元素的index会随着DOM变化重新编号，因此按元素内容（去掉index）作为key
+    内容相同的元素按出现顺序编号区分
+    """
+    keyed, seen = {}, {}
+    for elem in elements:
+        signature = tuple(sorted((k, v) for k, v in elem.items() if k != 'index'))
+        occurrence = seen.get(signature, 0)
+        seen[signature] = occurrence + 1
+        keyed[(signature, occurrence)] = elem
+    return keyed
+
+
+def diff_elements(previous: List[dict], current: List[dict]) -> Dict[str, list]:
+    """比较两次浏览器状态中的可交互元素，返回新增、移除以及仅index变化的元素"""
+    before, after = _keyed_elements(previous), _keyed_elements(current)
+    return {
+        'added': [elem for key, elem in after.items() if key not in before],
+        'removed': [elem for key, elem in before.items() if key not in after],
+        'changed': [
+            {**elem, 'previous_index': before[key]['index']}
+            for key, elem in after.items() if key in before and before[key]['index'] != elem['index']
+        ],
+    }
+
+
+class BrowserStateTracker:
+    """
+    记录每个标签页上一次输出给模型的浏览器状态，后续只输出增量
+
+    - 标签页首次获取、URL变化、要求完整快照或距离上次完整快照超过snapshot_interval次时，输出完整状态
+    - 其余情况下输出"自第N次获取以来没有变化"，或者新增、移除、index变化的元素
+    """
+    def __init__(self, snapshot_interval: int = 5):
+        self.snapshot_interval = snapshot_interval
+        self.step = 0
+        self._last_states: Dict[Any, dict] = {}
+
+    def reset(self, tab_key: Any = None) -> None:
+        if tab_key is None:
+            self._last_states.clear()
+        else:
+            self._last_states.pop(tab_key, None)
+
+    def render(self, tab_key: Any, state: dict, full_snapshot: bool = False) -> str:
+        """
+        state: 包含url、title、tabs、interactive_elements的完整浏览器状态
+        """
+        self.step += 1
+        last = self._last_states.get(tab_key)
+
+        if (
+            full_snapshot
+            or last is None
+            or last['state']['url'] != state['url']
+            or self.step - last['snapshot_step'] >= self.snapshot_interval
+        ):
+            self._last_states[tab_key] = {'state': state, 'step': self.step, 'snapshot_step': self.step}
+            return wrap_browser_info({'step': self.step, 'mode': 'full', **state})
+
+        diff = diff_elements(last['state']['interactive_elements'], state['interactive_elements'])
+        page_changed = {k: state[k] for k in ('title', 'tabs') if state[k] != last['state'][k]}
+        if not page_changed and not any(diff.values()):
+            return wrap_browser_info(
+                f"Browser state unchanged since step {last['step']}, "
+                f"the interactive elements of step {last['step']} are still valid."
+            )
+
+        payload = {'step': self.step, 'mode': 'diff', 'base_step': last['step'], 'url': state['url'], **page_changed}
+        payload.update({k: v for k, v in diff.items() if v})
+        self._last_states[tab_key] = {'state': state, 'step': self.step, 'snapshot_step': last['snapshot_step']}
+        return wrap_browser_info(payload)
+
+    def render_filtered(self, state: dict, selected: List[dict], cursor: Optional[dict], **criteria) -> str:
+        """输出筛选后的部分元素，筛选结果不作为后续增量的基准"""
+        self.step += 1
+        payload = {'step': self.step, 'mode': 'filtered', 'url': state['url'], 'title': state['title'],
+                   'tabs': state['tabs'], 'criteria': {k: v for k, v in criteria.items() if v},
+                   'total_elements': len(state['interactive_elements']), 'interactive_elements': selected}
+        if cursor:
+            payload['cursor'] = cursor
+        return wrap_browser_info(payload)
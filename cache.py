@@ -0,0 +1,144 @@
+import hashlib
+import json
+import time
+from collections import OrderedDict
+from pathlib import Path
+from typing import Any, Callable, Dict, Hashable, Optional, Tuple
+
+
+class LRUCache:
+    """
+    有容量上限的LRU缓存，记录命中与未命中次数
+    ttl大于0时，条目写入超过ttl秒后视为过期
+    """
+    def __init__(self, maxsize: int = 128, ttl: float = 0):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        # key -> (value, 写入时间)
+        self._data: OrderedDict = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+
+    def __len__(self) -> int:
+        return len(self._data)
+
+    def __contains__(self, key: Hashable) -> bool:
+        return key in self._data and not self._expired(key)
+
+    def _expired(self, key: Hashable) -> bool:
+        if self.ttl > 0 and time.time() - self._data[key][1] > self.ttl:
+            del self._data[key]
+            return True
+        return False
+
+    def get(self, key: Hashable, default: Any = None) -> Any:
+        if key in self._data and not self._expired(key):
+            self._data.move_to_end(key)
+            self.hits += 1
+            return self._data[key][0]
+        self.misses += 1
+        return default
+
+    def find(self, predicate: Callable[[Hashable, Any], bool]) -> Optional[Tuple[Hashable, Any]]:
+        """按条件查找第一个满足的条目（从最近使用的开始），用于无法直接按key匹配的近似查找"""
+        for key in reversed(list(self._data)):
+            if self._expired(key):
+                continue
+            value = self._data[key][0]
+            if predicate(key, value):
+                self._data.move_to_end(key)
+                self.hits += 1
+                return key, value
+        self.misses += 1
+        return None
+
+    def set(self, key: Hashable, value: Any) -> None:
+        self._data[key] = (value, time.time())
+        self._data.move_to_end(key)
+        while len(self._data) > self.maxsize:
+            self._data.popitem(last=False)
+
+    def discard(self, predicate: Callable[[Hashable], bool]) -> int:
+        """移除key满足条件的所有条目，返回移除的数量"""
+        keys = [key for key in self._data if predicate(key)]
+        for key in keys:
+            del self._data[key]
+        return len(keys)
+
+    def items(self):
+        return [(key, value) for key, (value, _) in self._data.items()]
+
+    def clear(self) -> None:
+        self._data.clear()
+
+    def stats(self) -> Dict[str, int]:
+        return {"size": len(self._data), "hits": self.hits, "misses": self.misses}
+
+
+class DiskCache:
+    """
+    以JSON文件持久化的缓存，key序列化后取sha256作为文件名，value需要可以被JSON序列化
+    """
+    def __init__(self, path: str | Path, ttl: float = 0):
+        self.path = Path(path)
+        self.path.mkdir(parents=True, exist_ok=True)
+        self.ttl = ttl
+
+    def _file(self, key: Hashable) -> Path:
+        digest = hashlib.sha256(json.dumps(key, ensure_ascii=False).encode("utf-8")).hexdigest()
+        return self.path / f"{digest}.json"
+
+    def get(self, key: Hashable, default: Any = None) -> Any:
+        file = self._file(key)
+        try:
+            record = json.loads(file.read_text(encoding="utf-8"))
+        except (OSError, json.JSONDecodeError):
+            return default
+        if self.ttl > 0 and time.time() - record["stored_at"] > self.ttl:
+            file.unlink(missing_ok=True)
+            return default
+        return record["value"]
+
+    def set(self, key: Hashable, value: Any) -> None:
+        record = {"stored_at": time.time(), "value": value}
+        self._file(key).write_text(json.dumps(record, ensure_ascii=False), encoding="utf-8")
+
+
+class TieredCache:
+    """
+    内存LRU + 可选的磁盘缓存，先查内存，内存未命中时查磁盘并回填内存
+    """
+    _MISSING = object()
+
+    def __init__(self, maxsize: int = 128, ttl: float = 0, disk_path: str | Path | None = None):
+        self.memory = LRUCache(maxsize=maxsize, ttl=ttl)
+        self.disk = DiskCache(disk_path, ttl=ttl) if disk_path else None
+        self.counts = {"memory_hits": 0, "disk_hits": 0, "misses": 0}
+
+    def get(self, key: Hashable, default: Any = None) -> Any:
+        value = self.memory.get(key, self._MISSING)
+        if value is not self._MISSING:
+            self.counts["memory_hits"] += 1
+            return value
+        if self.disk is not None:
+            value = self.disk.get(key, self._MISSING)
+            if value is not self._MISSING:
+                self.counts["disk_hits"] += 1
+                self.memory.set(key, value)
+                return value
+        self.counts["misses"] += 1
+        return default
+
+    def set(self, key: Hashable, value: Any) -> None:
+        self.memory.set(key, value)
+        if self.disk is not None:
+            self.disk.set(key, value)
+
+    def invalidate(self, predicate: Callable[[Hashable], bool]) -> int:
+        """
+        移除内存中key满足条件的条目；磁盘中的条目依靠key中的页面指纹与ttl失效
+        """
+        return self.memory.discard(predicate)
+
+    def stats(self) -> Dict[str, int]:
+        return {"size": len(self.memory), **self.counts}
@@ -0,0 +1,74 @@
+import asyncio
+import importlib.util
+import weakref
+from typing import Dict, Iterable, Tuple
+
+import httpx
+from openai import AsyncOpenAI
+
+
+class HttpClientRegistry:
+    """
+    进程级的HTTP客户端注册器，按base_url复用连接池，避免每个LLM实例都重新建立连接和TLS握手
+
+    异步客户端的连接池绑定在事件循环上，因此按(事件循环, base_url)缓存；同步客户端只按base_url缓存
+    """
+    def __init__(self, settings: dict = None):
+        settings = settings or {}
+        self.limits = httpx.Limits(
+            max_connections=settings.get("max_connections", 100),
+            max_keepalive_connections=settings.get("max_keepalive_connections", 20),
+            keepalive_expiry=settings.get("keepalive_expiry", 60),
+        )
+        self.timeout = httpx.Timeout(settings.get("timeout", 600), connect=settings.get("connect_timeout", 10))
+        self.verify = settings.get("verify", False)
+        # http2依赖h2库，未安装时回退到http1.1
+        self.http2 = settings.get("http2", False) and importlib.util.find_spec("h2") is not None
+
+        self._async_clients: weakref.WeakKeyDictionary = weakref.WeakKeyDictionary()
+        self._openai_clients: weakref.WeakKeyDictionary = weakref.WeakKeyDictionary()
+        self._sync_clients: Dict[str, httpx.Client] = {}
+
+    def get_async_client(self, base_url: str) -> httpx.AsyncClient:
+        """获取当前事件循环下base_url对应的共享异步客户端，必须在事件循环中调用"""
+        clients = self._async_clients.setdefault(asyncio.get_running_loop(), {})
+        if base_url not in clients:
+            clients[base_url] = httpx.AsyncClient(
+                limits=self.limits, timeout=self.timeout, verify=self.verify, http2=self.http2
+            )
+        return clients[base_url]
+
+    def get_openai_client(self, base_url: str, api_key: str) -> AsyncOpenAI:
+        """获取共享连接池的AsyncOpenAI客户端"""
+        clients: Dict[Tuple[str, str], AsyncOpenAI] = self._openai_clients.setdefault(asyncio.get_running_loop(), {})
+        if (base_url, api_key) not in clients:
+            clients[(base_url, api_key)] = AsyncOpenAI(
+                api_key=api_key,
+                base_url=base_url,
+                http_client=self.get_async_client(base_url),
+            )
+        return clients[(base_url, api_key)]
+
+    def get_sync_client(self, base_url: str) -> httpx.Client:
+        """获取base_url对应的共享同步客户端"""
+        if base_url not in self._sync_clients:
+            self._sync_clients[base_url] = httpx.Client(
+                limits=self.limits, timeout=self.timeout, verify=self.verify, http2=self.http2
+            )
+        return self._sync_clients[base_url]
+
+    async def preconnect(self, base_urls: Iterable[str]) -> None:
+        """提前与各base_url建立连接，使第一次LLM请求不需要等待TCP和TLS握手"""
+        async def connect(base_url: str):
+            try:
+                await self.get_async_client(base_url).head(base_url, timeout=self.timeout.connect)
+            except httpx.HTTPError as e:
+                print(f"Preconnect to {base_url} failed: {e}")
+
+        await asyncio.gather(*(connect(base_url) for base_url in set(base_urls) if base_url))
+
+    async def aclose(self) -> None:
+        """关闭当前事件循环下的所有异步客户端"""
+        clients = self._async_clients.pop(asyncio.get_running_loop(), {})
+        self._openai_clients.pop(asyncio.get_running_loop(), None)
+        await asyncio.gather(*(client.aclose() for client in clients.values()))
@@ -0,0 +1,211 @@
+import json
+import re
+from typing import Dict, List
+
+from browser_state import BROWSER_INFO_BEGIN
+from utils import remove_browser_info_in_the_history
+
+# 中日韩字符大致每个字符对应一个token，其他字符大致每4个字符对应一个token
+CJK_PATTERN = re.compile(r"[\u3000-\u303f\u3040-\u30ff\u4e00-\u9fff\uac00-\ud7af\uff00-\uffef]")
+IMAGE_TOKENS = 1000
+
+
+def estimate_messages_tokens(messages: List[dict]) -> int:
+    """不依赖具体tokenizer的消息列表token数估计，图像按IMAGE_TOKENS计"""
+    tokens = 0
+    for message in messages:
+        content = message.get("content")
+        if isinstance(content, str):
+            tokens += estimate_tokens(content)
+            continue
+        for block in content or []:
+            tokens += estimate_tokens(block["text"]) if block.get("type") == "text" else IMAGE_TOKENS
+    return tokens
+
+
+def common_prefix_length(a: str, b: str, chunk: int = 4096) -> int:
+    """两个字符串相同前缀的长度，先按块比较（在C中完成），再在第一个不同的块内逐字符比较"""
+    limit = min(len(a), len(b))
+    start = 0
+    while start < limit and a[start:start + chunk] == b[start:start + chunk]:
+        start += chunk
+    for i in range(start, min(start + chunk, limit)):
+        if a[i] != b[i]:
+            return i
+    return limit
+
+
+def estimate_tokens(text: str) -> int:
+    """不依赖具体tokenizer的token数估计"""
+    cjk = len(CJK_PATTERN.findall(text))
+    return cjk + (len(text) - cjk + 3) // 4
+
+
+class PromptStabilityTracker:
+    """
+    统计相邻两次请求之间，prompt中保持字节级不变的前缀所占的比例
+    前缀越稳定，服务端的prompt cache越容易命中
+    """
+    def __init__(self):
+        self.last_serialized: str = ""
+        self.calls = 0
+        self.stable_chars = 0
+        self.total_chars = 0
+        self.last_ratio = 0.0
+
+    @staticmethod
+    def serialize(messages: List[dict]) -> str:
+        # 与请求体的序列化方式保持一致，不对key排序
+        return json.dumps(messages, ensure_ascii=False)
+
+    def update(self, messages: List[dict]) -> float:
+        """记录一次请求的消息列表，返回其与上一次请求相同的前缀占比"""
+        serialized = self.serialize(messages)
+        stable = common_prefix_length(self.last_serialized, serialized) if self.last_serialized else 0
+
+        self.calls += 1
+        self.stable_chars += stable
+        self.total_chars += len(serialized)
+        self.last_ratio = stable / len(serialized) if serialized else 0.0
+        self.last_serialized = serialized
+        return self.last_ratio
+
+    @property
+    def overall_ratio(self) -> float:
+        return self.stable_chars / self.total_chars if self.total_chars else 0.0
+
+    def report(self) -> str:
+        return (f"prompt稳定前缀占比：最近一次 {self.last_ratio:.1%}，"
+                f"累计 {self.overall_ratio:.1%}（共 {self.calls} 次请求）")
+
+
+class ContextManager:
+    """
+    按token预算管理历史记录，超出预算时优先压缩、截断、移除较早且较大的工具观测
+
+    - 每条消息的token数按文本缓存，只有新增或被改写的消息才会重新计数
+    - 只改动user角色的工具观测，system prompt与最近keep_recent条消息保持不变
+    - 超出预算时一次性压缩到预算的target_ratio以下，使之后若干步的历史前缀保持稳定
+    - 不论是否超出预算，都会移除最近keep_recent条以前的浏览器状态，但最近一次完整的浏览器状态及其之后的增量状态除外，
+      增量状态是相对于它计算的；只有其余内容都处理完仍然超出预算时，才会改写最近一次完整的浏览器状态
+    """
+    OBSERVATION_MARKERS = ("Observation:", BROWSER_INFO_BEGIN)
+    EVICTED_TEXT = "[history observation removed for brevity]"
+    # BrowserStateTracker输出的状态以{"step": N, "mode": ...}开头，作为工具结果时引号会被转义
+    BROWSER_STATE_PATTERN = re.compile(r'\{\\?"step\\?": \d+, \\?"mode\\?": \\?"full\\?"')
+
+    def __init__(
+        self,
+        keep_recent: int = 6,
+        target_ratio: float = 0.8,
+        max_observation_tokens: int = 2000,
+    ):
+        self.keep_recent = keep_recent
+        self.target_ratio = target_ratio
+        self.max_observation_tokens = max_observation_tokens
+        self._token_cache: Dict[str, int] = {}
+        self.last_report: Dict[str, int] = {}
+
+    def count_text(self, text: str) -> int:
+        if text not in self._token_cache:
+            # 被移除的历史消息不会再被查询，缓存过大时直接清空
+            if len(self._token_cache) > 4096:
+                self._token_cache.clear()
+            self._token_cache[text] = estimate_tokens(text)
+        return self._token_cache[text]
+
+    def count_message(self, message: dict) -> int:
+        content = message.get("content")
+        if isinstance(content, str):
+            return self.count_text(content)
+        tokens = 0
+        for block in content or []:
+            if block.get("type") == "text":
+                tokens += self.count_text(block["text"])
+            else:
+                tokens += IMAGE_TOKENS
+        return tokens
+
+    def count(self, messages: List[dict]) -> int:
+        return sum(self.count_message(message) for message in messages)
+
+    def _is_observation(self, message: dict) -> bool:
+        if message.get("role") != "user" or not isinstance(message.get("content"), list):
+            return False
+        text = message["content"][0].get("text", "") if message["content"] else ""
+        return any(marker in text for marker in self.OBSERVATION_MARKERS)
+
+    def latest_snapshot_index(self, history: List[dict]) -> int | None:
+        """最近一次包含完整浏览器状态的工具观测的位置，没有时返回None"""
+        for i in range(len(history) - 1, 0, -1):
+            if self._is_observation(history[i]):
+                text = history[i]["content"][0].get("text", "")
+                if BROWSER_INFO_BEGIN in text and self.BROWSER_STATE_PATTERN.search(text):
+                    return i
+        return None
+
+    def _rewrite(self, history: List[dict], i: int, rewrite) -> int:
+        """改写第i条消息的文本，返回减少的token数"""
+        message = history[i]
+        text = message["content"][0]["text"]
+        new_text = rewrite(text)
+        if new_text == text:
+            return 0
+        old_tokens = self.count_message(message)
+        history[i] = {**message, "content": [{**message["content"][0], "text": new_text}] + message["content"][1:]}
+        return old_tokens - self.count_message(history[i])
+
+    def _truncate(self, text: str) -> str:
+        # 按字符保留首尾，字符数由token上限粗略换算
+        keep_chars = self.max_observation_tokens
+        if len(text) <= keep_chars * 2:
+            return text
+        omitted = len(text) - keep_chars * 2
+        return f"{text[:keep_chars]}\n...[{omitted} characters of history observation omitted]...\n{text[-keep_chars:]}"
+
+    def enforce(self, history: List[dict], token_budget: int) -> Dict[str, int]:
+        """
+        原地修剪history，使其token数不超过token_budget，返回本次修剪的统计信息
+        """
+        before = self.count(history)
+        report = {"before": before, "after": before, "removed": 0, "stripped": 0,
+                  "compacted": 0, "truncated": 0, "evicted": 0, "snapshot_rewritten": False}
+        self.last_report = report
+
+        old = range(1, max(1, len(history) - self.keep_recent))
+        snapshot = self.latest_snapshot_index(history)
+        protected = len(history) if snapshot is None else snapshot
+        total = before
+        # 较早的浏览器状态总是移除，与预算无关
+        for i in old:
+            if i < protected and self._is_observation(history[i]) and BROWSER_INFO_BEGIN in history[i]["content"][0]["text"]:
+                removed = self._rewrite(history, i, remove_browser_info_in_the_history)
+                total -= removed
+                report["stripped"] += removed > 0
+
+        if token_budget is not None and total > token_budget:
+            target = int(token_budget * self.target_ratio)
+            candidates = [i for i in old if i < protected and self._is_observation(history[i])]
+            # 越早、越大的观测越优先处理
+            candidates.sort(key=lambda i: self.count_message(history[i]) * (2 - i / len(history)), reverse=True)
+            stages = [
+                ("compacted", remove_browser_info_in_the_history),
+                ("truncated", self._truncate),
+                ("evicted", lambda _: self.EVICTED_TEXT),
+            ]
+            # 其余观测都处理完仍然超出预算时，才处理最近一次完整的浏览器状态及其之后的观测
+            for group in (candidates, [i for i in old if i >= protected and self._is_observation(history[i])]):
+                for stage, rewrite in stages:
+                    for i in group:
+                        if total <= target:
+                            break
+                        removed = self._rewrite(history, i, rewrite)
+                        if removed:
+                            total -= removed
+                            report[stage] += 1
+                            # 增量状态的基准已经不在上下文中，浏览器需要重新输出完整状态
+                            report["snapshot_rewritten"] |= i >= protected
+
+        report["after"] = total
+        report["removed"] = before - total
+        return report
@@ -0,0 +1,41 @@
+import io
+from typing import Tuple
+
+from PIL import Image
+
+
+def downscale_image(
+    data: bytes,
+    max_width: int,
+    max_height: int,
+    quality: int = 75,
+) -> Tuple[bytes, str]:
+    """
+    将图像等比缩放到不超过max_width x max_height，并重新编码
+    不含透明通道的图像编码为JPEG，含透明通道的编码为PNG，返回(图像数据, MIME类型)
+    """
+    with Image.open(io.BytesIO(data)) as image:
+        image.thumbnail((max_width, max_height))
+        buffer = io.BytesIO()
+        if image.mode in ("RGBA", "LA") or (image.mode == "P" and "transparency" in image.info):
+            image.save(buffer, format="PNG", optimize=True)
+            return buffer.getvalue(), "image/png"
+        image.convert("RGB").save(buffer, format="JPEG", quality=quality, optimize=True)
+        return buffer.getvalue(), "image/jpeg"
+
+
+# 模型接口可以直接接受的图像格式
+PASSTHROUGH_FORMATS = {"JPEG": "image/jpeg", "PNG": "image/png", "WEBP": "image/webp", "GIF": "image/gif"}
+
+
+def prepare_image(data: bytes, max_size: int, quality: int = 85) -> Tuple[bytes, str]:
+    """
+    检测图像的真实格式：格式可以直接发送且长边不超过max_size时原样返回，否则等比缩放并重新编码
+    返回(图像数据, MIME类型)
+    """
+    with Image.open(io.BytesIO(data)) as image:
+        image_format, size = image.format, image.size
+    if image_format in PASSTHROUGH_FORMATS and max(size) <= max_size:
+        return data, PASSTHROUGH_FORMATS[image_format]
+    return downscale_image(data, max_size, max_size, quality)
+
@@ -0,0 +1,125 @@
+"""
+系统记忆的检索索引：把记忆文件拆分为条目，用BM25检索与当前任务、任务步骤相关的条目，而不是把整个文件注入system prompt
+
+记忆文件通常是模型总结出的JSON代码块（{"<dilemma>": "<methodology>"}或{"<application>": {"<problem>": "<solution>"}}），
+无法解析为JSON时按空行分段；文件的修改时间或大小变化时只重新解析该文件
+"""
+import json
+import os
+import re
+from dataclasses import dataclass
+from pathlib import Path
+from typing import Any, Dict, List, Tuple
+
+from context import estimate_tokens
+from retrieval import BM25Index
+
+JSON_BLOCK_PATTERN = re.compile(r"```json\s*\n(.*?)\n```", re.DOTALL | re.IGNORECASE)
+
+
+@dataclass
+class MemoryEntry:
+    source: str
+    text: str
+    tokens: int
+
+
+def split_memory(text: str) -> List[str]:
+    """把一个记忆文件的内容拆分为条目文本"""
+    match = JSON_BLOCK_PATTERN.search(text)
+    try:
+        data = json.loads(match.group(1) if match else text)
+    except json.JSONDecodeError:
+        data = None
+
+    if not isinstance(data, dict):
+        return [paragraph.strip() for paragraph in re.split(r"\n\s*\n", text) if paragraph.strip()]
+
+    entries = []
+
+    def walk(value: Any, path: Tuple[str, ...]) -> None:
+        if isinstance(value, dict) and value:
+            for key, child in value.items():
+                walk(child, path + (str(key),))
+        else:
+            content = value if isinstance(value, str) else json.dumps(value, ensure_ascii=False)
+            entries.append(f"- {' / '.join(path)}: {content}")
+
+    walk(data, ())
+    return entries
+
+
+class MemoryIndex:
+    """
+    sources: 记忆名称（注入时用作标签名）到记忆文件路径的映射
+    """
+    def __init__(self, sources: Dict[str, str | Path]):
+        self.sources = {name: Path(path) for name, path in sources.items()}
+        self.entries: List[MemoryEntry] = []
+        self.index = BM25Index()
+        self._files: Dict[str, Tuple[Tuple[int, int], List[MemoryEntry]]] = {}
+        self.rebuilds = 0
+
+    @property
+    def total_tokens(self) -> int:
+        """整体注入全部记忆时的token数"""
+        return sum(entry.tokens for entry in self.entries)
+
+    def refresh(self) -> bool:
+        """检查记忆文件是否变化，只重新解析变化的文件，有变化时重建索引并返回True"""
+        changed = False
+        for name, path in self.sources.items():
+            try:
+                stat = os.stat(path)
+                signature = (stat.st_mtime_ns, stat.st_size)
+            except FileNotFoundError:
+                signature = (0, 0)
+            cached = self._files.get(name)
+            if cached is not None and cached[0] == signature:
+                continue
+            text = path.read_text(encoding="utf-8") if signature != (0, 0) else ""
+            self._files[name] = (signature, [MemoryEntry(name, entry, estimate_tokens(entry))
+                                             for entry in split_memory(text)])
+            changed = True
+
+        if changed:
+            self.entries = [entry for _, entries in self._files.values() for entry in entries]
+            self.index = BM25Index([entry.text for entry in self.entries])
+            self.rebuilds += 1
+        return changed
+
+    def retrieve(self, query: str, top_k: int, max_tokens: int, exclude: List[MemoryEntry] = ()) -> List[MemoryEntry]:
+        """返回与query最相关的至多top_k个条目，总token数不超过max_tokens，按记忆文件中的顺序排列"""
+        self.refresh()
+        selected, used = [], 0
+        for document_id, _ in self.index.search(query, len(self.entries)):
+            entry = self.entries[document_id]
+            if entry in exclude or used + entry.tokens > max_tokens:
+                continue
+            selected.append(document_id)
+            used += entry.tokens
+            if len(selected) >= top_k:
+                break
+        return [self.entries[document_id] for document_id in sorted(selected)]
+
+    def select(self, query: str, top_k: int, max_tokens: int, exclude: List[MemoryEntry] = (),
+               fallback_below: int = 0) -> List[MemoryEntry]:
+        """
+        选择要注入的记忆条目，只在确实需要取舍时才使用检索结果：
+        - 除exclude以外的条目总token数不超过max_tokens时全部注入
+        - 与query相关的条目少于fallback_below个时（例如任务描述与记忆使用不同的语言）全部注入
+        """
+        self.refresh()
+        candidates = [entry for entry in self.entries if entry not in exclude]
+        if sum(entry.tokens for entry in candidates) <= max_tokens:
+            return candidates
+        if fallback_below and len(self.index.search(query, len(self.entries))) < fallback_below:
+            return candidates
+        return self.retrieve(query, top_k, max_tokens, exclude=exclude)
+
+    def render(self, entries: List[MemoryEntry]) -> str:
+        """按记忆来源分组渲染，与整体注入时的标签保持一致"""
+        return "".join(
+            f"<{name}>\n" + "\n".join(entry.text for entry in entries if entry.source == name) + f"\n</{name}>\n"
+            for name in self.sources if any(entry.source == name for entry in entries)
+        )
@@ -1,46 +1,97 @@
 import os
 import yaml
-import httpx
+import asyncio
 import base64
-import aiofiles
 import traceback
 from pathlib import Path
 from dotenv import load_dotenv
 from openai import AsyncOpenAI
-from typing import AsyncGenerator, Union
+from typing import AsyncGenerator, Callable, Iterable, Optional, Tuple, Union
+
+from cache import LRUCache
+from client import HttpClientRegistry
+from context import PromptStabilityTracker, estimate_messages_tokens, estimate_tokens
+from imaging import prepare_image
 
 load_dotenv()
 
-with open("config.yaml", "r") as f:
-    raw_config = os.path.expandvars(f.read())
-    config = yaml.safe_load(raw_config)
+# 有libyaml时使用C实现的解析器，解析配置的耗时约为纯Python实现的十分之一
+YAML_LOADER = getattr(yaml, "CSafeLoader", yaml.SafeLoader)
+
+
+def load_config(path: str = "config.yaml") -> dict:
+    with open(path, "r") as f:
+        return yaml.load(os.path.expandvars(f.read()), Loader=YAML_LOADER)
+
+
+config = load_config()
 LLM_CONFIG = config["llm"]
+CACHE_FAMILY_CONFIG = config.get("cache_families", {})
+CONTEXT_CONFIG = config.get("context", {})
+IMAGE_CONFIG = config.get("images", {})
+# 预处理后的图像按(文件路径, 修改时间, 文件大小, 处理参数)缓存，文件被修改后自动失效
+IMAGE_CACHE = LRUCache(maxsize=IMAGE_CONFIG.get("cache_size", 64))
+# 所有LLM调用方（LLM、浏览器、工具）共享的HTTP连接池
+HTTP_CLIENTS = HttpClientRegistry(config.get("http", {}))
+
+
+async def preconnect(model_names: Iterable[str]) -> None:
+    """提前与模型对应的服务建立连接"""
+    await HTTP_CLIENTS.preconnect(
+        LLM_CONFIG[name]["base_url"] for name in model_names if name in LLM_CONFIG
+    )
+
 
 class LLM:
     def __init__(self, model: str="Qwen2.5-VL-7B-Instruct"):
         cfg = LLM_CONFIG.get(model)
         if cfg is None:
             raise ValueError(f"Model '{model}' not found in config.yaml")
-        self.async_client = AsyncOpenAI(
-            api_key=cfg["api_key"],
-            base_url=cfg["base_url"],
-            http_client=httpx.AsyncClient(verify=False)
-        )
+        self.api_key = cfg["api_key"]
+        self.base_url = cfg["base_url"]
         self.model = cfg["model"]
+        # 历史记录的token预算
+        self.context_budget = cfg.get("context_budget", CONTEXT_CONFIG.get("default_budget"))
+        # 发送给模型的图像的最大长边
+        self.max_image_size = cfg.get("max_image_size", IMAGE_CONFIG.get("default_max_size", 2048))
+        # 支持stop参数的模型可以在服务端遇到</tool_call>时直接停止生成（此时一次回复只能包含一个工具调用）
+        self.tool_call_stop = cfg.get("tool_call_stop", False)
+
+        self.family = cfg.get("family", "default")
+        family_cfg = CACHE_FAMILY_CONFIG.get(self.family) or CACHE_FAMILY_CONFIG.get("default", {})
+        self.cache_breakpoints = set(family_cfg.get("breakpoints", []))
+        self.stream_usage = family_cfg.get("stream_usage", False)
+
+        # 记录每次请求的token用量，包括命中prompt cache的token数
+        self.last_usage = {}
+        self.usage_stats = {"calls": 0, "prompt_tokens": 0, "cached_tokens": 0, "completion_tokens": 0}
+        # 提前停止的流式请求拿不到服务端返回的usage，按估计值单独统计，不计入usage_stats
+        self.estimated_usage_stats = {"calls": 0, "prompt_tokens": 0, "completion_tokens": 0}
+        # 流式生成被stop_at提前终止的次数
+        self.stream_stats = {"streams": 0, "early_stops": 0}
+        # 统计相邻两次请求间保持不变的prompt前缀占比
+        self.prompt_stability = PromptStabilityTracker()
+
+    @property
+    def async_client(self) -> AsyncOpenAI:
+        # 客户端的连接池绑定在事件循环上，每次从注册器中按当前事件循环获取
+        return HTTP_CLIENTS.get_openai_client(self.base_url, self.api_key)
 
     async def async_generate(
         self,
         prompt: str,
         image_path: Union[str, Path, None] = None,
-        history: list[dict] = None
+        history: list[dict] = None,
+        track_stability: bool = False,
     ) -> str:
         try:
-            messages = await self.prepare_messages(prompt, image_path, history)
+            messages = await self.prepare_messages(prompt, image_path, history, track_stability)
 
             chat_response = await self.async_client.chat.completions.create(
                 model=self.model,
                 messages=messages
             )
+            self.record_usage(chat_response.usage)
             return chat_response.choices[0].message.content
 
         except Exception as e:
@@ -50,19 +101,53 @@ class LLM:
         self,
         prompt: str,
         image_path: Union[str, Path, None] = None,
-        history: list[dict] = None
+        history: list[dict] = None,
+        stop: list[str] = None,
+        stop_at: Callable[[str], Optional[int]] = None,
+        track_stability: bool = False,
     ) -> AsyncGenerator[str, None]:
+        """
+        stop: 传给服务端的停止序列
+        stop_at: 根据已生成的全部文本返回截断位置，返回非None时只输出截断位置之前的内容并立即关闭流
+        track_stability: 是否把本次请求计入prompt_stability，见prepare_messages
+        """
         try:
-            messages = await self.prepare_messages(prompt, image_path, history)
+            messages = await self.prepare_messages(prompt, image_path, history, track_stability)
 
-            async for chunk in await self.async_client.chat.completions.create(
+            extra_args = {"stream_options": {"include_usage": True}} if self.stream_usage else {}
+            if stop:
+                extra_args["stop"] = stop
+            usage = None
+            text = ""
+            self.stream_stats["streams"] += 1
+            stream = await self.async_client.chat.completions.create(
                 model=self.model,
                 messages=messages,
                 stream=True,
-            ):
+                **extra_args
+            )
+            async for chunk in stream:
+                # 开启include_usage后，最后一个chunk只包含usage而没有choices
+                # 部分代理会在每个chunk中附带累计的usage，因此只保留最后一次出现的usage
+                if chunk.usage is not None:
+                    usage = chunk.usage
+                if not chunk.choices:
+                    continue
                 content = chunk.choices[0].delta.content
-                if content is not None:
-                    yield content
+                if content is None:
+                    continue
+                cut = stop_at(text + content) if stop_at else None
+                if cut is not None:
+                    # 提前关闭连接，服务端随之停止生成，此时拿不到本次请求的usage，只能记录估计值
+                    if cut > len(text):
+                        yield (text + content)[len(text):cut]
+                    self.stream_stats["early_stops"] += 1
+                    await stream.close()
+                    self.record_estimated_usage(messages, (text + content)[:max(cut, len(text))])
+                    return
+                text += content
+                yield content
+            self.record_usage(usage)
 
         except Exception as e:
             yield self.handle_error(e)
@@ -71,15 +156,20 @@ class LLM:
         self,
         prompt: str,
         image_path: Union[str, Path, None],
-        history: list[dict] = None
+        history: list[dict] = None,
+        track_stability: bool = False,
     ) -> list[dict]:
+        """
+        track_stability: 只有agent主流程（规划与行动）的请求才计入prompt_stability，
+        反思、视觉等使用其他历史记录的请求计入后，"相邻两次请求"的前缀比较就失去了意义
+        """
         messages = history.copy() if history else []
 
         if image_path:
-            base64_image = await self.image_to_base64(image_path)
+            base64_image, mime = await self.image_to_base64(image_path)
             content = [
                 {"type": "text", "text": prompt},
-                {"type": "image_url", "image_url": {"url": f"data:image/jpeg;base64,{base64_image}"}},
+                {"type": "image_url", "image_url": {"url": f"data:{mime};base64,{base64_image}"}},
             ]
         else:
             content = [{"type": "text", "text": prompt}]
@@ -87,19 +177,92 @@ class LLM:
         messages.append(
             {"role": "user", "content": content}
         )
+        if self.cache_breakpoints:
+            messages = self.apply_cache_breakpoints(messages)
+        if track_stability:
+            self.prompt_stability.update(messages)
+        return messages
+
+    def apply_cache_breakpoints(self, messages: list[dict]) -> list[dict]:
+        """
+        按照模型家族的配置，为消息打上cache_control标记
+        被修改的消息都会重新构造，不会改动调用方传入的history
+        """
+        def mark(block: dict) -> dict:
+            return {**block, "cache_control": {"type": "ephemeral"}}
+
+        # 工具描述写在system prompt内部，system prompt末尾的标记同时覆盖了工具描述
+        if "system" in self.cache_breakpoints and messages and messages[0].get("role") == "system":
+            blocks = messages[0]["content"]
+            if isinstance(blocks, list) and blocks:
+                messages[0] = {**messages[0], "content": blocks[:-1] + [mark(blocks[-1])]}
+
+        # 最后一条稳定的历史消息即为本轮用户输入之前的那条消息
+        if "history" in self.cache_breakpoints and len(messages) >= 3:
+            last_stable = messages[-2]
+            if isinstance(last_stable.get("content"), list) and last_stable["content"]:
+                messages[-2] = {**last_stable, "content": last_stable["content"][:-1] + [mark(last_stable["content"][-1])]}
+
         return messages
 
+    def record_usage(self, usage) -> None:
+        if usage is None:
+            return
+        # 不同服务商返回cached tokens的字段各不相同
+        details = getattr(usage, "prompt_tokens_details", None)
+        cached_tokens = (
+            getattr(details, "cached_tokens", None)
+            or getattr(usage, "prompt_cache_hit_tokens", None)
+            or getattr(usage, "cache_read_input_tokens", None)
+            or 0
+        )
+        self.last_usage = {
+            "prompt_tokens": usage.prompt_tokens or 0,
+            "cached_tokens": cached_tokens,
+            "completion_tokens": usage.completion_tokens or 0,
+        }
+        self.usage_stats["calls"] += 1
+        for key, value in self.last_usage.items():
+            self.usage_stats[key] += value
+
+    def record_estimated_usage(self, messages: list[dict], completion: str) -> None:
+        """记录没有usage的请求的估计用量，last_usage中以estimated标记"""
+        self.last_usage = {
+            "prompt_tokens": estimate_messages_tokens(messages),
+            "cached_tokens": 0,
+            "completion_tokens": estimate_tokens(completion),
+            "estimated": True,
+        }
+        self.estimated_usage_stats["calls"] += 1
+        self.estimated_usage_stats["prompt_tokens"] += self.last_usage["prompt_tokens"]
+        self.estimated_usage_stats["completion_tokens"] += self.last_usage["completion_tokens"]
+
     def handle_error(self, e: Exception) -> str:
         print(f"==========Error: {e}==========")
         print(traceback.format_exc())
         print(f"==========Model: {self.model}==========")
         return f"ERROR: {type(e).__name__} - {str(e)}"
 
-    async def image_to_base64(self, image_path: Union[str, Path]) -> str:
-        async with aiofiles.open(image_path, "rb") as image_file:
-            content = await image_file.read()
-            encoded_string = base64.b64encode(content).decode("utf-8")
-        return encoded_string
+    async def image_to_base64(self, image_path: Union[str, Path]) -> Tuple[str, str]:
+        """
+        读取图像，按模型的max_image_size缩放并编码为base64，返回(base64字符串, MIME类型)
+        读取与编码在线程中执行，不阻塞事件循环
+        """
+        path = Path(image_path).resolve()
+        stat = await asyncio.to_thread(path.stat)
+        quality = IMAGE_CONFIG.get("jpeg_quality", 85)
+        key = (str(path), stat.st_mtime_ns, stat.st_size, self.max_image_size, quality)
+        cached = IMAGE_CACHE.get(key)
+        if cached is not None:
+            return cached
+
+        def encode() -> Tuple[str, str]:
+            data, mime = prepare_image(path.read_bytes(), self.max_image_size, quality)
+            return base64.b64encode(data).decode("utf-8"), mime
+
+        encoded = await asyncio.to_thread(encode)
+        IMAGE_CACHE.set(key, encoded)
+        return encoded
 
 if __name__ == "__main__":
     print(LLM_CONFIG)
@@ -0,0 +1,78 @@
+"""
+计划库：持久化记录每个任务的描述、任务方案与最终结果，为新任务检索相似的成功历史任务的方案
+
+记录以JSON Lines的形式追加写入memory目录下的文件，检索使用本地的BM25索引，不依赖外部服务
+"""
+import json
+import time
+from pathlib import Path
+from typing import Any, Dict, List, Optional, Tuple
+
+from retrieval import BM25Index
+
+
+class PlanLibrary:
+    def __init__(self, path: str | Path):
+        self.path = Path(path)
+        self.entries: List[Dict[str, Any]] = []
+        # 索引中只包含成功的任务，index_entries[i]为索引中第i篇文档对应的记录
+        self.index = BM25Index()
+        self.index_entries: List[Dict[str, Any]] = []
+        # 每个任务方案最近一次的执行结果，方案最近一次执行失败时不再推荐
+        self.latest_outcomes: Dict[str, str] = {}
+        self.load()
+
+    def __len__(self) -> int:
+        return len(self.entries)
+
+    @staticmethod
+    def plan_key(plan: Dict[str, str]) -> str:
+        return json.dumps(plan, ensure_ascii=False, sort_keys=True)
+
+    def load(self) -> None:
+        if not self.path.exists():
+            return
+        with self.path.open("r", encoding="utf-8") as f:
+            for line in f:
+                if not line.strip():
+                    continue
+                try:
+                    self._add(json.loads(line))
+                except (json.JSONDecodeError, KeyError, AttributeError) as e:
+                    print(f"skip broken plan library entry: {e}")
+
+    def _add(self, entry: Dict[str, Any]) -> None:
+        self.entries.append(entry)
+        self.latest_outcomes[self.plan_key(entry["plan"])] = entry["outcome"]
+        if entry["outcome"] == "success":
+            self.index.add(entry["task"])
+            self.index_entries.append(entry)
+
+    def record(self, task: str, plan: Dict[str, str], outcome: str, **extra: Any) -> Dict[str, Any]:
+        """记录一次任务的执行结果（outcome为"success"或"failure"），并立即写入文件"""
+        entry = {"task": task, "plan": plan, "outcome": outcome, "time": time.strftime("%Y-%m-%d %H:%M:%S"), **extra}
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        with self.path.open("a", encoding="utf-8") as f:
+            f.write(json.dumps(entry, ensure_ascii=False) + "\n")
+        self._add(entry)
+        return entry
+
+    def similarity(self, task: str, document_id: int, score: float) -> float:
+        """
+        BM25得分相对于新任务与历史任务各自以自身为查询时得分中较大者的比例，描述相同的任务为1
+        任意一方比另一方多出的内容都会降低相似度
+        """
+        self_score = max(self.index.self_score(task), self.index.self_score(self.index_entries[document_id]["task"]))
+        return min(1.0, score / self_score) if self_score > 0 else 0.0
+
+    def match(self, task: str, top_k: int = 5) -> Optional[Tuple[Dict[str, Any], float]]:
+        """返回与task最相似、且方案最近一次执行成功的历史任务及其相似度，没有时返回None"""
+        best = None
+        for document_id, score in self.index.search(task, top_k):
+            entry = self.index_entries[document_id]
+            if self.latest_outcomes.get(self.plan_key(entry["plan"])) != "success":
+                continue
+            similarity = self.similarity(task, document_id, score)
+            if best is None or similarity > best[1]:
+                best = (entry, similarity)
+        return best
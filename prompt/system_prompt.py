@@ -73,7 +73,8 @@ password: theagentcompany
 注意：
 - 你必须完整的输出以上内容才能调用工具，包括完整的前后的<tool_call> </tool_call>标签
 - 如果你需要迭代多次调用多个工具，那么每一次你都要输出以上内容。
-- 如果你输出了多个上述工具调用，只有**第一个工具调用**会被执行！！
+- 你可以在一次回复中输出多个相互独立的上述工具调用，它们会按输出顺序执行，结果按相同顺序合并返回；\
+如果某个工具调用依赖另一个工具调用的结果，请等待结果返回后再在下一次回复中输出
 
 ### PROGRESS ###
 在执行任务时，请你一定按照以下流程进行推理以及任务执行：
@@ -165,6 +166,45 @@ jarvis_plan_multi_steps_task_prompt = """\
 除此之外不要输出任何内容，任务步骤名中也不需要序号。
 """
 
+jarvis_fused_plan_prompt = """\
+请你依次完成以下三项内容：
+1. 列出关于当前任务的，所有你已经知道和获取到的事实。
+2. 列出在以解决该任务为目标的情况下，还有哪些你需要去确认和获取的事实。
+3. 为当前任务制定一个分步骤的可执行任务方案，每一个任务步骤，你都需要澄清其目标，以确认何时完成此步骤。
+
+请严格按照如下模板输出：
+* 已知事实有：
+    1. xxx
+    2. xxx
+    ······
+
+* 还需要去确认的事实有：
+    1. xxx
+    2. xxx
+    ······
+
+* 任务方案：
+```json
+{
+    "<name_of_task_step_1>": "<step_goal>",
+    "<name_of_task_step_2>": "<step_goal>",
+    "<name_of_task_step_3>": "<step_goal>"
+}
+```
+JSON之后不要输出任何内容，任务步骤名中也不需要序号。
+"""
+
+jarvis_plan_draft_prompt = """\
+以下是一个相似的历史任务，以及执行成功的任务方案，可以作为制定任务方案的草稿。
+请根据当前任务与历史任务的差异修改、增删其中的步骤，不要照搬与当前任务无关的步骤。
+<similar_task>
+{task}
+</similar_task>
+```json
+{plan}
+```
+"""
+
 jarvis_execute_task_step_prompt = """\
 {task_step}
 
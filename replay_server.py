@@ -0,0 +1,289 @@
+"""
+本地的OpenAI兼容录制/回放服务，用于离线、可复现地运行agent
+
+录制：将请求转发给真实的上游服务，并按照归一化请求的哈希保存响应
+    python replay_server.py record --upstream $BASE_URL --cassette outputs/cassettes/demo
+回放：直接返回录制的响应，可以配置首token延迟(ttft)与生成速度(tps)
+    python replay_server.py replay --cassette outputs/cassettes/demo --ttft 0 --tps 0
+随后将agent的BASE_URL指向该服务即可：
+    BASE_URL=http://127.0.0.1:8765/v1 python run.py <task_name> <task>
+"""
+import argparse
+import asyncio
+import hashlib
+import json
+import os
+import re
+import time
+from pathlib import Path
+
+import httpx
+import uvicorn
+from dotenv import load_dotenv
+
+load_dotenv()
+
+# 请求中会随时间变化的内容，哈希前需要抹去
+VOLATILE_PATTERNS = [
+    re.compile(r"\d{4}-\d{2}-\d{2}[ T]\d{2}:\d{2}:\d{2}(\.\d+)?"),
+]
+# 不影响响应内容的请求字段
+IGNORED_REQUEST_KEYS = {"stream", "stream_options", "user"}
+
+
+def normalize_request(body: dict) -> dict:
+    def normalize(value):
+        if isinstance(value, dict):
+            return {k: normalize(v) for k, v in value.items() if k != "cache_control"}
+        if isinstance(value, list):
+            return [normalize(v) for v in value]
+        if isinstance(value, str):
+            for pattern in VOLATILE_PATTERNS:
+                value = pattern.sub("<VOLATILE>", value)
+        return value
+
+    return normalize({k: v for k, v in body.items() if k not in IGNORED_REQUEST_KEYS})
+
+
+def request_key(body: dict) -> str:
+    normalized = json.dumps(normalize_request(body), ensure_ascii=False, sort_keys=True)
+    return hashlib.sha256(normalized.encode("utf-8")).hexdigest()
+
+
+class Cassette:
+    """
+    按请求哈希保存的响应集合，每个哈希对应一个文件
+    同一请求出现多次时按顺序保存多个响应，回放时也按顺序返回，录制的响应用完后视为未命中
+    """
+    def __init__(self, path: str | Path):
+        self.path = Path(path)
+        self.path.mkdir(parents=True, exist_ok=True)
+        self.cursors = {}
+
+    def _file(self, key: str) -> Path:
+        return self.path / f"{key}.json"
+
+    def load(self, key: str) -> list[dict]:
+        file = self._file(key)
+        if not file.exists():
+            return []
+        return json.loads(file.read_text(encoding="utf-8"))
+
+    def append(self, key: str, request: dict, response: dict) -> None:
+        records = self.load(key)
+        records.append({"request": normalize_request(request), "response": response})
+        self._file(key).write_text(json.dumps(records, ensure_ascii=False, indent=2), encoding="utf-8")
+
+    def next(self, key: str) -> dict | None:
+        records = self.load(key)
+        if not records:
+            return None
+        cursor = self.cursors.get(key, 0)
+        if cursor >= len(records):
+            return None
+        self.cursors[key] = cursor + 1
+        return records[cursor]["response"]
+
+
+class ReplayServer:
+    def __init__(
+        self,
+        mode: str,
+        cassette: str | Path,
+        upstream: str | None = None,
+        api_key: str | None = None,
+        ttft: float = 0.0,
+        tps: float = 0.0,
+        chars_per_token: int = 4,
+    ):
+        if mode not in ("record", "replay"):
+            raise ValueError(f"Unknown mode '{mode}', expected 'record' or 'replay'")
+        if mode == "record" and not upstream:
+            raise ValueError("Record mode requires an upstream base url")
+
+        self.mode = mode
+        self.cassette = Cassette(cassette)
+        self.upstream = upstream.rstrip("/") if upstream else None
+        self.api_key = api_key
+        self.ttft = ttft
+        self.tps = tps
+        self.chars_per_token = chars_per_token
+        self.client = httpx.AsyncClient(timeout=None, verify=False) if upstream else None
+        self.stats = {"requests": 0, "hits": 0, "misses": 0, "recorded": 0}
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] == "lifespan":
+            while True:
+                message = await receive()
+                if message["type"] == "lifespan.startup":
+                    await send({"type": "lifespan.startup.complete"})
+                elif message["type"] == "lifespan.shutdown":
+                    if self.client:
+                        await self.client.aclose()
+                    print(f"replay server stats: {self.stats}")
+                    await send({"type": "lifespan.shutdown.complete"})
+                    return
+
+        if scope["type"] != "http":
+            return
+
+        body = b""
+        more_body = True
+        while more_body:
+            message = await receive()
+            body += message.get("body", b"")
+            more_body = message.get("more_body", False)
+
+        if scope["method"] != "POST" or not scope["path"].endswith("/chat/completions"):
+            await self._send_json(send, 404, {"error": {"message": f"Unsupported endpoint {scope['path']}"}})
+            return
+
+        try:
+            request = json.loads(body)
+        except json.JSONDecodeError as e:
+            await self._send_json(send, 400, {"error": {"message": f"Invalid JSON request body: {e}"}})
+            return
+        self.stats["requests"] += 1
+        key = request_key(request)
+
+        if self.mode == "record":
+            await self._record(send, key, request)
+        else:
+            await self._replay(send, key, request)
+
+    async def _record(self, send, key: str, request: dict) -> None:
+        headers = {"Authorization": f"Bearer {self.api_key}"} if self.api_key else {}
+        url = f"{self.upstream}/chat/completions"
+
+        if not request.get("stream"):
+            upstream_response = await self.client.post(url, json=request, headers=headers)
+            try:
+                payload = upstream_response.json()
+            except json.JSONDecodeError:
+                # 上游出错时可能返回HTML等非JSON内容，包装为JSON错误并保留状态码
+                await self._send_json(send, upstream_response.status_code if upstream_response.status_code >= 400 else 502,
+                                      {"error": {"message": upstream_response.text}})
+                return
+            if upstream_response.status_code == 200:
+                self.cassette.append(key, request, {"stream": False, "body": payload})
+                self.stats["recorded"] += 1
+            await self._send_json(send, upstream_response.status_code, payload)
+            return
+
+        # 流式请求边转发边累积，结束后再写入录制文件，原始的SSE行用于回放时逐字节还原
+        content, usage, lines = "", None, []
+        async with self.client.stream("POST", url, json=request, headers=headers) as upstream_response:
+            content_type = upstream_response.headers.get("content-type", "text/event-stream")
+            await send({"type": "http.response.start", "status": upstream_response.status_code,
+                        "headers": [(b"content-type", content_type.encode("latin-1"))]})
+            async for line in upstream_response.aiter_lines():
+                await send({"type": "http.response.body", "body": (line + "\n").encode("utf-8"), "more_body": True})
+                lines.append(line)
+                if upstream_response.status_code != 200 or not line.startswith("data:") or line.strip() == "data: [DONE]":
+                    continue
+                try:
+                    chunk = json.loads(line[len("data:"):])
+                except json.JSONDecodeError:
+                    continue
+                if chunk.get("usage"):
+                    usage = chunk["usage"]
+                for choice in chunk.get("choices", []):
+                    content += choice.get("delta", {}).get("content") or ""
+
+        # 先写入录制文件再结束响应，保证客户端收到完整响应时录制已经落盘
+        if upstream_response.status_code == 200:
+            self.cassette.append(key, request, {"stream": True, "content": content, "usage": usage,
+                                                "model": request.get("model"), "content_type": content_type,
+                                                "lines": lines})
+            self.stats["recorded"] += 1
+        await send({"type": "http.response.body", "body": b"", "more_body": False})
+
+    async def _replay(self, send, key: str, request: dict) -> None:
+        response = self.cassette.next(key)
+        if response is None:
+            self.stats["misses"] += 1
+            await self._send_json(send, 404, {"error": {"message": f"No recorded response for request {key}"}})
+            return
+        self.stats["hits"] += 1
+
+        content = response["content"] if response["stream"] else \
+            response["body"]["choices"][0]["message"].get("content") or ""
+
+        if self.ttft:
+            await asyncio.sleep(self.ttft)
+
+        if not request.get("stream"):
+            if self.tps:
+                await asyncio.sleep(len(content) / self.chars_per_token / self.tps)
+            body = response["body"] if not response["stream"] else self._completion(request, content, response.get("usage"))
+            await self._send_json(send, 200, body)
+            return
+
+        if response["stream"] and "lines" in response:
+            await self._replay_lines(send, response)
+            return
+
+        # 录制的是非流式响应时，按chars_per_token切分内容合成流式响应
+        await send({"type": "http.response.start", "status": 200,
+                    "headers": [(b"content-type", b"text/event-stream")]})
+        created = int(time.time())
+        for start in range(0, len(content), self.chars_per_token):
+            piece = content[start:start + self.chars_per_token]
+            chunk = {"id": f"replay-{key[:12]}", "object": "chat.completion.chunk", "created": created,
+                     "model": request.get("model"), "choices": [{"index": 0, "delta": {"content": piece}}]}
+            await send({"type": "http.response.body", "body": f"data: {json.dumps(chunk, ensure_ascii=False)}\n\n".encode("utf-8"), "more_body": True})
+            if self.tps:
+                await asyncio.sleep(1 / self.tps)
+        usage = response.get("usage") if response["stream"] else response["body"].get("usage")
+        if usage and request.get("stream_options", {}).get("include_usage"):
+            chunk = {"id": f"replay-{key[:12]}", "object": "chat.completion.chunk", "created": created,
+                     "model": request.get("model"), "choices": [], "usage": usage}
+            await send({"type": "http.response.body", "body": f"data: {json.dumps(chunk)}\n\n".encode("utf-8"), "more_body": True})
+        await send({"type": "http.response.body", "body": b"data: [DONE]\n\n", "more_body": False})
+
+    async def _replay_lines(self, send, response: dict) -> None:
+        """逐行还原录制的SSE响应，每个含内容的chunk之后按tps停顿"""
+        await send({"type": "http.response.start", "status": 200,
+                    "headers": [(b"content-type", response.get("content_type", "text/event-stream").encode("latin-1"))]})
+        for line in response["lines"]:
+            await send({"type": "http.response.body", "body": (line + "\n").encode("utf-8"), "more_body": True})
+            if self.tps and line.startswith("data:") and '"content"' in line:
+                await asyncio.sleep(1 / self.tps)
+        await send({"type": "http.response.body", "body": b"", "more_body": False})
+
+    @staticmethod
+    def _completion(request: dict, content: str, usage: dict | None) -> dict:
+        body = {
+            "id": "replay", "object": "chat.completion", "created": int(time.time()), "model": request.get("model"),
+            "choices": [{"index": 0, "message": {"role": "assistant", "content": content}, "finish_reason": "stop"}],
+        }
+        if usage:
+            body["usage"] = usage
+        return body
+
+    @staticmethod
+    async def _send_json(send, status: int, payload: dict) -> None:
+        body = json.dumps(payload, ensure_ascii=False).encode("utf-8")
+        await send({"type": "http.response.start", "status": status,
+                    "headers": [(b"content-type", b"application/json"), (b"content-length", str(len(body)).encode())]})
+        await send({"type": "http.response.body", "body": body})
+
+
+def main():
+    parser = argparse.ArgumentParser(description="OpenAI兼容的LLM录制/回放服务")
+    parser.add_argument("mode", choices=["record", "replay"], help="录制或回放")
+    parser.add_argument("--cassette", default="outputs/cassettes/default", help="录制文件目录")
+    parser.add_argument("--upstream", default=os.getenv("BASE_URL"), help="录制模式下的上游服务地址")
+    parser.add_argument("--api_key", default=os.getenv("API_KEY"), help="录制模式下的上游服务API KEY")
+    parser.add_argument("--ttft", type=float, default=0.0, help="回放的首token延迟（秒）")
+    parser.add_argument("--tps", type=float, default=0.0, help="回放的生成速度（token/秒），0表示不限速")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8765)
+    args = parser.parse_args()
+
+    app = ReplayServer(args.mode, args.cassette, args.upstream, args.api_key, args.ttft, args.tps)
+    uvicorn.run(app, host=args.host, port=args.port, log_level="warning")
+
+
+if __name__ == "__main__":
+    main()
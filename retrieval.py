@@ -0,0 +1,81 @@
+import math
+import re
+from collections import Counter
+from typing import Dict, List, Tuple
+
+# 英文、数字按单词切分，中日韩文字按单字与相邻二字切分
+WORD_PATTERN = re.compile(r"[a-z0-9]+|[\u3040-\u30ff\u4e00-\u9fff\uac00-\ud7af]+")
+CJK_PATTERN = re.compile(r"[\u3040-\u30ff\u4e00-\u9fff\uac00-\ud7af]")
+
+
+def tokenize(text: str) -> List[str]:
+    tokens = []
+    for word in WORD_PATTERN.findall(text.lower()):
+        if CJK_PATTERN.match(word):
+            tokens.extend(word)
+            tokens.extend(word[i:i + 2] for i in range(len(word) - 1))
+        else:
+            # 粗略地去掉英文复数后缀
+            tokens.append(word[:-1] if len(word) > 3 and word.endswith("s") else word)
+    return tokens
+
+
+class BM25Index:
+    """
+    不依赖外部服务的BM25词法检索索引，支持增量添加文档
+    """
+    def __init__(self, documents: List[str] = None, k1: float = 1.5, b: float = 0.75):
+        self.k1 = k1
+        self.b = b
+        self.term_freqs: List[Counter] = []
+        self.doc_lens: List[int] = []
+        self.doc_freqs: Counter = Counter()
+        for document in documents or []:
+            self.add(document)
+
+    def __len__(self) -> int:
+        return len(self.term_freqs)
+
+    def add(self, document: str) -> int:
+        """添加一篇文档，返回其编号"""
+        term_freq = Counter(tokenize(document))
+        self.term_freqs.append(term_freq)
+        self.doc_lens.append(sum(term_freq.values()))
+        self.doc_freqs.update(term_freq.keys())
+        return len(self.term_freqs) - 1
+
+    def idf(self, term: str) -> float:
+        df = self.doc_freqs.get(term, 0)
+        return math.log(1 + (len(self) - df + 0.5) / (df + 0.5))
+
+    def scores(self, query: str) -> List[float]:
+        if not self.term_freqs:
+            return []
+        avg_len = sum(self.doc_lens) / len(self.doc_lens) or 1
+        query_terms: Dict[str, float] = {term: self.idf(term) for term in set(tokenize(query))}
+        return [self._score(query_terms, term_freq, doc_len, avg_len)
+                for term_freq, doc_len in zip(self.term_freqs, self.doc_lens)]
+
+    def _score(self, query_terms: Dict[str, float], term_freq: Counter, doc_len: int, avg_len: float) -> float:
+        score = 0.0
+        for term, idf in query_terms.items():
+            freq = term_freq.get(term)
+            if freq:
+                score += idf * freq * (self.k1 + 1) / (freq + self.k1 * (1 - self.b + self.b * doc_len / avg_len))
+        return score
+
+    def self_score(self, text: str) -> float:
+        """把text当作索引中的一篇文档、并以其自身为查询时的得分，可用于把得分归一化为相似度"""
+        term_freq = Counter(tokenize(text))
+        avg_len = sum(self.doc_lens) / len(self.doc_lens) if self.doc_lens else 0
+        query_terms = {term: self.idf(term) for term in term_freq}
+        return self._score(query_terms, term_freq, sum(term_freq.values()), avg_len or 1)
+
+    def search(self, query: str, top_k: int = 5) -> List[Tuple[int, float]]:
+        """返回得分大于0的前top_k篇文档的(编号, 得分)，按得分降序"""
+        ranked = sorted(
+            ((i, score) for i, score in enumerate(self.scores(query)) if score > 0),
+            key=lambda item: item[1],
+            reverse=True,
+        )
+        return ranked[:top_k]
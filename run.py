@@ -8,6 +8,7 @@ import traceback
 from typing import List, Any, Optional, Dict, Tuple
 
 from agent import JarvisAgent, extract_json_codeblock
+from model import preconnect
 from prompt.system_prompt import jarvis_sys_prompt
 
 def get_TAC_evaluation(task_name: str) -> Tuple[str, str]:
@@ -37,14 +38,29 @@ async def main():
     parser = argparse.ArgumentParser(description="与Agent交互")
     parser.add_argument("task_name", type=str, help="任务名")
     parser.add_argument("task", type=str, help="请输入你的指令（英文或中文）")
+    parser.add_argument("--context_layout", type=str, default="dynamic", choices=["dynamic", "stable"],
+                        help="上下文布局，stable布局下system prompt保持不变以命中prompt cache")
+    parser.add_argument("--planning_mode", type=str, default=None, choices=["sequential", "fused"],
+                        help="任务规划方式，fused在一次调用中生成事实与任务方案（默认取config.yaml中的agent.planning_mode）")
+    parser.add_argument("--prewarm_browser", action="store_true",
+                        help="在任务规划阶段就在后台启动浏览器（默认取config.yaml中的browser.prewarm）")
     args = parser.parse_args()
 
-    jarvis = JarvisAgent(
-        init_model_name="gemini",
-        sys_prompt_template=jarvis_sys_prompt,
-        memory_dir="memory"
+    # 在构建agent（加载工具）的同时预先建立与LLM服务的连接
+    jarvis, _ = await asyncio.gather(
+        asyncio.to_thread(
+            JarvisAgent,
+            init_model_name="gemini",
+            sys_prompt_template=jarvis_sys_prompt,
+            memory_dir="memory",
+            context_layout=args.context_layout,
+            planning_mode=args.planning_mode
+        ),
+        preconnect(["gemini"])
     )
 
+    if args.prewarm_browser:
+        jarvis.prewarm_browser = True
     jarvis.logger.log_task(args.task, subtitle="STARTING······", title="Task")
 
     await jarvis.run(args.task, step_limit=50)
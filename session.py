@@ -0,0 +1,41 @@
+"""
+agent运行时独占的资源，通过上下文变量绑定到当前agent的协程上
+
+同一进程中并发运行多个agent时，工具函数通过这里获取当前agent自己的资源，而不是共享模块级的全局实例
+"""
+from contextlib import contextmanager
+from contextvars import ContextVar
+from typing import Any, Iterator, Optional
+
+CURRENT_BROWSER: ContextVar[Optional[Any]] = ContextVar("current_browser", default=None)
+CURRENT_SHELL: ContextVar[Optional[Any]] = ContextVar("current_shell", default=None)
+
+
+def current_browser() -> Optional[Any]:
+    """当前协程绑定的浏览器（BrowserUseLight），未绑定时返回None"""
+    return CURRENT_BROWSER.get()
+
+
+@contextmanager
+def bind_browser(browser: Any) -> Iterator[Any]:
+    """在with块内（以及其中创建的子任务中）将browser绑定为当前浏览器"""
+    token = CURRENT_BROWSER.set(browser)
+    try:
+        yield browser
+    finally:
+        CURRENT_BROWSER.reset(token)
+
+
+def current_shell() -> Optional[Any]:
+    """当前协程绑定的shell会话（ShellSession），未绑定时返回None"""
+    return CURRENT_SHELL.get()
+
+
+@contextmanager
+def bind_shell(shell: Any) -> Iterator[Any]:
+    """在with块内（以及其中创建的子任务中）将shell绑定为当前shell会话"""
+    token = CURRENT_SHELL.set(shell)
+    try:
+        yield shell
+    finally:
+        CURRENT_SHELL.reset(token)
@@ -0,0 +1,185 @@
+"""
+长期存活的shell会话，使工作目录、导出的环境变量、激活的虚拟环境等在多次命令之间保持
+
+每条命令通过eval在同一个shell中执行，执行完毕后分别向标准输出与标准错误写入带随机标记的结束行，
+据此划分命令边界并取得退出码；shell崩溃或命令超时时终止整个进程组，下一条命令会在新的shell中执行
+"""
+import asyncio
+import codecs
+import os
+import shlex
+import shutil
+import signal
+import uuid
+from typing import AsyncIterator, Optional, Tuple
+
+from model import config
+
+SHELL_CONFIG = config.get("tools", {}).get("cmd", {})
+
+
+class ShellSession:
+    def __init__(self, cwd: str = None, shell: str = None):
+        self.cwd = cwd or SHELL_CONFIG.get("cwd", "/workspace")
+        self.shell = shell or SHELL_CONFIG.get("shell") or shutil.which("bash") or "/bin/sh"
+        self.process: Optional[asyncio.subprocess.Process] = None
+        self._loop: Optional[asyncio.AbstractEventLoop] = None
+        self._lock: Optional[asyncio.Lock] = None
+        self._reaping: set = set()
+        self.restarts = 0
+        # 上一条命令结束后shell的工作目录
+        self.last_cwd = self.cwd
+
+    @property
+    def alive(self) -> bool:
+        return self.process is not None and self.process.returncode is None
+
+    def _kill(self) -> None:
+        process, self.process = self.process, None
+        if process is None:
+            return
+        if process.returncode is None:
+            try:
+                os.killpg(process.pid, signal.SIGKILL)
+            except ProcessLookupError:
+                pass
+        # 在创建进程的事件循环中回收进程，释放其管道
+        try:
+            if asyncio.get_running_loop() is self._loop:
+                self._reaping.add(asyncio.ensure_future(process.wait()))
+        except RuntimeError:
+            pass
+
+    async def _ensure_started(self) -> bool:
+        """确保shell正在运行，返回是否新启动了shell"""
+        if self.alive and self._loop is asyncio.get_running_loop():
+            return False
+        # 进程管道绑定在创建它的事件循环上，事件循环变化时同样需要重启
+        self._kill()
+        self._loop = asyncio.get_running_loop()
+        self.process = await asyncio.create_subprocess_exec(
+            self.shell,
+            *(["--noprofile", "--norc"] if os.path.basename(self.shell) == "bash" else []),
+            stdin=asyncio.subprocess.PIPE,
+            stdout=asyncio.subprocess.PIPE,
+            stderr=asyncio.subprocess.PIPE,
+            cwd=self.cwd,
+            start_new_session=True,
+        )
+        self.last_cwd = self.cwd
+        return True
+
+    async def run(self, command: str, timeout: float) -> AsyncIterator[Tuple[str, str]]:
+        """
+        在会话中执行一条命令，流式返回("stdout"/"stderr", 文本)，最后返回("exit", 退出码)
+        shell被重启时会先返回("restart", 原因)；超时返回("timeout", 说明)，并终止该shell
+        """
+        if self._lock is None or self._loop is not asyncio.get_running_loop():
+            self._lock = asyncio.Lock()
+        async with self._lock:
+            had_session = self._loop is not None
+            if await self._ensure_started() and had_session:
+                self.restarts += 1
+                yield "restart", "Previous shell session ended, commands now run in a new shell"
+
+            sentinel = f"__CMD_DONE_{uuid.uuid4().hex}__"
+            script = (
+                f"eval {shlex.quote(command)} < /dev/null\n"
+                f"__rc=$?; printf '\\n{sentinel} %d %s\\n' \"$__rc\" \"$PWD\"; printf '\\n{sentinel}\\n' >&2\n"
+            )
+            try:
+                self.process.stdin.write(script.encode("utf-8"))
+                await self.process.stdin.drain()
+            except (BrokenPipeError, ConnectionResetError):
+                self._kill()
+                yield "exit", -1
+                return
+
+            queue: asyncio.Queue = asyncio.Queue()
+            readers = [
+                asyncio.create_task(self._read_until(self.process.stdout, "stdout", sentinel, queue)),
+                asyncio.create_task(self._read_until(self.process.stderr, "stderr", sentinel, queue)),
+            ]
+            loop = asyncio.get_running_loop()
+            deadline = loop.time() + timeout
+            finished, returncode, complete = 0, None, True
+            try:
+                while finished < len(readers):
+                    try:
+                        name, value = await asyncio.wait_for(queue.get(), max(0.0, deadline - loop.time()))
+                    except asyncio.TimeoutError:
+                        self._kill()
+                        yield "timeout", f"Command timed out after {timeout} seconds, the shell session was killed"
+                        return
+                    if name == "done":
+                        stream_name, found, code = value
+                        finished += 1
+                        complete = complete and found
+                        if stream_name == "stdout":
+                            returncode = code
+                        continue
+                    yield name, value
+            finally:
+                for reader in readers:
+                    reader.cancel()
+                # 被取消或出错时shell的状态未知，直接重启
+                if finished < len(readers):
+                    self._kill()
+
+            if not complete or returncode is None:
+                # 没有读到结束标记，说明shell在命令中退出了（例如执行了exit）
+                try:
+                    code = await asyncio.wait_for(self.process.wait(), max(0.0, deadline - loop.time()))
+                except asyncio.TimeoutError:
+                    code = -1
+                self._kill()
+                yield "exit", code
+                return
+            yield "exit", returncode
+
+    async def _read_until(self, stream: asyncio.StreamReader, name: str, sentinel: str, queue: asyncio.Queue) -> None:
+        """读取一条命令的输出直到结束标记，标记之前的内容逐块放入队列"""
+        decoder = codecs.getincrementaldecoder("utf-8")(errors="replace")
+        marker = f"\n{sentinel}"
+        buffer = ""
+        found, returncode = False, None
+        try:
+            while True:
+                data = await stream.read(4096)
+                if not data:
+                    if buffer:
+                        await queue.put((name, buffer))
+                    break
+                buffer += decoder.decode(data)
+                index = buffer.find(marker)
+                if index >= 0:
+                    # 结束行之后还需要读到换行才完整
+                    end = buffer.find("\n", index + len(marker))
+                    while end < 0:
+                        data = await stream.read(4096)
+                        if not data:
+                            break
+                        buffer += decoder.decode(data)
+                        end = buffer.find("\n", index + len(marker))
+                    if buffer[:index]:
+                        await queue.put((name, buffer[:index]))
+                    found = end >= 0
+                    status = buffer[index + len(marker):end].split(maxsplit=1) if found else []
+                    if name == "stdout" and status:
+                        returncode = int(status[0])
+                        if len(status) > 1:
+                            self.last_cwd = status[1]
+                    break
+                # 保留可能是结束标记开头的部分
+                keep = len(marker) - 1
+                if len(buffer) > keep:
+                    await queue.put((name, buffer[:-keep]))
+                    buffer = buffer[-keep:]
+        finally:
+            await queue.put(("done", (name, found, returncode)))
+
+    async def aclose(self) -> None:
+        """终止shell并等待其退出，需要在创建shell的事件循环中调用"""
+        self._kill()
+        await asyncio.gather(*self._reaping)
+        self._reaping.clear()
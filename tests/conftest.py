@@ -0,0 +1,129 @@
+import json
+import os
+import socket
+import sys
+import threading
+import time
+from pathlib import Path
+
+import pytest
+import uvicorn
+
+ROOT = Path(__file__).resolve().parent.parent
+sys.path.insert(0, str(ROOT))
+# model.py 在导入时按相对路径读取config.yaml
+os.chdir(ROOT)
+
+
+def _free_port() -> int:
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+
+UPSTREAM_PORT = _free_port()
+# 必须在导入model之前设置，config.yaml中的${BASE_URL}在导入时展开
+os.environ["BASE_URL"] = f"http://127.0.0.1:{UPSTREAM_PORT}/v1"
+os.environ["API_KEY"] = "test-key"
+
+
+class StubUpstream:
+    """
+    最小的OpenAI兼容上游服务，记录收到的请求体，并返回固定的回复与usage
+    """
+    def __init__(self):
+        self.requests = []
+        # 非POST请求（如预连接的HEAD请求）
+        self.probes = []
+        self.content = "hello world"
+        self.usage = {"prompt_tokens": 100, "completion_tokens": 2, "total_tokens": 102,
+                      "prompt_tokens_details": {"cached_tokens": 80}}
+        # 模拟在每个chunk中都附带累计usage的代理
+        self.usage_every_chunk = False
+        # 模拟网关故障时返回的非JSON错误页
+        self.html_error = False
+
+    def reset(self):
+        self.__init__()
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] == "lifespan":
+            while True:
+                message = await receive()
+                if message["type"] == "lifespan.startup":
+                    await send({"type": "lifespan.startup.complete"})
+                elif message["type"] == "lifespan.shutdown":
+                    await send({"type": "lifespan.shutdown.complete"})
+                    return
+
+        body = b""
+        more_body = True
+        while more_body:
+            message = await receive()
+            body += message.get("body", b"")
+            more_body = message.get("more_body", False)
+        if scope["method"] != "POST":
+            self.probes.append((scope["method"], scope["path"]))
+            await send({"type": "http.response.start", "status": 200, "headers": []})
+            await send({"type": "http.response.body", "body": b""})
+            return
+
+        request = json.loads(body)
+        self.requests.append(request)
+
+        if self.html_error:
+            await send({"type": "http.response.start", "status": 502, "headers": [(b"content-type", b"text/html")]})
+            await send({"type": "http.response.body", "body": b"<html>502 Bad Gateway</html>"})
+            return
+
+        if not request.get("stream"):
+            payload = json.dumps({
+                "id": "stub", "object": "chat.completion", "created": 0, "model": request["model"],
+                "choices": [{"index": 0, "message": {"role": "assistant", "content": self.content}, "finish_reason": "stop"}],
+                "usage": self.usage,
+            }).encode()
+            await send({"type": "http.response.start", "status": 200,
+                        "headers": [(b"content-type", b"application/json")]})
+            await send({"type": "http.response.body", "body": payload})
+            return
+
+        await send({"type": "http.response.start", "status": 200,
+                    "headers": [(b"content-type", b"text/event-stream")]})
+        include_usage = request.get("stream_options", {}).get("include_usage")
+        for piece in self.content.split(" "):
+            chunk = {"id": "stub", "object": "chat.completion.chunk", "created": 0, "model": request["model"],
+                     "choices": [{"index": 0, "delta": {"content": piece + " "}}]}
+            if include_usage and self.usage_every_chunk:
+                chunk["usage"] = self.usage
+            await send({"type": "http.response.body", "body": f"data: {json.dumps(chunk)}\n\n".encode(), "more_body": True})
+        if include_usage:
+            chunk = {"id": "stub", "object": "chat.completion.chunk", "created": 0, "model": request["model"],
+                     "choices": [], "usage": self.usage}
+            await send({"type": "http.response.body", "body": f"data: {json.dumps(chunk)}\n\n".encode(), "more_body": True})
+        await send({"type": "http.response.body", "body": b"data: [DONE]\n\n", "more_body": False})
+
+
+def serve(app, port: int) -> uvicorn.Server:
+    """在后台线程中启动ASGI应用，返回可用于停止服务的uvicorn.Server"""
+    server = uvicorn.Server(uvicorn.Config(app, host="127.0.0.1", port=port, log_level="warning"))
+    threading.Thread(target=server.run, daemon=True).start()
+    deadline = time.time() + 10
+    while not server.started:
+        if time.time() > deadline:
+            raise RuntimeError(f"ASGI server on port {port} failed to start")
+        time.sleep(0.01)
+    return server
+
+
+@pytest.fixture(scope="session")
+def _upstream_server():
+    app = StubUpstream()
+    server = serve(app, UPSTREAM_PORT)
+    yield app
+    server.should_exit = True
+
+
+@pytest.fixture
+def upstream(_upstream_server):
+    _upstream_server.reset()
+    return _upstream_server
@@ -0,0 +1,389 @@
+import asyncio
+
+from agent import BaseAgent
+from log import AgentLogger, LogLevel
+from tool import ToolRegistry
+
+
+class StubAgent(BaseAgent):
+    """不加载LLM与工具箱，只注册测试用工具的agent"""
+    def __init__(self):
+        self.logger = AgentLogger(level=LogLevel.OFF)
+        self.tool_registrar = ToolRegistry()
+
+    async def _run(self, prompt, step_limit):
+        yield ""
+
+
+def make_agent(events: list):
+    agent = StubAgent()
+    running = {"now": 0, "peak": 0}
+
+    def read_tool(name):
+        async def tool(delay: float):
+            running["now"] += 1
+            running["peak"] = max(running["peak"], running["now"])
+            events.append(f"start {name}")
+            await asyncio.sleep(delay)
+            events.append(f"end {name}")
+            running["now"] -= 1
+            yield {"data": {"stream_chunk": f"{name} done"}, "instruction": ""}
+        return tool
+
+    async def click(index: int):
+        events.append(f"click {index}")
+        yield {"data": {"stream_chunk": f"clicked {index}"}, "instruction": ""}
+
+    for name in ("list_tabs", "extract"):
+        agent.tool_registrar.register_tool(name, read_tool(name))
+        agent.tool_registrar.read_only_tools.add(name)
+    agent.tool_registrar.register_tool("click", click)
+    return agent, running
+
+
+async def collect(agent, response: str):
+    final = None
+    async for status, chunk in agent.call_tools(agent.parse_tool_calls(response)):
+        if status == "[DONE]":
+            final = chunk
+    return final
+
+
+def test_parse_tool_calls_returns_every_block_in_order():
+    agent = StubAgent()
+    response = (
+        '<tool_call>{"name": "a", "arguments": {}}</tool_call> then '
+        '<tool_call>{"name": "b"}</tool_call>'
+        '<tool_call>{"name": "c", "arguments": {"x": 1}}</tool_call>'
+    )
+    results = agent.parse_tool_calls(response)
+
+    assert [r.tool_json["tool_name"] if r.tool_json else None for r in results] == ["a", None, "c"]
+    assert "arguments" in results[1].parse_msg
+    assert agent.parse_tool_call(response).tool_json["tool_name"] == "a"
+    assert agent.parse_tool_calls("no tool call here") == []
+
+
+def test_read_only_calls_run_concurrently_and_mutating_calls_serially():
+    events = []
+    agent, running = make_agent(events)
+    response = (
+        '<tool_call>{"name": "list_tabs", "arguments": {"delay": 0.05}}</tool_call>'
+        '<tool_call>{"name": "extract", "arguments": {"delay": 0.01}}</tool_call>'
+        '<tool_call>{"name": "click", "arguments": {"index": 3}}</tool_call>'
+        '<tool_call>{"name": "extract", "arguments": {"delay": 0}}</tool_call>'
+    )
+    observation = asyncio.run(collect(agent, response))
+
+    assert running["peak"] == 2
+    # 点击在前两个只读调用全部完成之后、最后一个只读调用之前执行
+    assert events.index("click 3") > events.index("end list_tabs")
+    assert events.index("click 3") < events.index("start extract", 3)
+    positions = [observation.index(f"第{i}个工具调用") for i in range(1, 5)]
+    assert positions == sorted(positions)
+    assert "list_tabs done" in observation.split("第2个")[0]
+
+
+def test_single_tool_call_observation_is_unchanged():
+    agent, _ = make_agent([])
+    response = '<tool_call>{"name": "click", "arguments": {"index": 1}}</tool_call>'
+
+    assert asyncio.run(collect(agent, response)) == "<tool_response>\nclicked 1\n</tool_response>"
+
+
+def test_tool_call_stream_end_waits_for_content_after_the_last_call():
+    from agent import tool_call_stream_end
+
+    call = '<tool_call>{"name": "a", "arguments": {}}</tool_call>'
+    assert tool_call_stream_end("thinking <tool_call>{\"name\"") is None
+    assert tool_call_stream_end(f"thinking {call}\n") is None
+    assert tool_call_stream_end(f"thinking {call}\n<tool_") is None
+    assert tool_call_stream_end(f"{call}\n{call}") is None
+    assert tool_call_stream_end(f"thinking {call}\nObservation: fake") == len(f"thinking {call}")
+
+
+class ScriptedLLM:
+    """按顺序返回预设回复的LLM，记录每次请求的prompt"""
+    def __init__(self, replies):
+        self.replies = list(replies)
+        self.prompts = []
+        self.usage_stats = {"calls": 0, "prompt_tokens": 0, "cached_tokens": 0, "completion_tokens": 0}
+
+    async def async_stream_generate(self, prompt, image_path=None, history=None, **kwargs):
+        self.prompts.append(prompt)
+        reply = self.replies.pop(0)
+        for i in range(0, len(reply), 5):
+            yield reply[i:i + 5]
+
+
+def make_planner(mode: str, replies):
+    from agent import JarvisAgent
+    from context import ContextManager
+
+    agent = JarvisAgent.__new__(JarvisAgent)
+    agent.logger = AgentLogger(level=LogLevel.OFF)
+    agent.llm = ScriptedLLM(replies)
+    agent.context_manager = ContextManager()
+    agent.context_layout = "dynamic"
+    agent.planning_mode = mode
+    agent.history = [{"role": "system", "content": "sys"}]
+    agent.multi_steps_plan = None
+    agent.plan_library = None
+    agent.memory_index = None
+    agent.step_memory = ""
+    return agent
+
+
+async def plan(agent, task="book a flight"):
+    trajectory = []
+    async for _ in agent.multi_step_task_plan(task, trajectory):
+        pass
+    return trajectory
+
+
+KNOWN = "* 已知事实有：\n    1. 需要订机票"
+UNKNOWN = "* 还需要去确认的事实有：\n    1. 出发日期"
+PLAN = '```json\n{"search": "find flights", "book": "pay"}\n```'
+
+
+def test_split_fused_plan_separates_sections():
+    from agent import split_fused_plan
+
+    known, unknown, steps = split_fused_plan(f"{KNOWN}\n\n{UNKNOWN}\n\n* 任务方案：\n{PLAN}")
+    assert (known, unknown) == (KNOWN, UNKNOWN)
+    assert list(steps) == ["search", "book"]
+
+    known, unknown, steps = split_fused_plan(f"{KNOWN}\n{PLAN}")
+    assert (known, unknown) == (KNOWN, "")
+    assert split_fused_plan(KNOWN)[2] == {}
+
+
+def test_fused_planning_builds_the_same_record_with_one_call():
+    sequential = make_planner("sequential", [KNOWN, UNKNOWN, PLAN])
+    fused = make_planner("fused", [f"{KNOWN}\n\n{UNKNOWN}\n\n* 任务方案：\n{PLAN}"])
+    asyncio.run(plan(sequential))
+    trajectory = asyncio.run(plan(fused))
+
+    assert fused.multi_steps_plan == sequential.multi_steps_plan == {"search": "find flights", "book": "pay"}
+    assert [m["role"] for m in fused.history] == ["system", "user", "assistant"]
+    assert fused.history[1] == sequential.history[1]
+    record = fused.history[-1]["content"][0]["text"]
+    assert record == sequential.history[-1]["content"][0]["text"]
+    assert record.endswith("* 任务方案可分为如下步骤：\n    1. search\n    2. book")
+    assert trajectory == fused.history
+    assert (sequential.planning_stats["calls"], fused.planning_stats["calls"]) == (3, 1)
+    assert fused.planning_stats["estimated_prompt_tokens"] < sequential.planning_stats["estimated_prompt_tokens"]
+
+
+def test_fused_planning_requests_the_plan_again_when_it_is_missing():
+    agent = make_planner("fused", [f"{KNOWN}\n\n{UNKNOWN}", PLAN])
+    asyncio.run(plan(agent))
+
+    assert agent.planning_stats["calls"] == 2
+    assert list(agent.multi_steps_plan) == ["search", "book"]
+    assert agent.history[-1]["content"][0]["text"].startswith(KNOWN)
+
+
+class ReflectLLM:
+    """完成度检查耗时check_delay后返回finish，困境分析逐块流式返回并记录是否被中途取消"""
+    def __init__(self, finish: str, check_delay: float = 0.05):
+        self.finish = finish
+        self.check_delay = check_delay
+        self.stream_started = self.stream_cancelled = 0
+
+    async def async_generate(self, prompt, image_path=None, history=None, **kwargs):
+        from prompt.reflect_memory import react_block_reflect_check_completion_prompt
+
+        if prompt == react_block_reflect_check_completion_prompt:
+            await asyncio.sleep(self.check_delay)
+            return f'```json\n{{"finish": "{self.finish}"}}\n```'
+        return '```json\n{"lesson": "ok"}\n```'
+
+    async def async_stream_generate(self, prompt, image_path=None, history=None, **kwargs):
+        self.stream_started += 1
+        try:
+            for piece in ("stuck ", "because ", "login ", "failed"):
+                await asyncio.sleep(0.02)
+                yield piece
+        except BaseException:
+            self.stream_cancelled += 1
+            raise
+
+
+def make_reflector(finish: str, speculative: bool):
+    from collections import deque
+
+    agent = make_planner("sequential", [])
+    agent.llm = ReflectLLM(finish)
+    agent.temp_memory = ""
+    agent.system_memory = ""
+    agent.context_layout = "stable"
+    agent.speculative_dilemma = speculative
+    agent.speculation_threshold = 0.0
+    agent.recent_step_failures = deque(maxlen=10)
+    agent.speculation_stats = {"checks": 0, "started": 0, "used": 0, "cancelled": 0,
+                               "wasted_tokens": 0, "saved_seconds": 0.0}
+    return agent
+
+
+async def reflect(agent):
+    reflection = {}
+    output = [chunk async for chunk in agent.react_block_reflect([{"role": "user", "content": "task"}], reflection)]
+    return reflection["finish"], "".join(output)
+
+
+def test_speculative_dilemma_analysis_is_used_when_the_step_failed():
+    agent = make_reflector("no", speculative=True)
+    finish, output = asyncio.run(reflect(agent))
+
+    assert finish == "no"
+    assert output.endswith("stuck because login failed")
+    assert agent.history[-1]["content"][0]["text"] == "stuck because login failed"
+    assert agent.llm.stream_started == 1
+    assert agent.speculation_stats["used"] == agent.speculation_stats["started"] == 1
+    assert agent.speculation_stats["saved_seconds"] > 0
+
+
+def test_speculative_dilemma_analysis_is_cancelled_when_the_step_finished():
+    agent = make_reflector("yes", speculative=True)
+    history_length = len(agent.history)
+    finish, output = asyncio.run(reflect(agent))
+
+    assert finish == "yes"
+    assert "stuck" not in output
+    assert len(agent.history) == history_length
+    assert agent.llm.stream_cancelled == 1
+    assert agent.speculation_stats["cancelled"] == 1
+    assert agent.speculation_stats["wasted_tokens"] > 0
+
+
+def test_speculation_follows_the_recent_failure_rate():
+    agent = make_reflector("yes", speculative=True)
+    agent.speculation_threshold = 0.5
+    assert agent.should_speculate()
+    agent.recent_step_failures.extend([False, False, True])
+    assert not agent.should_speculate()
+    agent.recent_step_failures.append(True)
+    assert agent.should_speculate()
+
+    agent = make_reflector("no", speculative=False)
+    asyncio.run(reflect(agent))
+    assert agent.speculation_stats["started"] == 0
+    assert agent.history[-1]["content"][0]["text"] == "stuck because login failed"
+
+
+def test_similar_successful_plan_is_reused_or_offered_as_draft(tmp_path):
+    from plan_library import PlanLibrary
+
+    library = PlanLibrary(tmp_path / "plans.jsonl")
+    library.record("book a flight to paris for the team offsite", {"search": "find flights", "book": "pay"}, "success")
+
+    agent = make_planner("fused", [])
+    agent.plan_library = library
+    asyncio.run(plan(agent, "book a flight to paris for the team offsite"))
+    assert agent.planning_stats["plan_library"] == "reused"
+    assert agent.planning_stats["calls"] == 0
+    assert list(agent.multi_steps_plan) == ["search", "book"]
+    assert agent.history[-1]["content"][0]["text"].endswith("1. search\n    2. book")
+
+    agent = make_planner("sequential", [KNOWN, UNKNOWN, PLAN])
+    agent.plan_library = library
+    asyncio.run(plan(agent, "book a flight to berlin for the team offsite"))
+    assert agent.planning_stats["plan_library"] == "draft"
+    assert agent.planning_stats["calls"] == 3
+    assert "<similar_task>\nbook a flight to paris for the team offsite\n</similar_task>" in agent.llm.prompts[-1]
+
+    agent.record_plan("book a flight to berlin for the team offsite", "success")
+    assert library.entries[-1]["plan"] == agent.multi_steps_plan
+    assert library.entries[-1]["reused"] is False
+
+
+def make_tool_agent():
+    from agent import JarvisAgent
+
+    agent = make_planner("sequential", [])
+    agent.context_layout = "stable"
+    agent.sys_prompt_template = "{now}{knowledge}<tools>\n{tools}\n</tools>"
+    agent.system_memory = ""
+    agent.tool_enhance_dict = {}
+    agent.tool_registrar = ToolRegistry()
+
+    def make_tool(name):
+        async def tool():
+            """demo tool"""
+            yield {"data": {"stream_chunk": name}, "instruction": ""}
+        tool.__name__ = name
+        return tool
+
+    for name, group in (("browser_navigate", "browser"), ("run_cmd", "shell"), ("describe_image", "vision")):
+        agent.tool_registrar.register_tool(name, make_tool(name), group)
+    agent.tool_subset_cache = {}
+    agent.active_tool_groups = None
+    agent.tool_registrar.register_tool("request_tools", agent.request_tools)
+    agent.tool_schema_texts = JarvisAgent.render_tool_schema_texts(agent)
+    return agent
+
+
+def test_tool_groups_are_selected_by_step_keywords_and_cached(monkeypatch):
+    import agent as agent_module
+
+    monkeypatch.setitem(agent_module.TOOL_GROUP_CONFIG, "select_by_step", True)
+    agent = make_tool_agent()
+    assert agent.select_tool_groups("Step1: 登录GitLab并打开仓库页面") == ("browser",)
+    assert agent.select_tool_groups("Step2: 在终端运行脚本，把结果保存为csv") == ("shell",)
+    assert agent.select_tool_groups("Step3: 总结") is None
+    # 英文关键词按完整单词匹配："url"不匹配"curl"
+    assert agent.select_tool_groups("Step4: 用curl调用接口") is None
+    assert agent.select_tool_groups("Step5: open the URL of the GitLab repo") == ("browser",)
+
+    agent.apply_tool_groups(("browser",))
+    browser_prompt = agent.history[0]["content"][0]["text"]
+    assert '"browser_navigate"' in browser_prompt and '"request_tools"' in browser_prompt
+    assert '"run_cmd"' not in browser_prompt
+
+    agent.apply_tool_groups(None)
+    agent.apply_tool_groups(("browser",))
+    assert agent.history[0]["content"][0]["text"] == browser_prompt
+    assert agent.render_tool_schema_texts(("browser",)) is agent.tool_subset_cache[("browser",)]
+
+
+def test_request_tools_adds_groups_to_the_current_subset():
+    agent = make_tool_agent()
+    agent.apply_tool_groups(("browser",))
+
+    async def request(groups):
+        return [chunk async for chunk in agent.request_tools(groups)][0]["data"]["stream_chunk"]
+
+    result = asyncio.run(request(["shell", "database"]))
+    assert agent.active_tool_groups == ("browser", "shell")
+    assert '"run_cmd"' in agent.history[0]["content"][0]["text"]
+    assert "database" in result
+
+    asyncio.run(request(["all"]))
+    assert agent.active_tool_groups is None
+    assert '"describe_image"' in agent.history[0]["content"][0]["text"]
+
+
+def test_stable_layout_keeps_request_prefix_byte_identical_across_steps(upstream):
+    import json
+
+    from model import LLM
+
+    agent = make_tool_agent()
+    agent.llm = LLM("gemini")
+    agent.temp_memory = ""
+    agent.total_steps = 0
+    agent.memory_stats = {}
+    agent.apply_tool_groups(None)
+    upstream.content = '<tool_call>\n{"name": "run_cmd", "arguments": {}}\n</tool_call>'
+
+    async def act():
+        return [chunk async for chunk in agent.reason_and_act("Step1: 运行脚本", step_limit=2, trajectory=[])]
+
+    asyncio.run(act())
+
+    first, second = (request["messages"] for request in upstream.requests[:2])
+    # 第一次请求中除本轮prompt（带有<runtime>）以外的部分，原样出现在第二次请求的开头
+    assert json.dumps(second[:len(first) - 1], ensure_ascii=False) == json.dumps(first[:-1], ensure_ascii=False)
+    assert "<runtime>" in first[-1]["content"][0]["text"] and "<runtime>" in second[-1]["content"][0]["text"]
+    assert agent.llm.prompt_stability.calls == 2 and agent.llm.prompt_stability.last_ratio > 0.5
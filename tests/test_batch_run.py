@@ -0,0 +1,93 @@
+import asyncio
+import json
+import sys
+
+import pytest
+
+from batch_run import BatchRunner, load_manifest
+
+
+class FakeAgent:
+    running = 0
+    peak = 0
+
+    def __init__(self, kind, workspace):
+        self.kind = kind
+        self.workspace = workspace
+        self.history = []
+        self.shell = self
+
+    async def run(self, prompt, step_limit=None, echo=True):
+        FakeAgent.running += 1
+        FakeAgent.peak = max(FakeAgent.peak, FakeAgent.running)
+        try:
+            await asyncio.sleep(0.05)
+            if prompt == "boom":
+                raise RuntimeError("agent crashed")
+            (self.workspace / "answer.txt").write_text(prompt)
+            self.history.append({"role": "assistant", "content": prompt})
+        finally:
+            FakeAgent.running -= 1
+
+    async def aclose(self):
+        pass
+
+    def save_trajectory(self, output_path):
+        with open(output_path, "w", encoding="utf-8") as f:
+            json.dump(self.history, f)
+
+
+def test_load_manifest_validates_tasks(tmp_path):
+    path = tmp_path / "tasks.jsonl"
+    path.write_text('{"task_name": "a", "task": "x"}\n\n{"task_name": "b", "task": "y", "agent": "react"}\n')
+    assert [task["task_name"] for task in load_manifest(path)] == ["a", "b"]
+
+    path.write_text('{"task_name": "a", "task": "x"}\n{"task_name": "a", "task": "y"}\n')
+    with pytest.raises(ValueError, match="duplicate"):
+        load_manifest(path)
+
+
+def test_batch_runner_isolates_tasks_and_evaluates_asynchronously(tmp_path, capsys):
+    tasks = [{"task_name": f"t{i}", "task": f"task {i}"} for i in range(5)] + [{"task_name": "bad", "task": "boom"}]
+    eval_script = "import sys, pathlib; p = pathlib.Path(sys.argv[1]); print(p.name, len(p.read_text()))"
+    runner = BatchRunner(
+        tasks, FakeAgent, tmp_path / "out", concurrency=2, eval_workers=2,
+        eval_cmd=f"{sys.executable} -c '{eval_script}' {{trajectory}}",
+    )
+    FakeAgent.peak = 0
+    results = asyncio.run(runner.run())
+
+    assert FakeAgent.peak == 2
+    assert [r.status for r in results] == ["finished"] * 5 + ["error"]
+    assert "agent crashed" in results[-1].error
+    assert all(r.eval_status == "evaluated" for r in results)
+    for i in range(5):
+        task_dir = tmp_path / "out" / f"t{i}"
+        assert (task_dir / "workspace" / "answer.txt").read_text() == f"task {i}"
+        assert json.loads((task_dir / "trajectory.json").read_text())[0]["content"] == f"task {i}"
+        assert (task_dir / "eval_output.txt").read_text().startswith("trajectory.json")
+
+    summary = json.loads((tmp_path / "out" / "summary.json").read_text())
+    assert summary["status"] == {"error": 1, "finished": 5}
+    assert summary["eval_status"] == {"evaluated": 6}
+    assert "[6/6]" in capsys.readouterr().out
+
+
+def test_unknown_eval_placeholder_is_rejected_before_running(tmp_path):
+    with pytest.raises(ValueError, match="typo"):
+        BatchRunner([{"task_name": "a", "task": "x"}], FakeAgent, tmp_path, eval_cmd="echo {typo}")
+
+
+def test_failing_evaluator_is_recorded_without_stalling_the_batch(tmp_path, monkeypatch):
+    async def broken_evaluator(*args, **kwargs):
+        raise RuntimeError("evaluator crashed")
+
+    monkeypatch.setattr(asyncio, "create_subprocess_exec", broken_evaluator)
+    tasks = [{"task_name": f"t{i}", "task": f"task {i}"} for i in range(3)]
+    runner = BatchRunner(tasks, FakeAgent, tmp_path, concurrency=3, eval_workers=1, eval_cmd="eval {trajectory}")
+
+    results = asyncio.run(asyncio.wait_for(runner.run(), timeout=10))
+
+    assert [r.eval_status for r in results] == ["eval_error"] * 3
+    assert all("evaluator crashed" in r.error for r in results)
+    assert json.loads((tmp_path / "summary.json").read_text())["eval_status"] == {"eval_error": 3}
@@ -0,0 +1,230 @@
+import asyncio
+import base64
+import io
+
+import pytest
+from PIL import Image, ImageDraw
+
+pytest.importorskip("browser_use")
+from browser import BrowserUseLight  # noqa: E402
+
+
+def screenshot(text: str = "", field: str = "") -> str:
+    """同一布局的页面截图，text为页面上的一小段文字，field为输入框中的内容"""
+    image = Image.new("RGB", (1280, 720), "white")
+    draw = ImageDraw.Draw(image)
+    draw.rectangle([0, 0, 1280, 60], fill="navy")
+    for y in range(100, 700, 60):
+        draw.rectangle([40, y, 900, y + 40], outline="gray")
+    draw.text((50, 110), text, fill="black")
+    draw.rectangle([950, 100, 1240, 140], outline="black")
+    draw.text((960, 110), field, fill="black")
+    buffer = io.BytesIO()
+    image.save(buffer, format="PNG")
+    return base64.b64encode(buffer.getvalue()).decode()
+
+
+class FakePage:
+    def __init__(self, url: str, html: str):
+        self.url, self.html = url, html
+
+    async def content(self) -> str:
+        return self.html
+
+    def is_closed(self) -> bool:
+        return False
+
+
+class FakeContext:
+    def __init__(self):
+        self.closed = False
+
+    async def close(self):
+        self.closed = True
+
+
+class FakeElement:
+    def __init__(self, index: int):
+        self.index, self.attributes = index, {}
+
+
+class FakeSession:
+    def __init__(self, url: str = "http://gitlab/issues/1", html: str = "<p>issue 1</p>", image: str = ""):
+        self.page = FakePage(url, html)
+        self.image = image or screenshot("issue 1")
+        self.tabs = [self.page]
+        self.started = False
+        self.stopped = False
+        self.clicked = []
+        self.browser_context = FakeContext()
+
+    async def stop(self):
+        self.stopped = True
+
+    async def get_dom_element_by_index(self, index: int) -> FakeElement:
+        return FakeElement(index)
+
+    async def _click_element_node(self, element: FakeElement):
+        self.clicked.append(element.index)
+
+    async def start(self):
+        await asyncio.sleep(0.05)
+        self.started = True
+
+    async def get_current_page(self) -> FakePage:
+        return self.page
+
+    async def take_screenshot(self) -> str:
+        return self.image
+
+    async def navigate(self, url: str, new_tab: bool = False) -> FakePage:
+        assert self.started, "navigate on a session that has not started"
+        self.page = FakePage(url, f"<p>{url}</p>")
+        self.tabs = [self.page]
+        return self.page
+
+
+class FakeVisionLLM:
+    """记录收到的视觉请求，回答中带有请求序号"""
+    model = "vision"
+
+    def __init__(self):
+        self.calls = 0
+        self.chat = self
+        self.completions = self
+
+    def get_client(self):
+        return self
+
+    async def create(self, model, messages):
+        self.calls += 1
+        message = type("Message", (), {"content": f"answer {self.calls}"})
+        return type("Response", (), {"choices": [type("Choice", (), {"message": message})]})
+
+
+def make_browser(session: FakeSession) -> BrowserUseLight:
+    browser = BrowserUseLight()
+    browser.browser_session = session
+    browser.llm = FakeVisionLLM()
+    return browser
+
+
+def test_vision_cache_reuses_answer_only_for_identical_page():
+    session = FakeSession()
+    browser = make_browser(session)
+
+    async def ask():
+        return await browser._extract_content_by_vision("what is the issue title?")
+
+    async def scenario():
+        first = await ask()
+        assert await ask() == first
+
+        # 相同布局下只有一小段文字不同
+        session.image = screenshot("issue 2")
+        assert await ask() == "answer 2"
+        # 输入框中输入了内容
+        session.image = screenshot("issue 2", field="hello")
+        assert await ask() == "answer 3"
+        # 截图相同但DOM或URL不同
+        session.page = FakePage("http://gitlab/issues/1", "<p>issue 1</p><input value='hello'>")
+        assert await ask() == "answer 4"
+        session.page = FakePage("http://gitlab/issues/2", session.page.html)
+        assert await ask() == "answer 5"
+
+    asyncio.run(scenario())
+    assert browser.vision_stats["cache_hits"] == 1
+
+
+def test_tool_call_waits_for_pending_prewarm(monkeypatch):
+    import browser as browser_module
+
+    monkeypatch.setattr(browser_module, "BrowserSession", lambda **kwargs: FakeSession())
+    monkeypatch.setattr(browser_module, "FileSystem", lambda base_dir: object())
+    browser = BrowserUseLight()
+
+    async def scenario():
+        browser.prewarm()
+        await asyncio.sleep(0)
+        # 预热仍在进行时发起的工具调用等待初始化完成，而不是使用尚未启动的会话
+        assert browser.browser_session is None
+        await browser._ensure_session()
+        assert browser.browser_session.started and browser.controller is not None
+        return await browser._navigate("http://gitlab/projects")
+
+    assert asyncio.run(scenario()) == "Navigated to: http://gitlab/projects"
+    assert browser.startup_stats["waited_seconds"] > 0
+
+
+def test_extract_cache_hits_on_unchanged_page_and_is_invalidated_by_actions():
+    url = "http://gitlab/issues/1"
+    browser = make_browser(FakeSession(url, f"<p>{url}</p>"))
+    browser.browser_session.started = True
+    extractions = []
+
+    async def extract_content(query, extract_links=False):
+        extractions.append(query)
+        return f"html {len(extractions)}"
+    browser._extract_content = extract_content
+
+    async def scenario():
+        first = await browser._extract_page_content("issue title")
+        # DOM、URL与问题都没有变化时直接复用
+        assert await browser._extract_page_content("  issue   title ") == first
+        assert len(extractions) == 1
+        # 问题不同时重新提取
+        await browser._extract_page_content("issue author")
+        assert len(extractions) == 2
+
+        # 点击可能改变页面，即使DOM看起来相同也重新提取
+        await browser._click(3)
+        await browser._extract_page_content("issue title")
+        assert len(extractions) == 3
+
+        # 离开页面时清除该页面的缓存，回到同一页面时重新提取
+        await browser._navigate("http://gitlab/issues/2")
+        await browser._navigate(url)
+        result = await browser._extract_page_content("issue title")
+        assert len(extractions) == 4
+        return result
+
+    assert asyncio.run(scenario())["html_result"] == "html 4"
+
+
+def test_browser_pool_shares_one_process_and_recycles_contexts(monkeypatch):
+    from browser_pool import BrowserPool
+    from session import current_browser
+
+    launches = []
+
+    async def start(self):
+        if self._browser is None:
+            launches.append(1)
+            self._browser, self._playwright = object(), object()
+    monkeypatch.setattr(BrowserPool, "start", start)
+    pool = BrowserPool(max_contexts=1)
+
+    async def scenario():
+        first = await pool.acquire()
+        first.browser_session = FakeSession()
+        # 上下文数量达到上限时，后续的acquire等待释放
+        waiter = asyncio.create_task(pool.acquire())
+        await asyncio.sleep(0.01)
+        assert not waiter.done()
+
+        session = first.browser_session
+        await pool.release(first)
+        # 只关闭自己的上下文，不停止共享的浏览器进程
+        assert session.browser_context.closed and not session.stopped
+        second = await asyncio.wait_for(waiter, timeout=1)
+
+        assert second is not first and second.shared_browser is first.shared_browser
+        assert pool.active == [second]
+        await pool.release(second)
+
+        async with pool.session() as bound:
+            assert current_browser() is bound
+        assert current_browser() is None and pool.active == []
+
+    asyncio.run(scenario())
+    assert launches == [1]
@@ -0,0 +1,106 @@
+import json
+
+from browser_state import BROWSER_INFO_BEGIN, BrowserStateTracker, diff_elements, element_info, filter_elements
+
+
+class FakeElement:
+    def __init__(self, index: int, tag: str, text: str, **attributes):
+        self.index, self.tag_name, self.text, self.attributes = index, tag, text, attributes
+
+    def clickable_elements_to_string(self):
+        return f"[{self.index}]<{self.tag_name} {self.text} />\n\t[{self.index + 1000}]<span />"
+
+
+def payload(rendered: str):
+    assert rendered.startswith(BROWSER_INFO_BEGIN)
+    return json.loads(rendered.splitlines()[1])
+
+
+def make_state(url: str = "http://a", elements=None, title: str = "A") -> dict:
+    elements = elements if elements is not None else [
+        {"index": 1, "tag": "button", "text": "<button Save/>"},
+        {"index": 2, "tag": "input", "text": "<input />", "placeholder": "Name"},
+    ]
+    return {"url": url, "title": title, "tabs": [{"url": url, "title": title}], "interactive_elements": elements}
+
+
+def test_element_info_extracts_main_tag_and_attributes():
+    info = element_info(3, FakeElement(3, "a", "Docs", href="/docs", placeholder=""))
+    assert info == {"index": 3, "tag": "a", "text": "<a Docs/>", "href": "/docs"}
+
+
+def test_diff_tracks_elements_by_content_not_index():
+    before = [{"index": 1, "tag": "button", "text": "Save"}, {"index": 2, "tag": "button", "text": "Cancel"}]
+    after = [{"index": 1, "tag": "button", "text": "Cancel"}, {"index": 2, "tag": "a", "text": "Help"}]
+
+    diff = diff_elements(before, after)
+
+    assert diff["added"] == [{"index": 2, "tag": "a", "text": "Help"}]
+    assert diff["removed"] == [{"index": 1, "tag": "button", "text": "Save"}]
+    assert diff["changed"] == [{"index": 1, "tag": "button", "text": "Cancel", "previous_index": 2}]
+
+
+def test_tracker_emits_full_then_unchanged_then_diff():
+    tracker = BrowserStateTracker(snapshot_interval=10)
+
+    assert payload(tracker.render("tab", make_state()))["mode"] == "full"
+    assert "unchanged since step 1" in payload(tracker.render("tab", make_state()))
+
+    elements = make_state()["interactive_elements"] + [{"index": 3, "tag": "a", "text": "<a Next/>"}]
+    diff = payload(tracker.render("tab", make_state(elements=elements)))
+    assert diff["mode"] == "diff" and diff["base_step"] == 1
+    assert diff["added"] == [{"index": 3, "tag": "a", "text": "<a Next/>"}]
+    assert "removed" not in diff
+
+
+def test_tracker_falls_back_to_full_snapshot():
+    tracker = BrowserStateTracker(snapshot_interval=3)
+    tracker.render("tab", make_state())
+
+    assert payload(tracker.render("tab", make_state(), full_snapshot=True))["mode"] == "full"
+    assert payload(tracker.render("tab", make_state(url="http://b")))["mode"] == "full"
+    assert payload(tracker.render("other-tab", make_state(url="http://b")))["mode"] == "full"
+    tracker.render("tab", make_state(url="http://b"))
+    # 距离上次完整快照已达到snapshot_interval
+    assert payload(tracker.render("tab", make_state(url="http://b")))["mode"] == "full"
+
+
+def numbered_elements(count: int) -> list:
+    return [{"index": i, "tag": "a", "text": f"<a item {i}/>"} for i in range(count)]
+
+
+def test_filter_ranks_elements_against_query():
+    elements = [
+        {"index": 1, "tag": "a", "text": "<a Issues/>"},
+        {"index": 2, "tag": "a", "text": "<a Merge requests/>"},
+        {"index": 3, "tag": "input", "text": "<input />", "placeholder": "Search merge request"},
+    ]
+
+    selected, cursor = filter_elements(elements, query="open the merge request", top_k=1)
+
+    assert [elem["index"] for elem in selected] == [2]
+    assert cursor is None
+
+
+def test_filter_pages_with_cursor_and_region():
+    elements = numbered_elements(5)
+    regions = {0: "above", 1: "viewport", 2: "viewport", 3: "below", 4: None}
+
+    page, cursor = filter_elements(elements, offset=0, limit=2)
+    assert [elem["index"] for elem in page] == [0, 1]
+    assert cursor == {"offset": 2, "remaining": 3}
+    page, cursor = filter_elements(elements, offset=cursor["offset"], limit=3)
+    assert [elem["index"] for elem in page] == [2, 3, 4] and cursor is None
+
+    visible, _ = filter_elements(elements, region="viewport", regions=regions)
+    assert [elem["index"] for elem in visible] == [1, 2, 4]
+
+
+def test_filtered_view_does_not_change_diff_base():
+    tracker = BrowserStateTracker()
+    tracker.render("tab", make_state())
+    selected, cursor = filter_elements(make_state()["interactive_elements"], limit=1)
+
+    filtered = payload(tracker.render_filtered(make_state(), selected, cursor, query="", region="all"))
+    assert filtered["mode"] == "filtered" and filtered["cursor"] == {"offset": 1, "remaining": 1}
+    assert "unchanged since step 1" in payload(tracker.render("tab", make_state()))
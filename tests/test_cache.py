@@ -0,0 +1,37 @@
+import cache
+from cache import LRUCache, TieredCache
+
+
+def test_lru_cache_expires_entries_after_ttl(monkeypatch):
+    now = [1000.0]
+    monkeypatch.setattr(cache.time, "time", lambda: now[0])
+    lru = LRUCache(maxsize=4, ttl=10)
+    lru.set("a", 1)
+
+    now[0] += 5
+    assert lru.get("a") == 1
+    now[0] += 10
+    assert lru.get("a") is None and len(lru) == 0
+
+
+def test_tiered_cache_falls_back_to_disk_and_counts(tmp_path):
+    key = ("https://example.com", "dom-hash", "what is this")
+    first = TieredCache(maxsize=4, disk_path=tmp_path)
+    first.set(key, {"vision_result": "a page", "html_result": "<p>"})
+
+    # 新的进程只有磁盘中的条目
+    second = TieredCache(maxsize=4, disk_path=tmp_path)
+    assert second.get(key) == {"vision_result": "a page", "html_result": "<p>"}
+    assert second.get(key) == {"vision_result": "a page", "html_result": "<p>"}
+    assert second.get(("https://example.com", "other-hash", "what is this")) is None
+    assert second.stats() == {"size": 1, "memory_hits": 1, "disk_hits": 1, "misses": 1}
+
+
+def test_tiered_cache_invalidates_memory_entries_by_url():
+    tiered = TieredCache(maxsize=4)
+    tiered.set(("https://a.com", "h1", "q"), "a")
+    tiered.set(("https://b.com", "h2", "q"), "b")
+
+    assert tiered.invalidate(lambda key: key[0] == "https://a.com") == 1
+    assert tiered.get(("https://a.com", "h1", "q")) is None
+    assert tiered.get(("https://b.com", "h2", "q")) == "b"
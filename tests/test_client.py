@@ -0,0 +1,40 @@
+import asyncio
+
+from model import HTTP_CLIENTS, LLM, preconnect
+
+
+def test_llm_instances_share_one_pool_per_base_url(upstream):
+    async def clients():
+        claude, gemini = LLM("claude"), LLM("gemini")
+        assert claude.async_client is LLM("claude").async_client
+        return claude.async_client._client, gemini.async_client._client
+
+    claude_http, gemini_http = asyncio.run(clients())
+    # 两个模型的base_url相同，共享同一个连接池
+    assert claude_http is gemini_http
+
+
+def test_async_clients_are_bound_to_event_loop():
+    async def client():
+        return HTTP_CLIENTS.get_async_client("http://example.invalid/v1")
+
+    assert asyncio.run(client()) is not asyncio.run(client())
+
+
+def test_sync_client_is_shared():
+    assert HTTP_CLIENTS.get_sync_client("http://example.invalid/v1") is \
+        HTTP_CLIENTS.get_sync_client("http://example.invalid/v1")
+
+
+def test_preconnect_reuses_connection_for_first_request(upstream):
+    async def run():
+        await preconnect(["gemini", "unknown-model"])
+        pool = HTTP_CLIENTS.get_async_client(LLM("gemini").base_url)._transport._pool
+        connections = list(pool.connections)
+        await LLM("gemini").async_generate("hi")
+        return connections, list(pool.connections)
+
+    before, after = asyncio.run(run())
+    assert upstream.probes == [("HEAD", "/v1")]
+    assert len(before) == 1
+    assert after == before
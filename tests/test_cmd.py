@@ -0,0 +1,109 @@
+import asyncio
+import json
+import time
+
+import pytest
+
+import toolbox.cmd as cmd
+from shell import ShellSession
+
+
+@pytest.fixture(autouse=True)
+def workspace(tmp_path, monkeypatch):
+    monkeypatch.setattr(cmd, "_default_shell", ShellSession(cwd=str(tmp_path)))
+    return tmp_path
+
+
+def run(command: str, **kwargs) -> list:
+    async def collect():
+        chunks = [chunk["data"]["stream_chunk"] async for chunk in cmd.run_cmd(command, **kwargs)]
+        await cmd._default_shell.aclose()
+        return chunks
+    return asyncio.run(collect())
+
+
+def run_all(*commands: str) -> list:
+    """在同一个事件循环中依次执行多条命令，返回每条命令的输出与结果"""
+    async def collect():
+        outputs = []
+        for command in commands:
+            output = "".join([chunk["data"]["stream_chunk"] async for chunk in cmd.run_cmd(command)])
+            *lines, result = output.rstrip("\n").split("\n")
+            outputs.append(("\n".join(lines), json.loads(result)))
+        await cmd._default_shell.aclose()
+        return outputs
+    return asyncio.run(collect())
+
+
+def test_streams_stdout_and_stderr_with_returncode():
+    chunks = run("echo out; echo err >&2; exit 3")
+    output = "".join(chunks)
+
+    assert "out" in output and "[stderr]\nerr" in output
+    assert json.loads(output.strip().splitlines()[-1])["returncode"] == 3
+
+
+def test_timeout_kills_the_whole_process_group(workspace):
+    start = time.monotonic()
+    chunks = run("(sleep 5; touch leaked) & sleep 5", timeout=1)
+
+    assert time.monotonic() - start < 4
+    result = json.loads("".join(chunks).strip().splitlines()[-1])
+    assert "timed out" in result["error"]
+    time.sleep(0.2)
+    assert not (workspace / "leaked").exists()
+
+
+def test_output_is_capped_keeping_head_and_tail(monkeypatch):
+    monkeypatch.setattr(cmd, "MAX_OUTPUT_CHARS", 100)
+    output = "".join(run("seq 1 10000"))
+
+    assert output.startswith("1\n2\n3\n")
+    assert "characters of output omitted" in output
+    assert "9999\n10000\n" in output
+    assert len(output) < 300
+
+
+def test_output_cap_keeps_short_output_intact():
+    cap = cmd._OutputCap(10)
+    assert cap.feed("abc") == "abc"
+    assert cap.finish() == ""
+
+
+def test_working_directory_and_environment_persist_between_calls(workspace):
+    (workspace / "sub").mkdir()
+    outputs = run_all("cd sub && export GREETING=hi", "pwd; echo $GREETING", "false")
+
+    assert outputs[0][1] == {"returncode": 0, "cwd": str(workspace / "sub")}
+    assert outputs[1][0] == f"{workspace / 'sub'}\nhi\n"
+    assert outputs[2][1]["returncode"] == 1
+
+
+def test_shell_restarts_after_exit_and_timeout(workspace):
+    async def collect():
+        shell = cmd._default_shell
+        events = []
+        for command, timeout in (("cd /; exit 7", 5), ("sleep 5", 0.5), ("pwd", 5)):
+            events.append([item async for item in shell.run(command, timeout)])
+        await shell.aclose()
+        return events, shell.restarts
+
+    (exit_events, timeout_events, pwd_events), restarts = asyncio.run(collect())
+    assert exit_events == [("exit", 7)]
+    assert timeout_events[-1][0] == "timeout" and timeout_events[0][0] == "restart"
+    assert pwd_events[0][0] == "restart"
+    assert "".join(text for kind, text in pwd_events if kind == "stdout") == f"{workspace}\n"
+    assert pwd_events[-1] == ("exit", 0)
+    assert restarts == 2
+
+
+def test_stdout_and_stderr_are_separated_per_command():
+    async def collect():
+        events = [item async for item in cmd._default_shell.run("echo out; echo err >&2; (exit 4)", 5)]
+        await cmd._default_shell.aclose()
+        return events
+
+    events = asyncio.run(collect())
+    assert "".join(text for kind, text in events if kind == "stdout") == "out\n"
+    assert "".join(text for kind, text in events if kind == "stderr") == "err\n"
+    assert events[-1] == ("exit", 4)
@@ -0,0 +1,128 @@
+import json
+
+from browser_state import wrap_browser_info
+from context import ContextManager, PromptStabilityTracker, common_prefix_length, estimate_tokens
+from utils import remove_browser_info_in_the_history
+
+BROWSER_INFO = ("============== BROWSER INFO BEGIN ==============\n{}\n"
+                "============== BROWSER INFO END ==============")
+
+
+def text_message(role: str, text: str) -> dict:
+    return {"role": role, "content": [{"type": "text", "text": text}]}
+
+
+def make_history(observations: int, browser_chars: int = 4000) -> list:
+    history = [text_message("system", "system prompt")]
+    for i in range(observations):
+        history.append(text_message("user", f"Observation: step {i}\n" + BROWSER_INFO.format("x" * browser_chars)))
+        history.append(text_message("assistant", f"Thought: step {i}"))
+    return history
+
+
+def test_estimate_tokens_counts_cjk_per_character():
+    assert estimate_tokens("abcd" * 10) == 10
+    assert estimate_tokens("浏览器状态") == 5
+
+
+def test_under_budget_history_is_untouched():
+    history = make_history(3)
+    snapshot = [dict(message) for message in history]
+
+    report = ContextManager().enforce(history, token_budget=100000)
+
+    assert report["removed"] == 0
+    assert history == snapshot
+
+
+def test_over_budget_compacts_oldest_observations_first_and_keeps_recent():
+    manager = ContextManager(keep_recent=6, target_ratio=0.8)
+    history = make_history(10)
+    recent = history[-6:]
+    budget = manager.count(history) // 2
+
+    report = manager.enforce(history, token_budget=budget)
+
+    assert report["after"] <= int(budget * 0.8)
+    assert report["removed"] == report["before"] - report["after"] > 0
+    # 较早的浏览器状态在检查预算之前就已经被移除
+    assert report["stripped"] > 0
+    assert history[-6:] == recent
+    assert history[0]["content"][0]["text"] == "system prompt"
+    # 最早的观测最先被压缩
+    assert "BROWSER INFO BEGIN" not in history[1]["content"][0]["text"]
+    assert manager.count(history) == report["after"]
+
+
+def test_escalates_to_truncation_and_eviction():
+    manager = ContextManager(keep_recent=2, max_observation_tokens=100)
+    history = [text_message("system", "s")]
+    for i in range(4):
+        history.append(text_message("user", f"Observation: {i}\n" + "y" * 5000))
+        history.append(text_message("assistant", "ok"))
+
+    report = manager.enforce(history, token_budget=300)
+
+    assert report["truncated"] > 0
+    assert report["evicted"] > 0
+    assert ContextManager.EVICTED_TEXT in [m["content"][0]["text"] for m in history]
+
+
+def test_prompt_stability_tracker_reports_common_prefix_share():
+    tracker = PromptStabilityTracker()
+    system = text_message("system", "x" * 1000)
+
+    assert tracker.update([system, text_message("user", "a")]) == 0.0
+    assert tracker.update([system, text_message("user", "b")]) > 0.9
+
+
+def test_common_prefix_length_across_chunk_boundaries():
+    base = "x" * 10000
+    assert common_prefix_length(base, base) == 10000
+    assert common_prefix_length(base, base[:4096]) == 4096
+    assert common_prefix_length(base, base[:5000] + "y" + base[5001:]) == 5000
+    assert common_prefix_length("", base) == 0
+
+
+def test_remove_browser_info_keeps_text_around_each_block():
+    text = "a " + BROWSER_INFO.format("x") + " b " + BROWSER_INFO.format("y").lower() + " c"
+    assert remove_browser_info_in_the_history(text) == (
+        "a [history browser info removed for brevity] b [history browser info removed for brevity] c")
+    assert remove_browser_info_in_the_history("no browser info") == "no browser info"
+
+
+def browser_observation(step: int, mode: str, elements: int = 200) -> dict:
+    state = {"step": step, "mode": mode, "url": "http://gitlab", "interactive_elements": [{"index": i} for i in range(elements)]}
+    # 浏览器工具的结果经过json.dumps后写入历史记录
+    return text_message("user", f"<tool_response>\n{json.dumps(wrap_browser_info(state))}\n</tool_response>")
+
+
+def test_old_browser_info_is_stripped_under_budget_except_latest_snapshot_chain():
+    manager = ContextManager(keep_recent=2)
+    history = [text_message("system", "s")]
+    for step, mode in enumerate(["full", "diff", "full", "diff", "diff", "diff"], 1):
+        history += [text_message("assistant", f"step {step}"), browser_observation(step, mode)]
+
+    report = manager.enforce(history, token_budget=10 ** 6)
+
+    has_browser_info = ["BROWSER INFO BEGIN" in m["content"][0]["text"] for m in history if m["role"] == "user"]
+    assert has_browser_info == [False, False, True, True, True, True]
+    assert report["stripped"] == 2 and not report["snapshot_rewritten"]
+    assert manager.latest_snapshot_index(history) == 6
+
+
+def test_latest_snapshot_is_rewritten_only_as_a_last_resort():
+    manager = ContextManager(keep_recent=1, max_observation_tokens=100)
+    history = [text_message("system", "s"),
+               text_message("user", "Observation: " + "y" * 4000), browser_observation(1, "full"),
+               text_message("assistant", "ok")]
+    tokens = manager.count(history)
+
+    report = manager.enforce(history, token_budget=tokens - 100)
+    assert report["truncated"] == 1 and not report["snapshot_rewritten"]
+    assert report["after"] <= int((tokens - 100) * manager.target_ratio)
+    assert "BROWSER INFO BEGIN" in history[2]["content"][0]["text"]
+
+    report = manager.enforce(history, token_budget=500)
+    assert report["snapshot_rewritten"]
+    assert "BROWSER INFO BEGIN" not in history[2]["content"][0]["text"]
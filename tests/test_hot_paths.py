@@ -0,0 +1,36 @@
+"""
+热点路径的微基准，与benchmark/hot_paths.py使用同一组用例
+安装pytest-benchmark时按其方式测量（pytest tests/test_hot_paths.py --benchmark-only），未安装时每个用例只执行一次以验证其可运行
+"""
+import importlib.util
+import json
+import sys
+
+import pytest
+
+from conftest import ROOT
+
+sys.path.insert(0, str(ROOT / "benchmark"))
+import hot_paths  # noqa: E402
+
+if importlib.util.find_spec("pytest_benchmark") is None:
+    @pytest.fixture
+    def benchmark():
+        return lambda func: func()
+
+
+@pytest.mark.parametrize("name", list(hot_paths.CASES))
+def test_hot_path(benchmark, name):
+    assert benchmark(hot_paths.CASES[name]())
+
+
+def test_synthetic_inputs_have_realistic_sizes():
+    history = hot_paths.make_history()
+    assert len(history) == 2 * hot_paths.HISTORY_STEPS + 1
+    assert len(hot_paths.make_browser_state()["interactive_elements"]) == hot_paths.SELECTOR_MAP_SIZE
+
+
+def test_baseline_covers_every_case():
+    baseline = json.loads(hot_paths.BASELINE_PATH.read_text(encoding="utf-8"))
+    assert set(baseline["cases"]) == set(hot_paths.CASES)
+    assert all(result["median_us"] > 0 for result in baseline["cases"].values())
@@ -0,0 +1,55 @@
+import io
+
+from PIL import Image, ImageDraw
+
+from cache import LRUCache
+from imaging import downscale_image, prepare_image
+
+
+def png_bytes(width: int, height: int, mode: str = "RGB", marker: int = 0) -> bytes:
+    image = Image.new(mode, (width, height), "white")
+    draw = ImageDraw.Draw(image)
+    for x in range(0, width, 40):
+        draw.rectangle([x, 0, x + 20, height // 2], fill="black")
+    if marker:
+        draw.rectangle([0, height - marker, width // 2, height], fill="black")
+    buffer = io.BytesIO()
+    image.save(buffer, format="PNG")
+    return buffer.getvalue()
+
+
+def test_downscale_keeps_aspect_ratio_and_reencodes_as_jpeg():
+    data, mime = downscale_image(png_bytes(2560, 1440), max_width=1280, max_height=1280, quality=70)
+
+    assert mime == "image/jpeg"
+    with Image.open(io.BytesIO(data)) as image:
+        assert image.size == (1280, 720)
+        assert image.format == "JPEG"
+
+
+def test_downscale_keeps_transparency_as_png():
+    _, mime = downscale_image(png_bytes(100, 100, mode="RGBA"), max_width=50, max_height=50)
+    assert mime == "image/png"
+
+
+def test_lru_cache_evicts_least_recently_used_and_counts_hits():
+    cache = LRUCache(maxsize=2)
+    cache.set("a", 1)
+    cache.set("b", 2)
+    assert cache.get("a") == 1
+    cache.set("c", 3)
+
+    assert "b" not in cache and "a" in cache
+    assert cache.find(lambda key, value: value == 3) == ("c", 3)
+    assert cache.find(lambda key, value: value == 2) is None
+    assert cache.stats() == {"size": 2, "hits": 2, "misses": 1}
+
+
+def test_prepare_image_passes_small_supported_images_through():
+    data = png_bytes(200, 100)
+    assert prepare_image(data, max_size=400) == (data, "image/png")
+
+    resized, mime = prepare_image(data, max_size=100)
+    assert mime == "image/jpeg"
+    with Image.open(io.BytesIO(resized)) as image:
+        assert image.size == (100, 50)
@@ -0,0 +1,80 @@
+import json
+import os
+
+from memory_index import MemoryIndex, split_memory
+
+METHODOLOGY = {
+    "PDF处理": "处理PDF前先确认环境中有pdftoppm等工具",
+    "需求澄清": "对有歧义的数量要求先向用户确认",
+    "文件上传": "上传到OwnCloud之后刷新目录确认文件存在",
+}
+APPLICATION = {"GitLab": {"登录失败": "使用root账号登录", "仓库搜索": "在Projects页面搜索仓库名"}}
+
+
+def write_memory(path, data):
+    path.write_text(f"```json\n{json.dumps(data, ensure_ascii=False)}\n```", encoding="utf-8")
+
+
+def make_index(tmp_path):
+    write_memory(tmp_path / "methodology.txt", METHODOLOGY)
+    write_memory(tmp_path / "application.txt", APPLICATION)
+    return MemoryIndex({"方法论": tmp_path / "methodology.txt", "应用": tmp_path / "application.txt"})
+
+
+def test_split_memory_flattens_json_and_falls_back_to_paragraphs():
+    assert split_memory(f"```json\n{json.dumps(APPLICATION, ensure_ascii=False)}\n```") == [
+        "- GitLab / 登录失败: 使用root账号登录",
+        "- GitLab / 仓库搜索: 在Projects页面搜索仓库名",
+    ]
+    assert split_memory("first tip\n\n\nsecond tip\n") == ["first tip", "second tip"]
+    assert split_memory("") == []
+
+
+def test_retrieve_returns_relevant_entries_under_the_caps(tmp_path):
+    index = make_index(tmp_path)
+    entries = index.retrieve("在GitLab上搜索sotopia仓库", top_k=1, max_tokens=1000)
+
+    assert [entry.text for entry in entries] == ["- GitLab / 仓库搜索: 在Projects页面搜索仓库名"]
+    assert len(index.retrieve("GitLab PDF OwnCloud 仓库", top_k=2, max_tokens=1000)) == 2
+    assert index.retrieve("GitLab 仓库", top_k=5, max_tokens=5) == []
+    assert all(entry not in entries for entry in index.retrieve("GitLab 仓库", 5, 1000, exclude=entries))
+
+    rendered = index.render(entries)
+    assert rendered.startswith("<应用>\n- GitLab") and rendered.endswith("</应用>\n")
+    assert index.total_tokens > sum(entry.tokens for entry in entries)
+
+
+def test_index_rebuilds_only_when_memory_files_change(tmp_path):
+    index = make_index(tmp_path)
+    assert index.refresh()
+    assert not index.refresh()
+    assert index.rebuilds == 1
+
+    path = tmp_path / "methodology.txt"
+    write_memory(path, {**METHODOLOGY, "浏览器超时": "页面加载超时时先刷新再重试"})
+    stat = os.stat(path)
+    os.utime(path, ns=(stat.st_atime_ns, stat.st_mtime_ns + 1_000_000))
+
+    assert index.retrieve("浏览器页面加载超时", top_k=1, max_tokens=1000)[0].text.startswith("- 浏览器超时")
+    assert index.rebuilds == 2
+    assert len(index.entries) == 6
+
+
+def test_select_keeps_full_memory_when_it_fits_the_cap(tmp_path):
+    index = make_index(tmp_path)
+    index.refresh()
+    entries = index.select("在GitLab上搜索sotopia仓库", top_k=1, max_tokens=index.total_tokens)
+
+    assert entries == index.entries
+    assert index.select("GitLab 仓库", top_k=1, max_tokens=index.total_tokens, exclude=entries) == []
+
+
+def test_select_falls_back_to_full_memory_for_cross_language_queries(tmp_path):
+    index = make_index(tmp_path)
+    index.refresh()
+    cap = index.total_tokens - 1
+
+    assert index.select("Upload the PDF report to OwnCloud", top_k=3, max_tokens=cap, fallback_below=3) == index.entries
+    assert len(index.select("Upload the PDF report to OwnCloud", top_k=3, max_tokens=cap)) < 3
+    selected = index.select("在GitLab上登录并搜索仓库，处理PDF并上传到OwnCloud", top_k=3, max_tokens=cap, fallback_below=3)
+    assert 0 < len(selected) < len(index.entries)
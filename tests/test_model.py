@@ -0,0 +1,141 @@
+import asyncio
+import copy
+
+from model import LLM
+
+CACHE_CONTROL = {"type": "ephemeral"}
+
+
+def make_history():
+    return [
+        {"role": "system", "content": [{"type": "text", "text": "meta\n<knowledge>k</knowledge>\n<tools>\n{}\n</tools>\nrest"}]},
+        {"role": "user", "content": [{"type": "text", "text": "task"}]},
+        {"role": "assistant", "content": [{"type": "text", "text": "plan"}]},
+    ]
+
+
+async def collect(generator):
+    return "".join([chunk async for chunk in generator])
+
+
+async def generate_both(llm, history):
+    """依次发起一次普通请求和一次流式请求（LLM的http client绑定在同一个事件循环上）"""
+    return await llm.async_generate("next", history=history), await collect(llm.async_stream_generate("next", history=history))
+
+
+def test_claude_breakpoints_on_system_and_last_stable_turn(upstream):
+    llm = LLM("claude")
+    history = make_history()
+    snapshot = copy.deepcopy(history)
+
+    assert asyncio.run(generate_both(llm, history)) == ("hello world", "hello world ")
+
+    assert history == snapshot
+    for request in upstream.requests:
+        system, user, assistant, prompt = request["messages"]
+        assert len(system["content"]) == 1
+        assert system["content"][-1]["cache_control"] == CACHE_CONTROL
+        assert "cache_control" not in user["content"][-1]
+        assert assistant["content"][-1]["cache_control"] == CACHE_CONTROL
+        assert "cache_control" not in prompt["content"][-1]
+
+    assert "stream_options" not in upstream.requests[0]
+    assert upstream.requests[1]["stream_options"] == {"include_usage": True}
+
+
+def test_gemini_sends_plain_messages(upstream):
+    llm = LLM("gemini")
+    history = make_history()
+
+    asyncio.run(generate_both(llm, history))
+
+    for request in upstream.requests:
+        assert request["messages"][:-1] == history
+        assert "cache_control" not in str(request["messages"])
+
+
+def test_usage_stats_accumulate_cached_tokens(upstream):
+    llm = LLM("claude")
+
+    asyncio.run(generate_both(llm, make_history()))
+
+    assert llm.last_usage == {"prompt_tokens": 100, "cached_tokens": 80, "completion_tokens": 2}
+    assert llm.usage_stats == {"calls": 2, "prompt_tokens": 200, "cached_tokens": 160, "completion_tokens": 4}
+
+
+def test_running_usage_on_every_chunk_is_recorded_once(upstream):
+    upstream.usage_every_chunk = True
+    llm = LLM("gemini")
+
+    asyncio.run(collect(llm.async_stream_generate("next", history=make_history())))
+
+    assert llm.usage_stats == {"calls": 1, "prompt_tokens": 100, "cached_tokens": 80, "completion_tokens": 2}
+
+
+def test_images_are_resized_per_model_labelled_with_their_format_and_cached(upstream, tmp_path, monkeypatch):
+    import base64
+    import io
+    import os
+
+    from PIL import Image
+
+    import model
+
+    monkeypatch.setattr(model, "IMAGE_CACHE", model.LRUCache(maxsize=8))
+    path = tmp_path / "shot.png"
+    Image.new("RGB", (3000, 1500), "white").save(path)
+    llm = LLM("claude")
+
+    async def send_twice():
+        await llm.async_generate("describe", image_path=path)
+        await llm.async_generate("describe", image_path=path)
+
+    asyncio.run(send_twice())
+    urls = [request["messages"][-1]["content"][1]["image_url"]["url"] for request in upstream.requests]
+    assert urls[0] == urls[1] and urls[0].startswith("data:image/jpeg;base64,")
+    with Image.open(io.BytesIO(base64.b64decode(urls[0].split(",", 1)[1]))) as sent:
+        assert sent.size == (llm.max_image_size, llm.max_image_size // 2)
+    assert model.IMAGE_CACHE.stats()["hits"] == 1
+
+    # 小图按原格式原样发送；文件被修改后缓存失效
+    Image.new("RGB", (10, 10), "red").save(path)
+    os.utime(path, ns=(0, 10 ** 9))
+    assert asyncio.run(llm.image_to_base64(path))[1] == "image/png"
+
+
+def test_stream_stops_once_stop_at_returns_a_cut(upstream):
+    from agent import tool_call_stream_end
+
+    upstream.content = '<tool_call>{"name":"a","arguments":{}}</tool_call> Observation: invented result that goes on'
+    llm = LLM("gemini")
+
+    text = asyncio.run(collect(llm.async_stream_generate("next", stop_at=tool_call_stream_end)))
+
+    # 工具调用之后的空白已经输出，之后的内容被截断
+    assert text.rstrip() == '<tool_call>{"name":"a","arguments":{}}</tool_call>'
+    assert llm.stream_stats == {"streams": 1, "early_stops": 1}
+    # 提前停止的请求没有服务端的usage，用量按估计值单独记录
+    assert llm.usage_stats["calls"] == 0
+    assert llm.last_usage["estimated"] and llm.last_usage["completion_tokens"] > 0
+    assert llm.estimated_usage_stats["calls"] == 1 and llm.estimated_usage_stats["prompt_tokens"] > 0
+
+
+def test_stop_sequence_is_forwarded(upstream):
+    llm = LLM("gemini")
+    asyncio.run(collect(llm.async_stream_generate("next", stop=["</tool_call>"])))
+    assert upstream.requests[0]["stop"] == ["</tool_call>"]
+
+
+def test_prompt_stability_only_tracks_opted_in_requests(upstream):
+    llm = LLM("gemini")
+
+    async def requests():
+        await collect(llm.async_stream_generate("act", history=make_history(), track_stability=True))
+        # 反思、视觉等使用其他历史记录的请求不计入
+        await llm.async_generate("reflect", history=[{"role": "user", "content": [{"type": "text", "text": "x"}]}])
+        await collect(llm.async_stream_generate("act again", history=make_history(), track_stability=True))
+
+    asyncio.run(requests())
+    assert len(upstream.requests) == 3
+    assert llm.prompt_stability.calls == 2
+    assert llm.prompt_stability.last_ratio > 0.5
@@ -0,0 +1,31 @@
+from plan_library import PlanLibrary
+
+PLAN = {"open repo": "repo page is shown", "upload readme": "file is in Documents"}
+
+
+def test_match_prefers_the_most_similar_successful_task(tmp_path):
+    library = PlanLibrary(tmp_path / "plans.jsonl")
+    library.record("upload the sotopia README to owncloud documents", PLAN, "success")
+    library.record("create a plane issue for the login bug", {"open plane": "issue created"}, "success")
+    library.record("upload the janusgraph README to owncloud documents", {"x": "y"}, "failure")
+
+    entry, similarity = library.match("upload the sotopia README to owncloud documents")
+    assert entry["plan"] == PLAN
+    assert similarity == 1.0
+
+    entry, similarity = library.match("upload the openhands README to owncloud")
+    assert entry["plan"] == PLAN
+    assert 0 < similarity < 1
+    assert library.match("order pizza") is None
+
+
+def test_library_persists_and_skips_plans_that_failed_when_reused(tmp_path):
+    path = tmp_path / "memory" / "plans.jsonl"
+    library = PlanLibrary(path)
+    library.record("upload the sotopia README to owncloud", PLAN, "success")
+    assert PlanLibrary(path).match("upload the sotopia README to owncloud")[0]["plan"] == PLAN
+
+    library.record("upload the sotopia README to owncloud", PLAN, "failure", reused=True)
+    reloaded = PlanLibrary(path)
+    assert len(reloaded) == 2
+    assert reloaded.match("upload the sotopia README to owncloud") is None
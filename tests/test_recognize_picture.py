@@ -0,0 +1,49 @@
+import asyncio
+
+import pytest
+from PIL import Image
+
+import toolbox.recognize_picture as recognize_picture
+from cache import TieredCache
+
+
+@pytest.fixture
+def cache_dir(tmp_path, monkeypatch):
+    monkeypatch.setattr(recognize_picture, "_description_cache", TieredCache(disk_path=tmp_path / "cache"))
+    return tmp_path / "cache"
+
+
+def make_image(path, color) -> str:
+    Image.new("RGB", (8, 8), color).save(path)
+    return str(path)
+
+
+def describe(image_path) -> str:
+    async def collect():
+        return "".join([chunk["data"]["stream_chunk"]
+                        async for chunk in recognize_picture.gpt4o_describe_image(image_path)])
+    return asyncio.run(collect())
+
+
+def test_batch_is_described_concurrently_and_identical_images_share_one_request(upstream, cache_dir, tmp_path):
+    red = make_image(tmp_path / "red.png", "red")
+    red_copy = make_image(tmp_path / "red_copy.png", "red")
+    blue = make_image(tmp_path / "blue.png", "blue")
+
+    result = describe([red, red_copy, blue, str(tmp_path / "missing.png")])
+
+    assert len(upstream.requests) == 2
+    assert all(request["messages"][0]["content"][1]["image_url"]["url"].startswith("data:image/png;base64,")
+               for request in upstream.requests)
+    assert result.count("hello world") == 3
+    assert "图片4" in result and "读取图片失败" in result
+
+
+def test_descriptions_are_reused_across_runs_from_disk(upstream, cache_dir, monkeypatch, tmp_path):
+    image = make_image(tmp_path / "green.png", "green")
+    assert describe(image) == "hello world"
+
+    # 新的运行只有磁盘缓存
+    monkeypatch.setattr(recognize_picture, "_description_cache", TieredCache(disk_path=cache_dir))
+    assert describe(image) == "hello world"
+    assert len(upstream.requests) == 1
@@ -0,0 +1,71 @@
+import httpx
+import pytest
+
+from conftest import UPSTREAM_PORT, _free_port, serve
+from replay_server import ReplayServer, request_key
+
+
+def chat_request(now: str, stream: bool = True) -> dict:
+    return {
+        "model": "gemini-2.5-flash",
+        "stream": stream,
+        "stream_options": {"include_usage": True},
+        "messages": [{"role": "user", "content": [{"type": "text", "text": f"current time: {now}\nhello"}]}],
+    }
+
+
+@pytest.fixture
+def start_server(tmp_path):
+    """启动共享同一个录制目录的ReplayServer，返回应用实例和chat completions地址"""
+    servers = []
+
+    def start(mode: str, **kwargs):
+        port = _free_port()
+        app = ReplayServer(mode, tmp_path / "cassette", **kwargs)
+        servers.append(serve(app, port))
+        return app, f"http://127.0.0.1:{port}/v1/chat/completions"
+
+    yield start
+    for server in servers:
+        server.should_exit = True
+
+
+def test_request_key_ignores_timestamps_and_stream_flags():
+    assert request_key(chat_request("2025-07-16 10:12:15.367877")) == \
+        request_key(chat_request("2026-01-01 00:00:00", stream=False))
+    assert request_key(chat_request("2025-07-16 10:12:15")) != \
+        request_key({**chat_request("2025-07-16 10:12:15"), "model": "gpt-4.1"})
+
+
+def test_recorded_stream_replays_byte_identical(upstream, start_server):
+    recorder, record_url = start_server("record", upstream=f"http://127.0.0.1:{UPSTREAM_PORT}/v1")
+    recorded = httpx.post(record_url, json=chat_request("2025-07-16 10:12:15"))
+    assert recorded.status_code == 200
+    assert recorder.stats["recorded"] == 1
+
+    player, replay_url = start_server("replay")
+    replayed = httpx.post(replay_url, json=chat_request("2025-07-17 08:00:00"))
+    assert replayed.status_code == 200
+    assert replayed.content == recorded.content
+    assert replayed.headers["content-type"] == recorded.headers["content-type"]
+
+    # 录制的响应只有一份，第二次回放应当视为未命中
+    exhausted = httpx.post(replay_url, json=chat_request("2025-07-17 08:00:01"))
+    assert exhausted.status_code == 404
+    assert player.stats == {"requests": 2, "hits": 1, "misses": 1, "recorded": 0}
+
+
+def test_invalid_request_body_returns_json_error(start_server):
+    _, replay_url = start_server("replay")
+    response = httpx.post(replay_url, content=b"not json")
+    assert response.status_code == 400
+    assert "error" in response.json()
+
+
+def test_non_json_upstream_error_is_wrapped(upstream, start_server):
+    upstream.html_error = True
+    recorder, record_url = start_server("record", upstream=f"http://127.0.0.1:{UPSTREAM_PORT}/v1")
+    response = httpx.post(record_url, json=chat_request("2025-07-16 10:12:15", stream=False))
+    assert response.status_code == 502
+    assert "502 Bad Gateway" in response.json()["error"]["message"]
+    assert recorder.stats["recorded"] == 0
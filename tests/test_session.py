@@ -0,0 +1,18 @@
+import asyncio
+
+from session import bind_browser, current_browser
+
+
+def test_bound_browser_is_isolated_per_task():
+    async def agent(name: str):
+        with bind_browser(name):
+            await asyncio.sleep(0)
+            # 子任务继承绑定
+            inner = await asyncio.create_task(asyncio.sleep(0, result=current_browser()))
+            return current_browser(), inner
+
+    async def main():
+        return await asyncio.gather(agent("a"), agent("b"))
+
+    assert asyncio.run(main()) == [("a", "a"), ("b", "b")]
+    assert current_browser() is None
@@ -0,0 +1,54 @@
+import asyncio
+import json
+import shutil
+
+from tool import LazyTool, ToolRegistry, generate_tool_schema
+
+
+def copy_toolbox(tmp_path):
+    folder = tmp_path / "toolbox"
+    folder.mkdir()
+    shutil.copy("toolbox/cmd.py", folder / "cmd.py")
+    return folder
+
+
+def test_manifest_registers_lazy_tools_with_identical_schemas(tmp_path):
+    folder, manifest = copy_toolbox(tmp_path), tmp_path / "manifest.json"
+    eager = ToolRegistry()
+    eager.load_tools(str(folder), manifest_path=manifest)
+    assert eager.manifest_stats == {"hits": 0, "misses": 1}
+    assert list(json.loads(manifest.read_text(encoding="utf-8"))) == ["cmd"]
+
+    lazy = ToolRegistry()
+    lazy.load_tools(str(folder), manifest_path=manifest)
+    assert lazy.manifest_stats == {"hits": 1, "misses": 0}
+    assert isinstance(lazy.get_tool("run_cmd"), LazyTool)
+    assert lazy.tool_schema("run_cmd") == generate_tool_schema(eager.get_tool("run_cmd"))
+    assert lazy.tool_schema("run_cmd", "new description") == generate_tool_schema(eager.get_tool("run_cmd"), "new description")
+
+
+def test_manifest_is_rebuilt_when_the_module_source_changes(tmp_path):
+    folder, manifest = copy_toolbox(tmp_path), tmp_path / "manifest.json"
+    ToolRegistry().load_tools(str(folder), manifest_path=manifest)
+    signature = json.loads(manifest.read_text(encoding="utf-8"))["cmd"]["signature"]
+
+    with open(folder / "cmd.py", "a", encoding="utf-8") as f:
+        f.write("\n# changed\n")
+    registry = ToolRegistry()
+    registry.load_tools(str(folder), manifest_path=manifest)
+
+    assert registry.manifest_stats == {"hits": 0, "misses": 1}
+    assert not isinstance(registry.get_tool("run_cmd"), LazyTool)
+    assert json.loads(manifest.read_text(encoding="utf-8"))["cmd"]["signature"] != signature
+
+
+def test_lazy_tool_imports_its_module_on_first_call():
+    tool = LazyTool("_chunk", "cmd")
+    assert tool.func is None
+    # _chunk不是异步生成器，这里只验证导入与解析
+    assert tool.resolve()("x") == {"data": {"stream_chunk": "x"}, "instruction": ""}
+
+    async def collect():
+        return [chunk async for chunk in LazyTool("gpt4o_describe_image", "recognize_picture")(image_path=[])]
+
+    assert asyncio.run(collect()) == [{"data": {"stream_chunk": ""}, "instruction": ""}]
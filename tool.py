@@ -1,27 +1,84 @@
+import asyncio
+import hashlib
 import importlib
 import inspect
 import json
 import os
 import re
+from pathlib import Path
 from typing import Callable, List, Union, get_origin, get_args, Dict, Any
 
+# 工具清单的签名包含本文件的内容，schema的生成方式变化时清单同样失效
+_SCHEMA_SOURCE_HASH = hashlib.sha256(Path(__file__).read_bytes()).hexdigest()
+
+
+class LazyTool:
+    """
+    工具清单中的工具，第一次调用时才在线程中导入其所在的模块，避免启动时导入浏览器等重量级依赖
+    """
+    def __init__(self, name: str, module_name: str):
+        self.__name__ = name
+        self.module_name = module_name
+        self.func = None
+
+    def resolve(self) -> Callable:
+        if self.func is None:
+            module = importlib.import_module(f"toolbox.{self.module_name}")
+            self.func = getattr(module, self.__name__)
+        return self.func
+
+    async def __call__(self, **kwargs):
+        func = self.func or await asyncio.to_thread(self.resolve)
+        async for chunk in func(**kwargs):
+            yield chunk
+
 
 class ToolRegistry:
     def __init__(self):
         self.tools = {}
+        # 只读工具（不改变浏览器、文件等外部状态），同一回复中的多个只读工具调用可以并发执行
+        self.read_only_tools = set()
+        # 工具名到其所属工具组（由工具模块的TOOL_GROUP声明），不属于任何工具组的工具总是提供给模型
+        self.tool_groups: Dict[str, str] = {}
+        # 从工具清单中读取的、预先生成的工具schema
+        self.schemas: Dict[str, Dict[str, Any]] = {}
+        self.manifest_stats = {"hits": 0, "misses": 0}
 
-    def register_tool(self, tool_name: str, tool_func: Callable):
+    def register_tool(self, tool_name: str, tool_func: Callable, group: str = None):
         """注册工具函数到工具注册器"""
         self.tools[tool_name] = tool_func
+        if group is not None:
+            self.tool_groups[tool_name] = group
+
+    def groups(self) -> List[str]:
+        return sorted(set(self.tool_groups.values()))
+
+    def tool_names(self, groups: List[str] = None) -> List[str]:
+        """属于groups中任一工具组的工具以及不属于任何工具组的工具，groups为None时返回全部工具"""
+        return [name for name in self.tools
+                if groups is None or name not in self.tool_groups or self.tool_groups[name] in groups]
 
     def get_tool(self, tool_name: str):
         """通过工具名获取工具函数"""
         return self.tools.get(tool_name)
 
-    def load_module_tools(self, module_name: str):
-        """根据功能模块名称加载工具"""
+    def is_read_only(self, tool_name: str) -> bool:
+        return tool_name in self.read_only_tools
+
+    def tool_schema(self, tool_name: str, enhance_des: str | None = None) -> str:
+        """工具的json描述，优先使用清单中预先生成的schema"""
+        schema = self.schemas.get(tool_name)
+        if schema is None:
+            return generate_tool_schema(self.tools[tool_name], enhance_des)
+        if enhance_des is not None:
+            schema = {**schema, "function": {**schema["function"], "description": enhance_des}}
+        return json.dumps(schema, ensure_ascii=False)
+
+    def load_module_tools(self, module_name: str) -> bool:
+        """根据功能模块名称加载工具，返回是否加载成功"""
         try:
             module = importlib.import_module(f"toolbox.{module_name}")
+            group = getattr(module, "TOOL_GROUP", module_name)
 
             # 遍历模块中的所有属性，确保它们是“可调用的”、不是私有的，并且定义在当前模块中
             for attr_name in dir(module):
@@ -31,22 +88,73 @@ class ToolRegistry:
                         and not attr_name.startswith('_')
                         and getattr(attr, '__module__', None) == module.__name__  # 检查函数是否定义在当前模块中
                 ):
-                    self.register_tool(attr_name, attr)
+                    self.register_tool(attr_name, attr, group)
+            # 工具模块通过模块级的READ_ONLY_TOOLS声明其中的只读工具
+            self.read_only_tools.update(getattr(module, "READ_ONLY_TOOLS", ()))
+            return True
         except Exception as e:
             print(f"Error loading module 'toolbox.{module_name}': {e}")
+            return False
 
-    def load_tools(self, tools_folder: str="toolbox", modules: List[str] = None):
-        """根据模块列表加载工具"""
+    def load_tools(self, tools_folder: str="toolbox", modules: List[str] = None, manifest_path: str | Path = None):
+        """
+        根据模块列表加载工具
+        指定manifest_path时使用工具清单：模块源码未变化时只按清单注册延迟导入的工具，否则导入模块并更新清单
+        """
         # 如果没有指定模块列表，加载所有模块
         if modules is None:
-            modules = [
+            modules = sorted(
                 filename[:-3] for filename in os.listdir(tools_folder)
                 if filename.endswith('.py') and filename != '__init__.py'
-            ]
+            )
+
+        if manifest_path is None:
+            # 加载每个指定模块中的工具
+            for module_name in modules:
+                self.load_module_tools(module_name)
+            return
+
+        manifest_path = Path(manifest_path)
+        try:
+            manifest = json.loads(manifest_path.read_text(encoding="utf-8"))
+        except (OSError, json.JSONDecodeError):
+            manifest = {}
 
-        # 加载每个指定模块中的工具
+        changed = False
         for module_name in modules:
-            self.load_module_tools(module_name)
+            signature = self.module_signature(Path(tools_folder) / f"{module_name}.py")
+            entry = manifest.get(module_name)
+            if entry is not None and entry.get("signature") == signature:
+                self.manifest_stats["hits"] += 1
+                for tool in entry["tools"]:
+                    self.register_tool(tool["name"], LazyTool(tool["name"], module_name), entry["group"])
+                    self.schemas[tool["name"]] = tool["schema"]
+                self.read_only_tools.update(entry["read_only"])
+                continue
+
+            self.manifest_stats["misses"] += 1
+            before = set(self.tools)
+            if not self.load_module_tools(module_name):
+                # 导入失败的模块不写入清单，下次启动时重试
+                changed = manifest.pop(module_name, None) is not None or changed
+                continue
+            names = [name for name in self.tools if name not in before]
+            manifest[module_name] = {
+                "signature": signature,
+                "group": self.tool_groups.get(names[0], module_name) if names else module_name,
+                "tools": [{"name": name, "schema": json.loads(generate_tool_schema(self.tools[name]))} for name in names],
+                "read_only": sorted(self.read_only_tools.intersection(names)),
+            }
+            changed = True
+
+        if changed:
+            manifest_path.parent.mkdir(parents=True, exist_ok=True)
+            manifest_path.write_text(json.dumps(manifest, ensure_ascii=False, indent=2), encoding="utf-8")
+
+    @staticmethod
+    def module_signature(path: Path) -> str:
+        """工具模块源码与schema生成方式的哈希"""
+        return hashlib.sha256(path.read_bytes() + _SCHEMA_SOURCE_HASH.encode()).hexdigest()
 
 
 def generate_tool_schema(func: Callable, enhance_des: str | None = None) -> str:
@@ -1,9 +1,19 @@
 import asyncio
 import json
-from browser import BrowserUseLight
+from browser import BrowserUseLight, default_browser
+from session import current_browser
 
+# 工具所属的工具组，agent按任务步骤只向模型提供相关工具组的工具
+TOOL_GROUP = "browser"
+# 同一回复中的多个只读工具调用会并发执行，因此只有既不改动DOM、也不改动浏览器状态记录的工具才是只读的
+# browser_get_browser_state与需要标记的browser_extract_content会在页面中绘制标记，并推进增量状态的基准，不能并发
+READ_ONLY_TOOLS = {"browser_list_tabs"}
+
+
+def _get_browser() -> BrowserUseLight:
+    """当前agent绑定的浏览器，未绑定时返回进程级的默认浏览器"""
+    return current_browser() or default_browser()
 
-browser = BrowserUseLight()
 
 async def browser_navigate( url: str, new_tab: bool = False):
     """
@@ -13,10 +23,14 @@ async def browser_navigate( url: str, new_tab: bool = False):
         url: 目标网页的 URL。
         new_tab: 是否在新标签页打开（默认 False）。
     """
-    if browser.browser_session is None:
-        await browser._init_browser_session()
+    browser = _get_browser()
+    # 浏览器已经预热时直接使用，仍在启动时等待其完成
+    await browser._ensure_session()
 
+    restart_notice = await browser._enforce_memory_limit()
     result = await browser._navigate(url, new_tab=new_tab)
+    if restart_notice:
+        result = f"{restart_notice}\n{result}"
     result_dict = {
         "data": {
             "stream_chunk": json.dumps(result, ensure_ascii=False, indent=2)
@@ -38,6 +52,7 @@ async def browser_click(index: int, new_tab: bool = False):
         index: 目标元素的索引号。
         new_tab: 是否通过新标签页打开（适用于链接，默认 False）。
     """
+    browser = _get_browser()
     result = await browser._click(index, new_tab=new_tab)
     result_dict = {
             "data": {
@@ -51,7 +66,14 @@ async def browser_click(index: int, new_tab: bool = False):
 
     yield result_dict
 
-async def browser_get_browser_state():
+async def browser_get_browser_state(
+    full_snapshot: bool = False,
+    query: str = "",
+    top_k: int = 20,
+    region: str = "all",
+    offset: int = 0,
+    limit: int = 0
+):
     """
     获取当前浏览器状态，包括：
     1. 当前浏览器显示的标签页的url
@@ -62,9 +84,25 @@ async def browser_get_browser_state():
     注意：
     - 该工具使用后将会给浏览器当前标签页上的可交互元素绘制标记框以及元素索引，重复使用将会更新绘制，在页面变化后需要及时利用这个工具更新
     - 该工具对于文本、视觉内容信息的提取可能比较简略，富内容信息需要使用browser_extract_content_by_vision工具补充提取
-    - 该浏览器状态获得后最多会在上下文中维持六轮对话，然后需要重新获取
+    - 上下文超出预算时，较早的浏览器状态会被优先移除，需要时请重新获取
+    - 同一标签页的URL没有变化时，默认只返回相对上一次获取(step)的变化：页面没有变化时返回unchanged；\
+否则返回新增(added)、移除(removed)以及index发生变化(changed)的元素，此时上一次获取的其余元素仍然有效
+    - 如果上下文中已经找不到之前的完整状态，请设置full_snapshot为True
+    - 在元素很多的页面上，可以用query只获取与当前目标最相关的元素，或者用region、offset、limit分页获取；\
+分页结果中的cursor.offset即为获取下一页时应传入的offset，筛选结果总是返回所选元素的完整信息而不是增量
+
+    Args:
+        full_snapshot: 是否强制返回完整的浏览器状态而不是增量（默认 False）
+        query: 与当前步骤目标相关的关键词，非空时只返回相关性最高的top_k个元素（默认为空，不筛选）
+        top_k: 使用query时返回的元素个数（默认 20）
+        region: 只返回位于指定区域的元素，可选 all、viewport（当前可视区域）、above（可视区域上方）、below（可视区域下方），默认 all
+        offset: 分页获取时跳过的元素个数（默认 0）
+        limit: 分页获取时每页的元素个数，0表示不分页（默认 0）
     """
-    result = await browser._get_browser_state()
+    browser = _get_browser()
+    result = await browser._get_browser_state(
+        full_snapshot=full_snapshot, query=query, top_k=top_k, region=region, offset=offset, limit=limit
+    )
 
     yield {
         "data": {
@@ -86,16 +124,17 @@ async def browser_extract_content(query: str = "请详细地描述这个网页",
         query: 给视觉模型的内容提取的指令，默认为：请详细地描述这个网页
         need_mark: 自动使用browser_get_browser_state为页面的可交互元素绘制标记，默认为False（但是当前页面如果在先前的action中调用过browser_get_browser_state，那么即使该参数设置为False仍然会有标记）
     """
+    browser = _get_browser()
     if need_mark:
-        await browser._get_browser_state()
-    tasks = [browser._extract_content_by_vision(query), browser._extract_content(query, True)]
-    vision_result, html_result = await asyncio.gather(*tasks)
+        await browser._mark_elements()
+    # 对未变化的页面重复提问时直接复用缓存的提取结果
+    result = await browser._extract_page_content(query)
 
     yield {
         "data": {
             "stream_chunk": str({
-                "vision_result": vision_result,
-                "html_result": html_result
+                "vision_result": result["vision_result"],
+                "html_result": result["html_result"]
             })
         },
         "instruction": ""
@@ -109,6 +148,7 @@ async def browser_type_text(index: int, text: str):
         index: 目标输入框元素的索引。
         text: 需要输入的文本内容。
     """
+    browser = _get_browser()
     result = await browser._type_text(index, text)
 
     yield {
@@ -125,6 +165,7 @@ async def browser_send_keys(keys: str):
     Args:
         keys: 发送的按键信息，如"Enter"、"Control+A"等。
     """
+    browser = _get_browser()
     result = await browser._send_keys(keys)
 
     yield {
@@ -138,6 +179,7 @@ async def browser_go_back():
     """
     触发浏览器当前标签页的"回退"
     """
+    browser = _get_browser()
     result = await browser._go_back()
 
     yield {
@@ -164,6 +206,7 @@ async def browser_list_tabs():
     """
     获取浏览器当前所有已打开标签页的列表。
     """
+    browser = _get_browser()
     result = await browser._list_tabs()
 
     yield {
@@ -180,6 +223,7 @@ async def browser_switch_tab(tab_index: int):
     Args:
         tab_index: 目标标签页的索引号。
     """
+    browser = _get_browser()
     result = await browser._switch_tab(tab_index)
 
     yield {
@@ -196,6 +240,7 @@ async def browser_close_tab(tab_index: int):
     Args:
         tab_index: 目标标签页的索引号。
     """
+    browser = _get_browser()
     result = await browser._close_tab(tab_index)
 
     yield {
@@ -1,32 +1,101 @@
 import json
-import subprocess
+
+from model import config
+from session import current_shell
+from shell import ShellSession
+
+TOOL_GROUP = "shell"
+CMD_CONFIG = config.get("tools", {}).get("cmd", {})
+CMD_CWD = CMD_CONFIG.get("cwd", "/workspace")
+DEFAULT_TIMEOUT = CMD_CONFIG.get("timeout", 300)
+MAX_OUTPUT_CHARS = CMD_CONFIG.get("max_output_chars", 20000)
+
+
+class _OutputCap:
+    """
+    限制返回给模型的命令输出长度：前max_chars/2个字符随到随输出，之后只保留最后max_chars/2个字符，结束时再输出
+    """
+    def __init__(self, max_chars: int):
+        self.head_chars = max_chars // 2
+        self.tail_chars = max_chars - self.head_chars
+        self.emitted = 0
+        self.tail = ""
+        self.omitted = 0
+
+    def feed(self, text: str) -> str:
+        """输入一段输出，返回可以立即输出的部分"""
+        head = text[:max(0, self.head_chars - self.emitted)]
+        self.emitted += len(head)
+        rest = text[len(head):]
+        if rest:
+            self.tail += rest
+            if len(self.tail) > self.tail_chars:
+                self.omitted += len(self.tail) - self.tail_chars
+                self.tail = self.tail[-self.tail_chars:]
+        return head
+
+    def finish(self) -> str:
+        """返回被保留的末尾部分，中间被省略时附带省略说明"""
+        if not self.omitted:
+            return self.tail
+        return f"\n...[{self.omitted} characters of output omitted]...\n{self.tail}"
+
+
+_default_shell: ShellSession | None = None
+
+
+def _get_shell() -> ShellSession:
+    """当前agent绑定的shell会话，未绑定时使用进程级的默认会话"""
+    global _default_shell
+    if shell := current_shell():
+        return shell
+    if _default_shell is None:
+        _default_shell = ShellSession(cwd=CMD_CWD)
+    return _default_shell
+
+
+def _chunk(text: str) -> dict:
+    return {"data": {"stream_chunk": text}, "instruction": ""}
+
 
 async def run_cmd(
     command: str,
+    timeout: int = 0,
 ):
     """
-    执行一个完整的 shell 命令字符串，并返回执行结果。
+    在当前agent的持久shell会话中执行一个完整的 shell 命令字符串，流式返回标准输出与标准错误，最后返回退出码与当前工作目录。
+    工作目录、导出的环境变量、激活的虚拟环境等会在多次调用之间保持，不需要每次都重新cd或source。
+    输出过长时只保留开头和结尾部分。
 
     Args:
         command: 要执行的命令，如 "ls -la /home"
+        timeout: 超时时间（秒），超时后终止该命令及其所有子进程（shell会话随之重启），默认为0表示使用默认的超时时间
     """
-    result = subprocess.run(
-        command,
-        shell=True,  # 允许字符串形式命令
-        capture_output=True,  # 捕获标准输出和错误
-        text=True,  # 输出为字符串（不是字节）
-        cwd = "/workspace"
-    )
-
-    result =  {
-        "returncode": result.returncode,
-        "stdout": result.stdout.strip(),
-        "stderr": result.stderr.strip()
-    }
-
-    yield {
-        "data": {
-            "stream_chunk": json.dumps(result, ensure_ascii=False, indent=2)
-        },
-        "instruction": ""
-    }
\ No newline at end of file
+    timeout = timeout or DEFAULT_TIMEOUT
+    shell = _get_shell()
+    cap = _OutputCap(MAX_OUTPUT_CHARS)
+    current_stream = "stdout"
+    result = {}
+
+    async for kind, value in shell.run(command, timeout):
+        if kind in ("stdout", "stderr"):
+            text = value
+            if kind != current_stream:
+                # 标准输出与标准错误交替时标注来源
+                text = f"\n[{kind}]\n{text}"
+                current_stream = kind
+            if head := cap.feed(text):
+                yield _chunk(head)
+        elif kind == "exit":
+            result["returncode"] = value
+        elif kind == "timeout":
+            result["returncode"] = None
+            result["error"] = value
+        elif kind == "restart":
+            result["notice"] = f"{value}, the working directory and environment variables were reset"
+
+    # 会话中的工作目录会在命令之间保持，返回给模型以免其重复cd
+    result["cwd"] = shell.last_cwd
+    if cap.omitted:
+        result["omitted_characters"] = cap.omitted
+    yield _chunk(f"{cap.finish()}\n{json.dumps(result, ensure_ascii=False)}")
@@ -1,48 +1,102 @@
-
-import os
+import asyncio
 import base64
+import hashlib
+import mimetypes
+import os
 from pathlib import Path
-from openai import OpenAI
+from typing import Dict, List, Union
 
-client = OpenAI(
-    api_key=os.getenv("API_KEY"),
-    base_url=os.getenv("BASE_URL")
+from cache import TieredCache
+from model import HTTP_CLIENTS, config
+
+RECOGNIZE_CONFIG = config.get("tools", {}).get("recognize_picture", {})
+VISION_MODEL = "gpt-4o"
+DESCRIBE_PROMPT = "请描述这张图片的内容，并尽可能提取出图中文字。"
+# 按图片内容哈希缓存识别结果，磁盘缓存使得先前运行中识别过的图片也能直接返回
+_description_cache = TieredCache(
+    maxsize=RECOGNIZE_CONFIG.get("cache_size", 256),
+    disk_path=RECOGNIZE_CONFIG.get("cache_dir") or None,
 )
+_inflight: Dict[tuple, asyncio.Future] = {}
+
+TOOL_GROUP = "vision"
+# 只读取图片、不改变外部状态的工具，同一回复中的多个只读工具调用会并发执行
+READ_ONLY_TOOLS = {"gpt4o_describe_image"}
+
+
+def _read_image(image_path: str) -> tuple[bytes, str]:
+    image_bytes = Path(image_path).read_bytes()
+    mime = mimetypes.guess_type(image_path)[0] or "image/jpeg"
+    return image_bytes, mime
+
+
+async def _request_description(key: tuple, image_bytes: bytes, mime: str, semaphore: asyncio.Semaphore) -> str:
+    base64_image = base64.b64encode(image_bytes).decode("utf-8")
+    client = HTTP_CLIENTS.get_openai_client(os.getenv("BASE_URL"), os.getenv("API_KEY"))
+    async with semaphore:
+        response = await client.chat.completions.create(
+            model=VISION_MODEL,
+            messages=[
+                {"role": "user", "content": [
+                    {"type": "text", "text": DESCRIBE_PROMPT},
+                    {
+                        "type": "image_url",
+                        "image_url": {
+                            "url": f"data:{mime};base64,{base64_image}"
+                        }
+                    }
+                ]}
+            ],
+            temperature=0.2,
+            max_tokens=1024
+        )
+
+    result = response.choices[0].message.content
+    if result:
+        _description_cache.set(key, result)
+    return result
+
+
+async def _describe_one(image_path: str, semaphore: asyncio.Semaphore) -> str:
+    try:
+        image_bytes, mime = await asyncio.to_thread(_read_image, image_path)
+    except OSError as e:
+        return f"读取图片失败：{e}"
+
+    key = (hashlib.sha256(image_bytes).hexdigest(), VISION_MODEL, DESCRIBE_PROMPT)
+    cached = _description_cache.get(key)
+    if cached is not None:
+        return cached
+
+    # 内容相同的图片正在识别时，等待同一个请求的结果
+    if key not in _inflight:
+        _inflight[key] = asyncio.ensure_future(_request_description(key, image_bytes, mime, semaphore))
+        _inflight[key].add_done_callback(lambda _: _inflight.pop(key, None))
+    return await asyncio.shield(_inflight[key])
+
 
 async def gpt4o_describe_image(
-    image_path: str
+    image_path: Union[str, List[str]]
 ):
     """
-    使用 GPT-4o 对图像进行识别与理解。
+    使用 GPT-4o 对图像进行识别与理解，可以一次识别多张图像（并发识别），识别过的相同图像会直接返回先前的结果。
 
     Args:
-        image_path: 本地图像路径
+        image_path: 本地图像路径，或本地图像路径的列表
     """
-    image_bytes = Path(image_path).read_bytes()
-    base64_image = base64.b64encode(image_bytes).decode("utf-8")
+    image_paths = [image_path] if isinstance(image_path, str) else list(image_path)
+    semaphore = asyncio.Semaphore(RECOGNIZE_CONFIG.get("max_concurrency", 4))
+    results = await asyncio.gather(*(_describe_one(path, semaphore) for path in image_paths))
 
-    response = client.chat.completions.create(
-        model="gpt-4o",
-        messages=[
-            {"role": "user", "content": [
-                {"type": "text", "text": "请描述这张图片的内容，并尽可能提取出图中文字。"},
-                {
-                    "type": "image_url",
-                    "image_url": {
-                        "url": f"data:image/jpeg;base64,{base64_image}"
-                    }
-                }
-            ]}
-        ],
-        temperature=0.2,
-        max_tokens=1024
-    )
-
-    result = response.choices[0].message.content
+    if isinstance(image_path, str):
+        result = results[0]
+    else:
+        result = "\n\n".join(f"图片{i + 1}（{path}）：\n{description}"
+                             for i, (path, description) in enumerate(zip(image_paths, results)))
 
     yield {
         "data": {
             "stream_chunk": result
         },
         "instruction": ""
-    }
\ No newline at end of file
+    }
@@ -3,20 +3,32 @@ import json
 import traceback
 from typing import Dict, Any
 
+from browser_state import BROWSER_INFO_BEGIN, BROWSER_INFO_END
+
+# 每一步都会对历史记录和模型回复执行，预先编译
+BROWSER_INFO_PATTERN = re.compile(
+    r"============== BROWSER INFO BEGIN ==============(.*?)============== BROWSER INFO END ==============",
+    re.DOTALL | re.IGNORECASE
+)
+BROWSER_INFO_REPLACEMENT = "[history browser info removed for brevity]"
+JSON_CODEBLOCK_PATTERN = re.compile(r"```json\s*\n(.*?)\n```", re.DOTALL | re.IGNORECASE)
+
 
 def remove_browser_info_in_the_history(text: str) -> str:
-    pattern = re.compile(
-        r"============== BROWSER INFO BEGIN ==============(.*?)============== BROWSER INFO END ==============",
-        re.DOTALL | re.IGNORECASE
-    )
-    return pattern.sub(r"[history browser info removed for brevity]", text)
+    # wrap_browser_info写入的标记用str.find直接定位，比正则的逐字符惰性匹配快得多；大小写不同的标记仍由正则处理
+    parts, start = [], 0
+    while (begin := text.find(BROWSER_INFO_BEGIN, start)) != -1:
+        end = text.find(BROWSER_INFO_END, begin + len(BROWSER_INFO_BEGIN))
+        if end == -1:
+            break
+        parts += [text[start:begin], BROWSER_INFO_REPLACEMENT]
+        start = end + len(BROWSER_INFO_END)
+    if parts:
+        text = "".join(parts) + text[start:]
+    return BROWSER_INFO_PATTERN.sub(BROWSER_INFO_REPLACEMENT, text)
 
 def extract_json_codeblock(md_text: str) -> Dict[str, Any]:
-    match = re.search(
-        r"```json\s*\n(.*?)\n```",
-        md_text,
-        re.DOTALL | re.IGNORECASE
-    )
+    match = JSON_CODEBLOCK_PATTERN.search(md_text)
     if not match:
         print("Error: can't found json block, return empty dict")
         return {}